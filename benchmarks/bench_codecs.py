@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+''' Benchmark of the PING_DATA_COMPACT codecs (src/pingcodecs.py). For each codec, reports the bytes per ping and the
+encode time per ping over several sweeps of synthetic pings, and checks that the reference decoder
+(utils/decode_ping_compact.py) reproduces the pings.
+
+Usage: python3 bench_codecs.py [--samples N] [--sweeps N] [--codec CODEC ...]
+'''
+
+import math
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+from types import SimpleNamespace
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'utils'))
+from pingcodecs import PingDataEncoder
+from decode_ping_compact import PingCompactDecoder
+
+CODECS = ['', 'bin2', 'bin4', '4bit', 'delta', 'rle', 'zlib', '4bit,rle', '4bit,delta,rle', '4bit,delta,zlib',
+          'bin2,4bit,delta,zlib']
+DEVICE_DATA_SIZE = 22  # device_data message header, payload fields & checksum, without the samples
+
+
+def synthetic_pings(num_samples, num_sweeps, start_angle=0, stop_angle=399, noise=3, seed=0):
+    ''' Returns pings sweeping back & forth across a sector. Each angle has a fixed profile of range decay and a few
+    targets, plus per ping noise, as a stand-in for a static scene. '''
+    rng = random.Random(seed)
+    profiles = {}
+    for angle in range(start_angle, stop_angle + 1):
+        profile = [200 * math.exp(-sample / (num_samples / 8)) for sample in range(num_samples)]
+        for _ in range(rng.randrange(3)):
+            target = rng.randrange(num_samples - 20)
+            for sample in range(target, target + 20):
+                profile[sample] += 120
+        profiles[angle] = profile
+
+    pings = []
+    angles = list(range(start_angle, stop_angle + 1))
+    for sweep in range(num_sweeps):
+        for angle in (angles if sweep % 2 == 0 else reversed(angles)):
+            data = bytes(max(0, min(255, int(value + rng.uniform(-noise, noise)))) for value in profiles[angle])
+            pings.append(SimpleNamespace(angle=angle, gain_setting=1, transmit_duration=80, sample_period=80,
+                                         transmit_frequency=750, number_of_samples=num_samples, data=data))
+    return pings
+
+
+def run(num_samples=1200, num_sweeps=4, codecs=CODECS):
+    ''' Returns a dict of {codec: {bytes_per_ping, encode_usec_per_ping, ratio}} '''
+    pings = synthetic_pings(num_samples, num_sweeps)
+    raw_bytes = DEVICE_DATA_SIZE + num_samples
+    results = {}
+    for codec in codecs:
+        encoder = PingDataEncoder(codec)
+        start = time.perf_counter()
+        messages = [encoder.encode(ping) for ping in pings]
+        elapsed = time.perf_counter() - start
+
+        decoder = PingCompactDecoder()
+        for ping, message in zip(pings, messages):
+            decoded = decoder.decode(message)
+            assert decoded is not None and decoded.angle == ping.angle, 'Codec {0} failed to decode'.format(codec)
+
+        bytes_per_ping = sum(len(message) for message in messages) / len(messages)
+        results[codec or 'none'] = {
+            'bytes_per_ping': bytes_per_ping,
+            'encode_usec_per_ping': elapsed / len(pings) * 1e6,
+            'ratio': raw_bytes / bytes_per_ping,
+        }
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--samples', type=int, default=1200, help='Number of samples per ping')
+    parser.add_argument('--sweeps', type=int, default=4, help='Number of full revolution sweeps')
+    parser.add_argument('--codec', action='append', help='Codec to benchmark, may be repeated (default: all)')
+    args = parser.parse_args()
+
+    results = run(args.samples, args.sweeps, args.codec or CODECS)
+    print('Raw device_data: {0} bytes/ping'.format(DEVICE_DATA_SIZE + args.samples))
+    print('{0:24} {1:>12} {2:>12} {3:>8}'.format('Codec', 'bytes/ping', 'usec/ping', 'ratio'))
+    for codec, result in results.items():
+        print('{0:24} {1:12.1f} {2:12.1f} {3:8.2f}'.format(codec, result['bytes_per_ping'],
+                                                              result['encode_usec_per_ping'], result['ratio']))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+''' Micro-benchmark of Ping360Logger record encoding & writing. Compares the current logger against the previous
+per-field encoder (one struct compile and one file write per field), and checks that both produce identical files.
+
+Usage: python3 bench_logger.py [--records N] [--samples N] [--repeat N]
+'''
+
+import os
+import struct
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from ping360logger import Ping360Logger
+
+TIMESTAMP = '12:34:56.789'
+
+
+class LegacyPing360Logger(Ping360Logger):
+    ''' The per-field encoder used before records were assembled in a single buffer '''
+
+    # Log files were opened with the default write buffer size
+    FILE_BUFFER_SIZE = -1
+
+    def pack_int(self, data: int):
+        data_format = '>1i'
+        packed_data = struct.Struct(data_format).pack(data)
+        self.file_write(packed_data)
+
+    def pack_array(self, array: bytearray):
+        self.pack_int(len(array))
+        self.file_write(array)
+
+    def pack_string(self, text: str):
+        encoding = 'UTF-16-BE'
+        encoded_text = text.encode(encoding)
+        self.pack_int(len(encoded_text.decode()))
+        self.file_write(encoded_text)
+
+    def pack_header(self):
+        self.pack_string(self.header.string)
+        self.pack_int(self.header.version)
+
+        self.pack_string(self.header.ping_viewer_build_info.hash_commit)
+        self.pack_string(self.header.ping_viewer_build_info.date)
+        self.pack_string(self.header.ping_viewer_build_info.tag)
+        self.pack_string(self.header.ping_viewer_build_info.os_name)
+        self.pack_string(self.header.ping_viewer_build_info.os_version)
+
+        self.pack_int(self.header.sensor.family)
+        self.pack_int(self.header.sensor.type_sensor)
+
+    def write_record(self, timestamp, msg_data):
+        self.pack_string(timestamp)
+        self.pack_array(msg_data)
+
+
+def write_log(logger_class, dir, num_records, msg_data):
+    ''' Writes num_records records, returns (records/sec, file name) '''
+    logger = logger_class()
+    file_name = os.path.join(dir, logger_class.__name__ + '.bin')
+    logger.file = open(file_name, 'wb', buffering=logger_class.FILE_BUFFER_SIZE)
+    logger.pack_header()
+
+    start = time.perf_counter()
+    for _ in range(num_records):
+        logger.write_record(TIMESTAMP, msg_data)
+    logger.close_log_file()
+    elapsed = time.perf_counter() - start
+
+    return num_records / elapsed, file_name
+
+
+def run(num_records=20000, num_samples=1200, repeat=5):
+    ''' Returns a dict of the best records/sec over 'repeat' runs for the legacy and current encoders '''
+    msg_data = bytes(range(256)) * (num_samples // 256 + 1)
+    msg_data = msg_data[:num_samples + 22] # device_data header + payload + checksum
+
+    with tempfile.TemporaryDirectory() as dir:
+        legacy_rate = rate = 0
+        for _ in range(repeat):
+            legacy_result, legacy_file = write_log(LegacyPing360Logger, dir, num_records, msg_data)
+            result, file_name = write_log(Ping360Logger, dir, num_records, msg_data)
+            legacy_rate = max(legacy_rate, legacy_result)
+            rate = max(rate, result)
+
+        with open(legacy_file, 'rb') as legacy, open(file_name, 'rb') as current:
+            assert legacy.read() == current.read(), 'Logger output differs from the legacy encoder'
+
+    record_size = Ping360Logger.RECORD_PREFIX.size + len(msg_data)
+    return {'legacy_records_per_sec': legacy_rate, 'records_per_sec': rate, 'speedup': rate / legacy_rate,
+            'mb_per_sec': rate * record_size / 1e6}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=20000, help='Number of records to write')
+    parser.add_argument('--samples', type=int, default=1200, help='Number of samples per ping')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the best run is reported')
+    args = parser.parse_args()
+
+    result = run(args.records, args.samples, args.repeat)
+    print('Legacy encoder:  {0:10.0f} records/sec'.format(result['legacy_records_per_sec']))
+    print('Current encoder: {0:10.0f} records/sec'.format(result['records_per_sec']))
+    print('Speedup:         {0:10.2f}x'.format(result['speedup']))
+    print('Current encoder: {0:10.1f} MB/s'.format(result['mb_per_sec']))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+''' Benchmark of parallel log decoding. Decodes a generated log, split into chunks, with an increasing number of
+worker processes and reports messages/sec and the speedup over a single worker.
+
+Usage: python3 bench_parallel_decode.py [--messages N] [--samples N] [--max-workers N]
+'''
+
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'utils'))
+from bench_reader import write_test_log
+from parallel_decode import decode_parallel
+
+
+def run(num_messages=40000, num_samples=1200, max_workers=None, file_name=None):
+    ''' Returns a dict of {workers: messages/sec} for 1, 2, 4 ... max_workers (default: the number of cores) '''
+    max_workers = max_workers or os.cpu_count()
+    with tempfile.TemporaryDirectory() as dir:
+        if file_name is None:
+            file_name = os.path.join(dir, 'bench_parallel_decode.bin')
+            write_test_log(file_name, num_messages, num_samples)
+
+        # Enough chunks for every worker to have several
+        chunk_size = max(1, os.path.getsize(file_name) // (4 * max_workers))
+
+        result = {}
+        workers = 1
+        while True:
+            start = time.perf_counter()
+            count = sum(1 for _ in decode_parallel([file_name], workers, chunk_size))
+            result[workers] = count / (time.perf_counter() - start)
+            if workers >= max_workers:
+                break
+            workers = min(2 * workers, max_workers)
+    return result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--file', help='Decode this log instead of a generated one')
+    parser.add_argument('--messages', type=int, default=40000, help='Number of messages in the generated log')
+    parser.add_argument('--samples', type=int, default=1200, help='Number of samples per ping')
+    parser.add_argument('--max-workers', type=int, default=None, help='Default: the number of cores')
+    args = parser.parse_args()
+
+    result = run(args.messages, args.samples, args.max_workers, args.file)
+    for workers, rate in result.items():
+        print('{0:3d} workers: {1:10.0f} messages/sec ({2:5.2f}x)'.format(workers, rate, rate / result[1]))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+''' End-to-end benchmark of the iPing360Device ping loop. Runs the app against utils/ping360_emulator.py (in a
+separate process) with a mock MOOS comms object, and for each scan mode reports pings/sec, percentiles of the
+interval between PING_DATA publications, and of the latency from commanding a ping to publishing its data (per ping
+scan modes only). Also includes a micro-benchmark of calc_next_transmit_angle().
+
+Usage: python3 bench_ping_loop.py [--duration SECONDS] [--latency-ms MS] [--jitter-ms MS] [--no-log]
+'''
+
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+import mock_moos
+sys.modules['pymoos'] = mock_moos  # the app must not connect to a real MOOSDB
+import iping360device as app
+from ping360device import Ping360Device, ScanMode, State
+from brping import PingMessage, definitions
+
+EMULATOR = os.path.join(BENCHMARKS_DIR, '..', 'utils', 'ping360_emulator.py')
+PREFIX = 'BENCH_'
+SCAN_MODE_NAMES = {mode.value: mode.name.lower() for mode in ScanMode}
+ANGLE = struct.Struct('<H')
+ANGLE_OFFSET = 10  # of the angle in device_data & auto_device_data: 8 byte header, mode, gain_setting
+
+
+def percentiles(values):
+    ''' Returns the p50, p95 & p99 of values, in milliseconds '''
+    if len(values) < 2:
+        return {}
+    cut_points = statistics.quantiles(values, n=100)
+    return {'p50_ms': cut_points[49] * 1000, 'p95_ms': cut_points[94] * 1000, 'p99_ms': cut_points[98] * 1000}
+
+
+def transmit_angle_rate(num_calls=100000):
+    ''' Returns calc_next_transmit_angle() calls/sec, sweeping the default sector '''
+    device = Ping360Device('', mock_moos.comms())
+    device.ping360_device_data = PingMessage(definitions.PING360_DEVICE_DATA)
+    device.ping360_device_data.angle = int(device.inputs['START_ANGLE_GRADS']['val'])
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        device.calc_next_transmit_angle()
+        device.ping360_device_data.angle = device.transmit_angle_grads
+    return num_calls / (time.perf_counter() - start)
+
+
+def start_emulator(latency_ms, jitter_ms):
+    ''' Starts the emulator on a free port, returns (process, port) once it is listening '''
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    emulator = subprocess.Popen([sys.executable, EMULATOR, '--host', '127.0.0.1', '--port', str(port),
+                                 '--latency-ms', str(latency_ms), '--jitter-ms', str(jitter_ms)],
+                                stdout=subprocess.PIPE, text=True)
+    emulator.stdout.readline()  # listening
+    return emulator, port
+
+
+async def wait_for_state(device, state, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while device.outputs['STATE'] != state.name:
+        if time.perf_counter() > deadline:
+            raise TimeoutError('Device did not reach {0}, last error: {1}'.format(state.name,
+                                                                                  device.outputs['LAST_ERROR']))
+        await asyncio.sleep(0.01)
+
+
+async def drive(port, duration, scan_modes, log_dir, settle_time=0.5):
+    comms = app.g_comms
+    device = Ping360Device('', comms)
+    device.port_type = 'udp'
+    device.sonar_ip = '127.0.0.1'
+    device.udp_port = port
+    device.prefix = PREFIX
+    device.log_file_dir = log_dir
+    app.g_devices = [device]
+    app.g_mail_routes = {msg_name: device for msg_name in device.input_names()}
+
+    comms.watch(PREFIX + 'PING_DATA')
+    command_times = {}  # angle -> time the ping was commanded
+    send_transducer_command = device.send_transducer_command
+
+    def timed_send_transducer_command(transmit_angle_grads):
+        command_times[int(transmit_angle_grads)] = time.perf_counter()
+        send_transducer_command(transmit_angle_grads)
+
+    # The device runs in the benchmark's event loop, rather than in a worker thread
+    device.send_transducer_command = timed_send_transducer_command
+    device_task = asyncio.ensure_future(device.run())
+    results = {}
+    try:
+        await asyncio.sleep(0)
+        app.connect_to_db()
+        await wait_for_state(device, State.DB_CONNECTED)
+        comms.post(PREFIX + 'DEVICE_COMMS_ENABLE', 1)
+        comms.post(PREFIX + 'LOG_ENABLE', 1 if log_dir else 0)
+        await wait_for_state(device, State.READY_TO_TRANSMIT)
+
+        for scan_mode in scan_modes:
+            comms.post(PREFIX + 'SCAN_MODE', scan_mode)
+            comms.post(PREFIX + 'TRANSMIT_ENABLE', 1)
+            await asyncio.sleep(settle_time)
+            comms.clear()
+            await asyncio.sleep(duration)
+
+            pings = list(comms.watched[PREFIX + 'PING_DATA'])
+            intervals = [b[0] - a[0] for a, b in zip(pings, pings[1:])]
+            latencies = []
+            if scan_mode != ScanMode.AUTO_TRANSMIT.value:
+                for publish_time, ping_data in pings:
+                    command_time = command_times.get(ANGLE.unpack_from(ping_data, ANGLE_OFFSET)[0])
+                    if command_time is not None and command_time <= publish_time:
+                        latencies.append(publish_time - command_time)
+
+            results[SCAN_MODE_NAMES[scan_mode]] = {
+                'pings_per_sec': len(pings) / duration,
+                'interval': percentiles(intervals),
+                'latency': percentiles(latencies),
+                'errors': comms.notification_counts[PREFIX + 'LAST_ERROR'],
+            }
+        comms.post(PREFIX + 'TRANSMIT_ENABLE', 0)
+        comms.post(PREFIX + 'LOG_ENABLE', 0)
+        await asyncio.sleep(0.1)
+    finally:
+        device_task.cancel()
+    return results
+
+
+def run(duration=5.0, scan_modes=(0, 1, 2), latency_ms=1.0, jitter_ms=0.5, log=True):
+    ''' Returns a dict of results per scan mode, and of calc_next_transmit_angle() calls/sec '''
+    result = {'calc_next_transmit_angle_per_sec': transmit_angle_rate()}
+    emulator, port = start_emulator(latency_ms, jitter_ms)
+    try:
+        # The app's status printing is discarded
+        with tempfile.TemporaryDirectory() as log_dir, contextlib.redirect_stdout(io.StringIO()):
+            result.update(asyncio.run(drive(port, duration, scan_modes, log_dir if log else None)))
+    finally:
+        emulator.terminate()
+        emulator.wait()
+    return result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=float, default=5.0, help='Measurement time per scan mode [s]')
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='Emulated link latency [ms]')
+    parser.add_argument('--jitter-ms', type=float, default=0.5, help='Emulated link jitter [ms]')
+    parser.add_argument('--no-log', action='store_true', help='Run with logging disabled')
+    args = parser.parse_args()
+
+    result = run(args.duration, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, log=not args.no_log)
+    print('calc_next_transmit_angle: {0:10.0f} calls/sec'.format(result.pop('calc_next_transmit_angle_per_sec')))
+    for mode, mode_result in result.items():
+        print('{0:14s} {1:6.1f} pings/sec, interval {2}, latency {3}, errors {4}'.format(
+            mode, mode_result['pings_per_sec'],
+            ' '.join('{0} {1:.1f}'.format(key, value) for key, value in mode_result['interval'].items()),
+            ' '.join('{0} {1:.1f}'.format(key, value) for key, value in mode_result['latency'].items()),
+            mode_result['errors']))
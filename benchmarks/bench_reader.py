@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+''' Micro-benchmark of PingViewerLogReader decoding. Generates a log of device_data messages and reports
+messages/sec for the previous byte-at-a-time PingParser loop, parser() and frames(), with and without mmap.
+
+Usage: python3 bench_reader.py [--messages N] [--samples N]
+'''
+
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'utils'))
+from brping import PingMessage, PingParser, definitions
+from decode_sensor_binary import PingViewerLogReader
+from ping360logger import Ping360Logger
+
+
+def write_test_log(file_name, num_messages, num_samples):
+    ''' Writes a log of device_data messages sweeping the full circle '''
+    logger = Ping360Logger()
+    logger.file = open(file_name, 'wb', buffering=Ping360Logger.FILE_BUFFER_SIZE)
+    logger.pack_header()
+
+    for index in range(num_messages):
+        message = PingMessage(definitions.PING360_DEVICE_DATA)
+        message.mode = 1
+        message.angle = index % 400
+        message.number_of_samples = num_samples
+        message.data = bytearray((index + sample) % 256 for sample in range(num_samples))
+        timestamp = '{0:02d}:{1:02d}:{2:02d}.{3:03d}'.format(index // 3600000 % 24, index // 60000 % 60,
+                                                             index // 1000 % 60, index % 1000)
+        logger.write_record(timestamp, message.pack_msg_data())
+    logger.close_log_file()
+
+
+def legacy_parser(log, message_ids={1300, 2300, 2301}):
+    ''' The byte-at-a-time parser used before PingFrame '''
+    parser = PingParser()
+    for (timestamp, message) in log:
+        for byte in message:
+            if parser.parse_byte(byte) == parser.NEW_MESSAGE:
+                decoded_message = parser.rx_msg
+                if decoded_message.message_id in message_ids:
+                    yield timestamp, decoded_message
+                    break
+
+
+def messages_per_sec(messages):
+    start = time.perf_counter()
+    count = sum(1 for _ in messages)
+    return count / (time.perf_counter() - start)
+
+
+def run(file_name=None, num_messages=4000, num_samples=1200):
+    ''' Returns a dict of messages/sec for each decoding path. Uses the log 'file_name' if given, otherwise
+    generates one. '''
+    with tempfile.TemporaryDirectory() as dir:
+        if file_name is None:
+            file_name = os.path.join(dir, 'bench_reader.bin')
+            write_test_log(file_name, num_messages, num_samples)
+
+        result = {
+            'legacy_parser': messages_per_sec(legacy_parser(PingViewerLogReader(file_name))),
+            'parser': messages_per_sec(PingViewerLogReader(file_name).parser()),
+            'parser_mmap': messages_per_sec(PingViewerLogReader(file_name, use_mmap=True).parser()),
+            'frames': messages_per_sec(PingViewerLogReader(file_name).frames()),
+            'frames_mmap': messages_per_sec(PingViewerLogReader(file_name, use_mmap=True).frames()),
+        }
+    return result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--file', help='Decode this log instead of a generated one')
+    parser.add_argument('--messages', type=int, default=4000, help='Number of messages in the generated log')
+    parser.add_argument('--samples', type=int, default=1200, help='Number of samples per ping')
+    args = parser.parse_args()
+
+    result = run(args.file, args.messages, args.samples)
+    for name, rate in result.items():
+        print('{0:15s} {1:10.0f} messages/sec ({2:6.1f}x)'.format(name, rate, rate / result['legacy_parser']))
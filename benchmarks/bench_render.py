@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+''' Benchmark of sector image rendering. Compares frames/sec of the cached remap table renderer
+(sonar_render.render_sector) against the previous path of copying & rotating the sector matrix and calling
+cv.warpPolar (only if OpenCV is installed).
+
+Usage: python3 bench_render.py [--samples N] [--size N] [--frames N]
+'''
+
+import copy
+import os
+import sys
+import time
+from argparse import ArgumentParser
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'utils'))
+from sonar_render import render_sector
+
+try:
+    import cv2 as cv
+except ImportError:
+    cv = None
+
+
+def legacy_render(sector_intensities, size):
+    ''' The rendering previously done by visualize_sonar_data.py, with the output size as a parameter '''
+    sector_intensities = sector_intensities.copy()  # the previous code rotated the matrix in place
+    sector_intensities_copy = copy.deepcopy(sector_intensities)
+    sector_intensities[0:100] = sector_intensities_copy[300:400]
+    sector_intensities[100:400] = sector_intensities_copy[0:300]
+
+    radius = size // 2
+    warp_flags = cv.WARP_INVERSE_MAP + cv.WARP_POLAR_LINEAR + cv.WARP_FILL_OUTLIERS + cv.INTER_LINEAR
+    return cv.warpPolar(sector_intensities, center=(radius, radius), maxRadius=radius,
+                        dsize=(2 * radius, 2 * radius), flags=warp_flags)
+
+
+def frames_per_sec(render, sweeps):
+    start = time.perf_counter()
+    for sweep in sweeps:
+        render(sweep)
+    return len(sweeps) / (time.perf_counter() - start)
+
+
+def run(num_samples=1200, size=800, num_frames=50):
+    ''' Returns a dict of frames/sec for each rendering path '''
+    rng = np.random.default_rng(0)
+    sweeps = [rng.integers(0, 256, (400, num_samples), dtype=np.uint8) for _ in range(4)]
+    sweeps = (sweeps * (num_frames // len(sweeps) + 1))[:num_frames]
+
+    out = np.empty((size, size), dtype=np.uint8)
+    render_sector(sweeps[0], size, out=out)  # build the cached table outside the timed loop
+
+    result = {'render_sector': frames_per_sec(lambda sweep: render_sector(sweep, size, out=out), sweeps)}
+    if cv is not None:
+        result['legacy_warp_polar'] = frames_per_sec(lambda sweep: legacy_render(sweep, size), sweeps)
+    return result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--samples', type=int, default=1200, help='Number of samples per ping')
+    parser.add_argument('--size', type=int, default=800, help='Output image width & height [pixels]')
+    parser.add_argument('--frames', type=int, default=50, help='Number of frames to render')
+    args = parser.parse_args()
+
+    result = run(args.samples, args.size, args.frames)
+    for name, rate in result.items():
+        print('{0:20s} {1:8.1f} frames/sec'.format(name, rate))
+    if cv is None:
+        print('OpenCV is not installed, the previous cv.warpPolar path was not measured')
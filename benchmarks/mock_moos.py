@@ -0,0 +1,93 @@
+''' Stand-in for the pymoos module, so that iPing360Device can be benchmarked without a MOOSDB. Install it before
+importing the app:
+
+    sys.modules['pymoos'] = mock_moos
+
+The comms object connects immediately, delivers mail posted with post(), and records the time of every notification
+of the variables passed to watch().
+'''
+
+import threading
+import time as _time
+from collections import defaultdict
+
+
+def time():
+    return _time.time()
+
+
+class message():
+    ''' A MOOS message, with the subset of the pymoos message interface used by the app '''
+
+    def __init__(self, name, value, msg_time=None):
+        self._name = name
+        self._value = value
+        self._time = msg_time if msg_time is not None else time()
+
+    def name(self):
+        return self._name
+
+    def double(self):
+        return float(self._value)
+
+    def string(self):
+        return str(self._value)
+
+    def is_double(self):
+        return not isinstance(self._value, (str, bytes))
+
+    def time(self):
+        return self._time
+
+
+class comms():
+    def __init__(self):
+        self.on_connect = None
+        self.on_mail = None
+        self.mail = []
+        self.lock = threading.Lock()
+        self.registered = set()
+        self.watched = {}  # name -> list of (perf_counter time, value)
+        self.notification_counts = defaultdict(int)
+
+    def set_on_connect_callback(self, callback):
+        self.on_connect = callback
+
+    def set_on_mail_callback(self, callback):
+        self.on_mail = callback
+
+    def run(self, host, port, name):
+        # pymoos calls on_connect from its own thread once connected
+        threading.Thread(target=self.on_connect, daemon=True).start()
+        return True
+
+    def register(self, name, interval):
+        self.registered.add(name)
+        return True
+
+    def notify(self, name, value, msg_time):
+        self.notification_counts[name] += 1
+        if name in self.watched:
+            self.watched[name].append((_time.perf_counter(), value))
+        return True
+
+    notify_binary = notify
+
+    def fetch(self):
+        with self.lock:
+            mail, self.mail = self.mail, []
+        return mail
+
+    def post(self, name, value):
+        ''' Delivers mail to the app, as if another MOOS app had published it '''
+        with self.lock:
+            self.mail.append(message(name, value))
+        self.on_mail()
+
+    def watch(self, name):
+        self.watched.setdefault(name, [])
+
+    def clear(self):
+        for notifications in self.watched.values():
+            notifications.clear()
+        self.notification_counts.clear()
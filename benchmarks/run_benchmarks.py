@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+''' Runs the benchmark suite and saves the results as JSON, optionally comparing them with a previous run:
+    logger      Ping360Logger records/sec and MB/s (bench_logger.py)
+    reader      PingViewerLogReader decode messages/sec (bench_reader.py)
+    render      sector rendering frames/sec (bench_render.py, needs NumPy)
+    codecs      PING_DATA_COMPACT bytes/ping & encode time (bench_codecs.py)
+    ping_loop   calc_next_transmit_angle() calls/sec, and end-to-end pings/sec & latency percentiles for each scan
+                mode against the Ping360 emulator (bench_ping_loop.py)
+
+Usage: python3 run_benchmarks.py [--output FILE] [--compare FILE] [--only NAME ...] [--quick]
+'''
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+
+def run_logger(quick):
+    import bench_logger
+    return bench_logger.run(num_records=2000 if quick else 20000, repeat=2 if quick else 5)
+
+
+def run_reader(quick):
+    import bench_reader
+    return bench_reader.run(num_messages=1000 if quick else 4000)
+
+
+def run_render(quick):
+    import bench_render
+    return bench_render.run(num_frames=10 if quick else 50)
+
+
+def run_codecs(quick):
+    import bench_codecs
+    return bench_codecs.run(num_sweeps=1 if quick else 4)
+
+
+def run_ping_loop(quick):
+    import bench_ping_loop
+    return bench_ping_loop.run(duration=1.0 if quick else 5.0)
+
+
+BENCHMARKS = {
+    'logger': run_logger,
+    'reader': run_reader,
+    'render': run_render,
+    'codecs': run_codecs,
+    'ping_loop': run_ping_loop,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    ''' Yields (dotted name, value) for each number in nested result dicts '''
+    for key, value in results.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            yield from flatten(value, name + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(previous, current):
+    ''' Prints each result with its change from the previous run '''
+    previous_values = dict(flatten(previous['results']))
+    print('Compared with {0} ({1}):'.format(previous.get('git_commit'), previous.get('created')))
+    for name, value in flatten(current['results']):
+        old = previous_values.get(name)
+        change = '{0:+8.1f}%'.format(100 * (value - old) / old) if old else '        '
+        print('{0:60s} {1:14.2f} {2}'.format(name, value, change))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    parser.add_argument('--only', action='append', choices=BENCHMARKS.keys(), help='Benchmark to run, may be repeated')
+    parser.add_argument('--quick', action='store_true', help='Smaller runs, for checking that the suite works')
+    args = parser.parse_args()
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'quick': args.quick,
+        'results': {},
+        'errors': {},
+    }
+    for name in args.only or BENCHMARKS:
+        print('Running {0}...'.format(name), file=sys.stderr)
+        start = time.perf_counter()
+        try:
+            report['results'][name] = BENCHMARKS[name](args.quick)
+        except ImportError as e:  # e.g. NumPy is not installed
+            report['errors'][name] = str(e)
+            print('Skipped {0}: {1}'.format(name, e), file=sys.stderr)
+        print('{0} took {1:.1f} s'.format(name, time.perf_counter() - start), file=sys.stderr)
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print('Results written to {0}'.format(args.output), file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+    else:
+        for name, value in flatten(report['results']):
+            print('{0:60s} {1:14.2f}'.format(name, value))
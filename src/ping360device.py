@@ -0,0 +1,1382 @@
+import pymoos
+import asyncio
+import copy
+import math
+import random
+import threading
+import time
+from datetime import datetime
+from enum import Enum
+from brping import Ping360
+from brping import PingMessage
+from brping import definitions
+from ping360logger import Ping360Logger
+from pingtransport import Ping360Transport
+from sectorimage import SectorImage
+from pingcodecs import PingDataEncoder
+from pingring import PingRing, PingRingWriter
+from pingtiming import PingTiming, PingTimeModel, HeadRouteModel
+from publishpolicy import PublishPolicy
+
+class ScanMode(Enum):
+    PER_PING = 0        # App sends a control_transducer command for every transmit angle
+    AUTO_TRANSMIT = 1   # Sonar sweeps the sector itself and streams auto_device_data messages
+    PIPELINED = 2       # Next control_transducer is sent as soon as a ping arrives, before it is published & logged
+
+class State(Enum):
+    DB_DISCONNECTED = 0
+    DB_CONNECTED = 1
+    READY_TO_TRANSMIT = 2
+    TRANSMITTING = 3
+
+# Input (subscription) variables. The prefix is added to the variable name (var)
+# at runtime when the app is configured. Variable value changes from the database
+# are only accepted if the value is within the min & max range. Each device has its own copy.
+INPUTS = {
+    'DEBUG_ENABLE' : {
+        'var': 'DEBUG_ENABLE',
+        'val': 0,
+        'min': 0,
+        'max': 1
+    },
+
+    'LOG_ENABLE' : {
+        'var': 'LOG_ENABLE',
+        'val': 0,
+        'min': 0,
+        'max': 1
+    },
+
+    'DEVICE_COMMS_ENABLE' : {
+        'var': 'DEVICE_COMMS_ENABLE',
+        'val': 0,
+        'min': 0,
+        'max': 1
+    },
+
+    # Note: Start angle is input from DB in degrees, and stored in gradians
+    'START_ANGLE_GRADS' : {
+        'var': 'START_ANGLE_GRADS',
+        'val': 350,
+        'min': 0,
+        'max': 400
+    },
+
+    # Note: Stop angle is input from DB in degrees, and stored in gradians
+    'STOP_ANGLE_GRADS' : {
+        'var': 'STOP_ANGLE_GRADS',
+        'val': 50,
+        'min': 0,
+        'max': 400
+    },
+
+    'NUM_STEPS' : {
+        'var': 'NUM_STEPS',
+        'val': 1,
+        'min': 1,
+        'max': 10
+    },
+
+    'GAIN' : { # 0: low, 1: normal, 2: high
+        'var': 'GAIN',
+        'val': 1,
+        'min': 0,
+        'max': 2
+    },
+
+    'RANGE' : {
+        'var': 'RANGE',
+        'val': 15.0,
+        'min': 0.0,
+        'max': 50.0
+    },
+
+    'SPEED_OF_SOUND' : {
+        'var': 'SPEED_OF_SOUND',
+        'val': 1500.0,
+        'min': 1450,
+        'max': 1550
+    },
+
+    'TRANSMIT_FREQUENCY' : {
+        'var': 'TRANSMIT_FREQUENCY',
+        'val': 750,
+        'min': 500,
+        'max': 1000
+    },
+
+    'NUMBER_OF_SAMPLES' : {
+        'var': 'NUMBER_OF_SAMPLES',
+        'val': 600,
+        'min': 200,
+        'max': 1200
+    },
+
+    'TRANSMIT_ENABLE' : {
+        'var': 'TRANSMIT_ENABLE',
+        'val': 0,
+        'min': 0,
+        'max': 1
+    },
+
+    'SCAN_MODE' : { # 0: per ping commands, 1: sonar auto transmit, 2: pipelined per ping commands (see ScanMode)
+        'var': 'SCAN_MODE',
+        'val': ScanMode.PER_PING.value,
+        'min': 0,
+        'max': 2
+    },
+
+    'SECTOR_IMAGE_ENABLE' : {
+        'var': 'SECTOR_IMAGE_ENABLE',
+        'val': 0,
+        'min': 0,
+        'max': 1
+    },
+
+    'SECTOR_IMAGE_RATE_HZ' : { # 0: publish when the sweep reaches the start or stop angle
+        'var': 'SECTOR_IMAGE_RATE_HZ',
+        'val': 0,
+        'min': 0,
+        'max': 10
+    },
+
+    'SECTOR_IMAGE_ANGLE_STEP' : {
+        'var': 'SECTOR_IMAGE_ANGLE_STEP',
+        'val': 1,
+        'min': 1,
+        'max': 10
+    },
+
+    'SECTOR_IMAGE_RANGE_DECIMATION' : {
+        'var': 'SECTOR_IMAGE_RANGE_DECIMATION',
+        'val': 1,
+        'min': 1,
+        'max': 16
+    },
+
+    'TIMING_ENABLE' : {
+        'var': 'TIMING_ENABLE',
+        'val': 0,
+        'min': 0,
+        'max': 1
+    },
+
+}
+
+# Inputs which change the sonar's transmit settings. In auto transmit mode the sonar must be reconfigured when any of
+# these change, as the settings are only sent once at the start of the sweep.
+SONAR_SETTING_INPUTS = ['NUM_STEPS', 'GAIN', 'RANGE', 'SPEED_OF_SOUND', 'TRANSMIT_FREQUENCY', 'NUMBER_OF_SAMPLES']
+
+# Ping360Device methods applying the changes of each input, in addition to storing its value. When a batch of mail
+# changes several inputs, each method is called once.
+INPUT_HANDLERS = {
+    'NUMBER_OF_SAMPLES': ['calculate_sample_period_and_transmit_duration', 'allocate_sector_image'],
+    'RANGE': ['calculate_sample_period_and_transmit_duration'],
+    'SPEED_OF_SOUND': ['calculate_sample_period_and_transmit_duration'],
+    'SECTOR_IMAGE_ENABLE': ['allocate_sector_image'],
+    'START_ANGLE_GRADS': ['on_scan_sector_changed'],
+    'STOP_ANGLE_GRADS': ['on_scan_sector_changed'],
+    'SCAN_MODE': ['on_scan_mode_changed'],
+    'TIMING_ENABLE': ['on_timing_enable_changed'],
+    'LOG_ENABLE': ['on_log_enable_changed'],
+}
+for input_id in SONAR_SETTING_INPUTS:
+    INPUT_HANDLERS[input_id] = INPUT_HANDLERS.get(input_id, []) + ['on_sonar_setting_changed']
+
+# Output variables & default values. Each device has its own copy.
+OUTPUTS = {
+    'PING_DATA' : bytes(bytearray()) ,
+    'SECTOR_IMAGE' : bytes(bytearray()) ,
+    'PING_DATA_COMPACT' : bytes(bytearray()) ,
+    'PING_DATA_COMPACT_BYTES' : 0,
+    'PING_DATA_ENCODE_USEC' : 0,
+    'SHM_RING' : '',
+    'PING_LATENCY_P50_MS' : 0,
+    'PING_LATENCY_P95_MS' : 0,
+    'PING_LATENCY_P99_MS' : 0,
+    'PING_STAGE_LATENCY_MS' : '',
+    'TIMING_PINGS_PER_SEC' : 0,
+    'TIMEOUT_RATE' : 0,
+    'NACK_RATE' : 0,
+    'STATE' : State.DB_DISCONNECTED.name,
+    'LAST_ERROR' : 'None',
+    'LOG_STATUS' : 'Disabled',
+    'LOG_QUEUE_DEPTH' : 0,
+    'LOG_DROPPED_RECORDS' : 0,
+    'LOG_WRITE_RATE_KBPS' : 0,
+    'TRANSMIT_ANGLE_GRADS': 0,
+    'TRANSMIT_ANGLE_DEGS': 0,
+    'SECTOR_SCAN_TIME_SEC': 0,
+    'EXPECTED_SECTOR_SCAN_TIME_SEC': 0,
+    'PING_TIMEOUT_MS': 0,
+    'PING_RATE': 0,
+    'PING_RATE_IMPROVEMENT_PCT': 0,
+    'RECONNECT_COUNT': 0,
+    'RECOVERY_TIME_SEC': 0,
+    'RECONFIGURATION_TIME_LOST_SEC': 0,
+    'SWEEP_START_SLEW_GRADS': 0,
+    'SWEEP_START_SLEW_SAVED_GRADS': 0,
+    'SWEEP_START_SLEW_SEC': 0,
+    'SUPPRESSED_NOTIFICATIONS': 0
+
+}
+
+# Outputs published with notify_binary
+BINARY_OUTPUTS = ['PING_DATA', 'SECTOR_IMAGE', 'PING_DATA_COMPACT']
+
+# [s] between checks for outputs withheld by the publication policy which are due to be published
+PUBLISH_CHECK_INTERVAL = 0.05
+
+# [s] between publications of the logging status, rather than on every logged ping
+LOG_STATUS_PERIOD = 1.0
+
+def smallest_angle_between(angle_a_grads, angle_b_grads):
+    ''' Returns the smaller of the two possible sectors between angle a & b. Result is always positive.'''
+    return min( (angle_a_grads - angle_b_grads)%400,
+                (angle_b_grads-angle_a_grads)%400 )
+
+def sector_extent_grads(sector_start_grads, sector_end_grads):
+    ''' Returns the angle swept by a clockwise rotation from the sector start angle to the sector end angle. An end
+    angle a full turn after the start angle (e.g. 0 & 400) is a full circle, and equal start & end angles are a sector
+    of a single angle. '''
+    if sector_end_grads - sector_start_grads == 400:
+        return 400
+    return (sector_end_grads - sector_start_grads)%400
+
+def angle_within(test_angle_grads, sector_start_grads, sector_end_grads):
+    ''' Returns true if the test angle lies within the sector defined by a clockwise rotation from the
+    sector start angle to the sector end angle'''
+    return (test_angle_grads - sector_start_grads)%400 <= sector_extent_grads(sector_start_grads, sector_end_grads)
+
+def next_transmit_angle(head_angle_grads, clockwise, start_angle_grads, stop_angle_grads, num_steps_grads):
+    ''' Returns the (transmit angle, clockwise) pair for the ping following one at head_angle_grads. The direction
+    is reversed when the next step would leave the sector. '''
+    if clockwise:
+        transmit_angle_grads = (head_angle_grads + num_steps_grads)%400
+        if not angle_within(transmit_angle_grads, start_angle_grads, stop_angle_grads):
+            transmit_angle_grads -= (2*num_steps_grads) # Reverse
+            clockwise = False
+    else: # counter-clockwise
+        transmit_angle_grads = (head_angle_grads - num_steps_grads)%400
+        if not angle_within(transmit_angle_grads, start_angle_grads, stop_angle_grads):
+            transmit_angle_grads += (2*num_steps_grads) # Reverse
+            clockwise = True
+    transmit_angle_grads = transmit_angle_grads%400
+
+    # In a sector narrower than a step (e.g. start angle = stop angle), the ping is at the edge being headed for
+    if not angle_within(transmit_angle_grads, start_angle_grads, stop_angle_grads):
+        transmit_angle_grads = (stop_angle_grads if clockwise else start_angle_grads)%400
+
+    return transmit_angle_grads, clockwise
+
+def nearer_sector_edge(head_angle_grads, start_angle_grads, stop_angle_grads, travel_grads):
+    ''' Returns the (transmit angle, clockwise) pair starting a sweep at the sector edge the head reaches first,
+    heading into the sector. travel_grads(from, to) returns the gradians the head moves between two angles, e.g.
+    HeadRouteModel.travel_grads(). '''
+    start_angle_grads, stop_angle_grads = start_angle_grads%400, stop_angle_grads%400
+    if travel_grads(head_angle_grads, start_angle_grads) <= travel_grads(head_angle_grads, stop_angle_grads):
+        return start_angle_grads, True
+    return stop_angle_grads, False
+
+def get_msg_time_str( msg ):
+    timestamp = msg.time()
+    date_time = datetime.fromtimestamp(timestamp)
+    return date_time.strftime('%c')
+
+
+class Ping360Device():
+    ''' A Ping360 sonar: its connection, inputs & outputs, logger and state machine. The state machine runs in an
+    asyncio event loop on the device's own worker thread (see start()), so that several devices ping in parallel.
+    The MOOS comms are shared between devices; the app routes each device's mail to post_mail(). '''
+
+    def __init__(self, name, comms):
+        self.name = name # Name of the Ping360.ini device section, '' for the [parameters] section
+        self.comms = comms
+
+        # Default parameter values
+        self.port_type    = ''
+        self.sonar_ip     = "192.168.0.100"
+        self.udp_port     = 12345
+        self.serial_port  = '/dev/ttyS0'
+        self.baudrate     = 115200
+        self.prefix       = ''
+        self.log_file_dir = './'
+        self.log_async    = False
+        self.log_queue_size = 1000
+        self.log_queue_full_policy = 'block'
+        self.log_flush_records = 0
+        self.log_flush_interval_ms = 0
+        self.log_fsync_on_sector = False
+        self.ping_data_codec = '' # PING_DATA_COMPACT codec stages (see PingDataEncoder), empty to disable
+        self.ping_data_key_interval = 10
+        self.shm_ring_name = '' # Shared memory ring buffer of pings (see PingRing), empty to disable
+        self.shm_ring_slots = 256
+        self.timing_period_sec = 5.0 # Period of the TIMING_ENABLE statistics
+        self.head_step_ms = 1.0 # Initial estimates for the response timeout model (see PingTimeModel)
+        self.response_timeout_margin = 4.0
+        self.response_timeout_min_ms = 20
+        self.response_timeout_max_ms = 2000
+        self.reconnect_min_sec = 0.5 # Delay before the first reconnection attempt, doubled after each failure
+        self.reconnect_max_sec = 30.0
+        self.dead_link_timeouts = 3 # Consecutive timeouts after which the link is probed, and reconnected if dead
+        self.publish_on_change = 'LOG_STATUS,LOG_QUEUE_DEPTH,LOG_DROPPED_RECORDS,LOG_WRITE_RATE_KBPS' # Publication policy (see PublishPolicy)
+        self.publish_max_rate_hz = 'TRANSMIT_ANGLE_GRADS:10,TRANSMIT_ANGLE_DEGS:10,PING_DATA_COMPACT_BYTES:1,PING_DATA_ENCODE_USEC:1'
+        self.publish_refresh_sec = 5.0
+
+        self.inputs = copy.deepcopy(INPUTS)
+        self.outputs = copy.deepcopy(OUTPUTS)
+
+        self.scan_sector_changed = False
+        self.scan_mode_changed = False
+        self.sonar_setting_changed = False
+        self.ping_360 = Ping360()
+        self.transport = Ping360Transport(self.ping_360)
+        self.thread = None # Worker thread running the event loop, set in start()
+        self.ready = threading.Event() # Set once the worker's event loop is running
+        self.loop = None # asyncio event loop running the device
+        self.task = None # Task running the device in the loop
+        self.mail_handlers = {} # MOOS variable name -> (input id, handler methods), set in run()
+        self.pending_mail = {} # MOOS variable name -> last message received, until applied between pings
+        self.wakeup = None # Event set whenever the state machine should re-evaluate its state (new mail, DB connection)
+        self.transmit_angle_grads = 0
+        self.clockwise = True
+        self.transmit_duration_usec = 0
+        self.firmware_min_transmit_duration = 5
+        self.firmware_max_transmit_duration = 500
+        self.sample_period_ticks = 0 # The number of timer ticks between each data point
+        self.sample_period_tick_duration = 25e-9  # Each timer tick has a duration of 25 nanoseconds
+        self.sector_scan_start_time = 0
+        self.auto_transmit_active = False # True once the sonar has been configured to sweep in auto transmit mode
+        self.auto_transmit_settings = None # Sampling & sweep settings of the last auto transmit command
+        self.ping_pending = False # True while a pipelined control_transducer command is awaiting its response
+        self.sector_ping_count = 0 # Pings received since the last sector edge, for the ping rate calculation
+        self.ping_rate_by_mode = {} # Most recent pings/sec measured in each scan mode, keyed by ScanMode value
+        self.sector_image_publish_time = 0 # Time SECTOR_IMAGE was last published, for SECTOR_IMAGE_RATE_HZ
+        self.command_start_time = 0 # PingTiming times at which the last control_transducer command started & was sent
+        self.command_sent_time = 0
+        self.command_time = 0 # Time the last control_transducer command was sent, for the response timeout model
+        self.command_angle_grads = None # Angle of the last control_transducer command, None if the head angle is unknown
+        self.command_settings = None # (sample period, number of samples) of the last control_transducer command
+        self.ping_steps_grads = 0 # Gradians the head moves for the current ping
+        self.auto_data_time = 0 # Time the last auto_device_data message was received, 0 after a timeout
+        self.reconnect_attempts = 0 # Failed connection attempts since the last ping was received
+        self.reconnect_time = 0 # Time before which the sonar is not (re)connected, while backing off
+        self.consecutive_timeouts = 0
+        self.last_ping_time = 0 # Time the last ping was received
+        self.link_lost_time = None # Time the last ping was received before the link was lost, until it recovers
+        self.resume_angle_grads = None # Transmit angle at which the sweep resumes after reconnecting
+        self.suppressed_publish_time = 0 # Time SUPPRESSED_NOTIFICATIONS was last published
+        self.sweep_start_pending = False # True until the first ping of a sweep planned from the head angle
+        self.sweep_start_head_angle_grads = None # Head angle reported before the sweep started, None if unknown
+        self.sweep_start_time = 0 # perf_counter() time of the sweep's first command, None until it is sent
+        self.reconfigure_time = 0 # Time the scan sector or mode last changed while transmitting, until a ping is
+                                  # received within the sector
+
+        self.ping360_device_data = PingMessage()
+        self.ping360_logger = Ping360Logger()
+        self.sector_image = SectorImage()
+        self.ping_data_encoder = None
+        self.ping_ring = None
+        self.ping_timing = PingTiming()
+        self.ping_time_model = PingTimeModel()
+        self.head_route = HeadRouteModel() # Which way round the head turns, learnt from the sweep start slews
+        self.configure_publish_policy()
+
+        # Transmit settings for the default inputs, otherwise they are only calculated once RANGE, SPEED_OF_SOUND or
+        # NUMBER_OF_SAMPLES is changed, and the first pings are commanded with a sample period of 0
+        self.calculate_sample_period_and_transmit_duration()
+
+    def configure(self, params):
+        ''' Reads in the device's parameters from its section of the Ping360.ini file '''
+
+        # Read in required parameter: port_type
+        try:
+            self.port_type = params['port_type']
+        except KeyError as e:
+            raise Exception("{0} is required but was not found".format(e))
+
+        # Read in optional parameters, use defaults if not found
+        self.sonar_ip = params.get('sonar_ip', self.sonar_ip)
+        self.udp_port = params.getint('udp_port', self.udp_port)
+        self.serial_port = params.get('serial_port', self.serial_port)
+        self.baudrate = params.getint('baudrate', self.baudrate)
+        self.prefix = params.get('prefix', self.prefix)
+        self.log_file_dir = params.get('log_file_dir', self.log_file_dir)
+        self.log_async = params.getboolean('log_async', self.log_async)
+        self.log_queue_size = params.getint('log_queue_size', self.log_queue_size)
+        self.log_queue_full_policy = params.get('log_queue_full_policy', self.log_queue_full_policy)
+        self.log_flush_records = params.getint('log_flush_records', self.log_flush_records)
+        self.log_flush_interval_ms = params.getint('log_flush_interval_ms', self.log_flush_interval_ms)
+        self.log_fsync_on_sector = params.getboolean('log_fsync_on_sector', self.log_fsync_on_sector)
+        self.ping_data_codec = params.get('ping_data_codec', self.ping_data_codec)
+        self.ping_data_key_interval = params.getint('ping_data_key_interval', self.ping_data_key_interval)
+        self.shm_ring_name = params.get('shm_ring_name', self.shm_ring_name)
+        self.shm_ring_slots = params.getint('shm_ring_slots', self.shm_ring_slots)
+        self.timing_period_sec = params.getfloat('timing_period_sec', self.timing_period_sec)
+        self.head_step_ms = params.getfloat('head_step_ms', self.head_step_ms)
+        self.response_timeout_margin = params.getfloat('response_timeout_margin', self.response_timeout_margin)
+        self.response_timeout_min_ms = params.getfloat('response_timeout_min_ms', self.response_timeout_min_ms)
+        self.response_timeout_max_ms = params.getfloat('response_timeout_max_ms', self.response_timeout_max_ms)
+        self.reconnect_min_sec = params.getfloat('reconnect_min_sec', self.reconnect_min_sec)
+        self.reconnect_max_sec = params.getfloat('reconnect_max_sec', self.reconnect_max_sec)
+        self.dead_link_timeouts = params.getint('dead_link_timeouts', self.dead_link_timeouts)
+        self.publish_on_change = params.get('publish_on_change', self.publish_on_change)
+        self.publish_max_rate_hz = params.get('publish_max_rate_hz', self.publish_max_rate_hz)
+        self.publish_refresh_sec = params.getfloat('publish_refresh_sec', self.publish_refresh_sec)
+
+        # Check validity of port_type
+        if self.port_type not in ['serial', 'udp']:
+            raise Exception("Invalid port_type ({0})".format(self.port_type))
+
+        # Check validity of baudrate
+        if self.baudrate not in [2400, 4800, 9600, 19200, 38400, 57600, 115200]:
+            raise Exception("Invalid baudrate ({0})".format(self.baudrate))
+
+        # Check validity of log queue parameters
+        if self.log_queue_full_policy not in ['block', 'drop']:
+            raise Exception("Invalid log_queue_full_policy ({0})".format(self.log_queue_full_policy))
+        if self.log_queue_size < 1:
+            raise Exception("Invalid log_queue_size ({0})".format(self.log_queue_size))
+        self.ping360_logger.set_async_mode(self.log_async, self.log_queue_size, self.log_queue_full_policy == 'drop')
+        self.ping360_logger.set_flush_policy(self.log_flush_records, self.log_flush_interval_ms,
+                                             self.log_fsync_on_sector)
+
+        # Check validity of the PING_DATA_COMPACT codec, raises an exception if a stage is invalid
+        if self.ping_data_key_interval < 0:
+            raise Exception("Invalid ping_data_key_interval ({0})".format(self.ping_data_key_interval))
+        if self.ping_data_codec:
+            self.ping_data_encoder = PingDataEncoder(self.ping_data_codec, self.ping_data_key_interval)
+
+        # Check validity of the shared memory ring buffer parameters
+        if self.shm_ring_slots < 1:
+            raise Exception("Invalid shm_ring_slots ({0})".format(self.shm_ring_slots))
+        if self.shm_ring_name:
+            self.outputs['SHM_RING'] = PingRing.layout(self.shm_ring_name, self.shm_ring_slots,
+                                                       self.inputs['NUMBER_OF_SAMPLES']['max'])
+
+        if self.timing_period_sec <= 0:
+            raise Exception("Invalid timing_period_sec ({0})".format(self.timing_period_sec))
+        self.ping_timing.period = self.timing_period_sec
+
+        # Check validity of the response timeout model parameters
+        if self.head_step_ms < 0:
+            raise Exception("Invalid head_step_ms ({0})".format(self.head_step_ms))
+        if self.response_timeout_margin < 0:
+            raise Exception("Invalid response_timeout_margin ({0})".format(self.response_timeout_margin))
+        if not 0 < self.response_timeout_min_ms <= self.response_timeout_max_ms:
+            raise Exception("Invalid response_timeout_min_ms/response_timeout_max_ms ({0}/{1})".
+                            format(self.response_timeout_min_ms, self.response_timeout_max_ms))
+        self.ping_time_model.step_time = self.head_step_ms / 1000
+        self.ping_time_model.margin = self.response_timeout_margin
+        self.ping_time_model.min_timeout = self.response_timeout_min_ms / 1000
+        self.ping_time_model.max_timeout = self.response_timeout_max_ms / 1000
+
+        # Check validity of the reconnection parameters
+        if not 0 < self.reconnect_min_sec <= self.reconnect_max_sec:
+            raise Exception("Invalid reconnect_min_sec/reconnect_max_sec ({0}/{1})".
+                            format(self.reconnect_min_sec, self.reconnect_max_sec))
+        if self.dead_link_timeouts < 1:
+            raise Exception("Invalid dead_link_timeouts ({0})".format(self.dead_link_timeouts))
+
+        self.configure_publish_policy()
+
+        # Ensure that prefix has '_' at the end if it is not empty
+        if self.prefix and not self.prefix.endswith('_'):
+            self.prefix += '_'
+        self.prefix = self.prefix.upper()
+
+        # Print configuration
+        if self.name:
+            print('device', self.name)
+        print('port_type is', self.port_type)
+        if self.port_type == 'udp':
+            print('sonar_ip is', self.sonar_ip)
+            print('udp_port is', self.udp_port)
+        elif self.port_type == 'serial':
+            print('serial_port is', self.serial_port)
+            print('baudrate is ', self.baudrate)
+        print("prefix is '{0}'".format(self.prefix))
+        print('log_file_dir is', self.log_file_dir)
+        if self.log_async:
+            print('log_queue_size is', self.log_queue_size)
+            print('log_queue_full_policy is', self.log_queue_full_policy)
+        print('log flush policy: every {0} records, every {1} ms, fsync on sector: {2}'.
+              format(self.log_flush_records, self.log_flush_interval_ms, self.log_fsync_on_sector))
+        if self.ping_data_encoder is not None:
+            print('ping_data_codec is', self.ping_data_codec)
+        if self.shm_ring_name:
+            print('shm_ring is', self.outputs['SHM_RING'])
+        if self.publish_policy.rules:
+            print('publish_on_change is', self.publish_on_change)
+            print('publish_max_rate_hz is', self.publish_max_rate_hz)
+
+        print(self.inputs)
+
+    def configure_publish_policy(self):
+        ''' Creates the publication policy from the publish_* parameters, raises an exception if one is invalid '''
+        if self.publish_refresh_sec < 0:
+            raise Exception("Invalid publish_refresh_sec ({0})".format(self.publish_refresh_sec))
+        self.publish_policy = PublishPolicy(self.publish_refresh_sec)
+        for output_id in PublishPolicy.parse_names(self.publish_on_change):
+            if output_id not in self.outputs:
+                raise Exception("Invalid publish_on_change variable ({0})".format(output_id))
+            self.publish_policy.publish_on_change(output_id)
+        for output_id, max_rate_hz in PublishPolicy.parse_rates(self.publish_max_rate_hz).items():
+            if output_id not in self.outputs:
+                raise Exception("Invalid publish_max_rate_hz variable ({0})".format(output_id))
+            self.publish_policy.limit_rate(output_id, max_rate_hz)
+
+    def input_names(self):
+        ''' Returns the MOOS variable names of the inputs, for registration & mail routing '''
+        return [self.prefix + input_id for input_id in self.inputs]
+
+    def on_connect(self):
+        ''' Called from the pymoos thread. Updates state to 'DB_CONNECTED', registers subscription vars with the
+        MOOS DB & publishes all outputs'''
+        self.set_output('STATE', State.DB_CONNECTED.name)
+
+        # Register all inputs with the DB
+        registered_vars = 0
+        for msg_name in self.input_names():
+            if (self.comms.register(msg_name,0)):
+                registered_vars += 1
+            else:
+                self.set_output('LAST_ERROR', 'Error registering {0}'.format(msg_name))
+
+        # Publish all outputs - all values except for 'state will be the default'
+        for output_id, value in list(self.outputs.items()):
+            self.set_output(output_id, value, force=True)
+
+        # The state machine is woken through the device's loop
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def set_output(self, output_id, value, force=False):
+        ''' Store & publish output, subject to the publication policy unless forced'''
+        # TODO: Print info if debug is enabled
+        self.outputs[output_id] = value
+        if not force and output_id in self.publish_policy.rules and \
+                not self.publish_policy.should_publish(output_id, value):
+            return
+        msg_name = self.prefix + output_id
+
+        if output_id in BINARY_OUTPUTS:
+            self.comms.notify_binary(msg_name, value, pymoos.time())
+        else:
+            self.comms.notify(msg_name, value, pymoos.time())
+
+    def publish_due_outputs(self):
+        ''' Publishes the outputs withheld by the rate limits once their interval has passed, refreshes unchanged
+        outputs, and publishes the number of suppressed notifications once a second '''
+        for output_id in self.publish_policy.due():
+            self.publish_policy.published(output_id, self.outputs[output_id])
+            self.set_output(output_id, self.outputs[output_id], force=True)
+
+        now = time.monotonic()
+        if now - self.suppressed_publish_time >= 1.0 and \
+                self.publish_policy.suppressed != self.outputs['SUPPRESSED_NOTIFICATIONS']:
+            self.suppressed_publish_time = now
+            self.set_output('SUPPRESSED_NOTIFICATIONS', self.publish_policy.suppressed)
+
+    async def run_timed_publications(self):
+        ''' Publishes the logging status periodically, and applies the publication policy's timed publications, also
+        while the state machine is idle '''
+        log_status_time = time.monotonic()
+        while True:
+            await asyncio.sleep(PUBLISH_CHECK_INTERVAL)
+            now = time.monotonic()
+            if now - log_status_time >= LOG_STATUS_PERIOD:
+                log_status_time = now
+                self.publish_log_status()
+            if self.publish_policy.rules:
+                self.publish_due_outputs()
+
+    def build_mail_handlers(self):
+        ''' Returns the table used to dispatch mail: MOOS variable name -> (input id, bound handler methods) '''
+        return {self.prefix + input_id: (input_id, [getattr(self, handler)
+                                                    for handler in INPUT_HANDLERS.get(input_id, [])])
+                for input_id in self.inputs}
+
+    def post_mail(self, msg_list):
+        ''' Called from the pymoos thread with the device's messages. Passes them to the event loop, where they are
+        applied by apply_mail() between pings. '''
+        try:
+            self.loop.call_soon_threadsafe(self.queue_mail, msg_list)
+        except RuntimeError:
+            pass # The device's worker has stopped and its loop is closed
+
+    def queue_mail(self, msg_list):
+        ''' Keeps the last message for each input until the state machine applies them, and wakes it so that it
+        reacts immediately '''
+        for msg in msg_list:
+            self.pending_mail[msg.name()] = msg
+        self.wakeup.set()
+
+    def apply_mail(self):
+        ''' Applies the pending mail as one change of configuration. The handlers of the changed inputs are called
+        once each after all the values are stored, so that e.g. RANGE, SPEED_OF_SOUND & NUMBER_OF_SAMPLES changing
+        together recalculate the transmit settings once. '''
+        mail, self.pending_mail = self.pending_mail, {}
+        handlers = {}
+        for msg_name, msg in mail.items():
+            input_id, input_handlers = self.mail_handlers[msg_name]
+            if self.set_input(input_id, msg):
+                handlers.update(dict.fromkeys(input_handlers))
+
+        for handler in handlers:
+            handler()
+
+    async def wait_for_event(self, timeout=None):
+        ''' Waits until new mail arrives or the DB connects, or until the timeout (seconds) expires. Callers check the
+        state immediately beforehand without awaiting, so no wakeup can be missed by clearing the event here. '''
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def set_input(self, input_id, msg):
+        ''' Stores the value of an input, returns False if it is out of range '''
+        value = msg.double() # TODO: how to handle ints
+        input = self.inputs[input_id] #TODO: handle case where input not found?
+
+        #Do not accept the value if it is out of range
+        # TODO: Update DB with current value if invalid value is specified?
+        # TODO: If updating DB from here, will also have to initialize as required in on_new_mail?
+        if value < input['min'] or value > input['max']:
+            # TODO: use debug message function when created + use message name?
+            print ("{0} value ({1}) out of range".format(self.prefix + input_id, value))
+            return False
+
+        # Save valid values
+        self.inputs[input_id]['val'] = value
+
+        # TODO: use debug message function when created + use message name?
+        print("{0}: {1} changed to {2}".\
+        format(get_msg_time_str(msg), self.prefix + input_id, value))
+        return True
+
+    def allocate_sector_image(self):
+        ''' The sector image is sized for the new number of samples, and cleared when it is (re)enabled '''
+        self.sector_image.allocate(self.inputs['NUMBER_OF_SAMPLES']['val'])
+
+    def on_scan_sector_changed(self):
+        self.scan_sector_changed = True
+
+    def on_scan_mode_changed(self):
+        self.scan_mode_changed = True
+
+    def on_sonar_setting_changed(self):
+        self.sonar_setting_changed = True
+
+    def on_timing_enable_changed(self):
+        self.ping_timing.set_enabled(bool(self.inputs['TIMING_ENABLE']['val']))
+
+    def on_log_enable_changed(self):
+        if self.inputs['LOG_ENABLE']['val']:
+            self.ping360_logger.create_new_file(self.log_file_dir, self.name)
+        else:
+            self.ping360_logger.close_log_file()
+        self.publish_log_status()
+
+    def publish_log_status(self):
+        self.ping360_logger.poll_write_rate()
+        self.set_output('LOG_STATUS', self.ping360_logger.status)
+        self.set_output('LOG_QUEUE_DEPTH', self.ping360_logger.queue_depth())
+        self.set_output('LOG_DROPPED_RECORDS', self.ping360_logger.dropped_records)
+        self.set_output('LOG_WRITE_RATE_KBPS', self.ping360_logger.write_rate / 1000)
+
+    def publish_timing(self):
+        ''' Publishes the ping timing statistics of the last period '''
+        report = self.ping_timing.report()
+        total_ms = report['latency_ms'].get('total', [0, 0, 0])
+        self.set_output('PING_LATENCY_P50_MS', total_ms[0])
+        self.set_output('PING_LATENCY_P95_MS', total_ms[1])
+        self.set_output('PING_LATENCY_P99_MS', total_ms[2])
+        self.set_output('PING_STAGE_LATENCY_MS', ','.join('{0}={1:.3f}/{2:.3f}/{3:.3f}'.format(stage, *percentiles)
+                                                          for stage, percentiles in report['latency_ms'].items()))
+        self.set_output('TIMING_PINGS_PER_SEC', report['pings_per_sec'])
+        self.set_output('TIMEOUT_RATE', report['timeout_rate'])
+        self.set_output('NACK_RATE', report['nack_rate'])
+
+    def connect_to_sonar(self):
+        ''' Opens the UDP socket or serial port and checks that the sonar responds. Blocks while waiting for the
+        sonar, so it is run outside the event loop, and only returns the result: the device's state is updated by
+        the state machine, on the loop. '''
+        try:
+            if self.port_type == 'serial':
+                self.ping_360.connect_serial(self.serial_port, self.baudrate)
+            elif self.port_type == 'udp':
+                print("Connecting to {0}:{1}".format(self.sonar_ip,self.udp_port))
+                self.ping_360.connect_udp(self.sonar_ip,self.udp_port)
+
+            initialized = self.ping_360.initialize()
+        except Exception as e: # brping raises Exception if the port cannot be opened
+            print(e)
+            initialized = False
+        print("Initialized: %s" % initialized)
+        return initialized
+
+    def disconnect_from_sonar(self):
+        ''' Stops receiving from the sonar and closes its UDP socket or serial port '''
+        self.transport.detach()
+        if getattr(self.ping_360, 'iodev', None) is not None:
+            try:
+                self.ping_360.iodev.close()
+            except OSError:
+                pass
+            self.ping_360.iodev = None
+
+    def schedule_reconnect(self):
+        ''' Sets the time of the next connection attempt. The delay doubles with each failed attempt, and is
+        randomised so that several devices do not retry in lockstep. '''
+        delay = min(self.reconnect_max_sec, self.reconnect_min_sec * 2 ** self.reconnect_attempts)
+        self.reconnect_attempts += 1
+        self.reconnect_time = time.monotonic() + random.uniform(delay / 2, delay)
+        if self.inputs['DEBUG_ENABLE']['val']:
+            print('Reconnecting in {0:.1f} s'.format(self.reconnect_time - time.monotonic()))
+
+    def on_ping_timeout(self):
+        self.consecutive_timeouts += 1
+        self.ping_timing.timeout()
+        self.ping_time_model.missed()
+
+    def on_ping_received(self):
+        ''' Resets the link health after a ping is received, and publishes the time to recover from a lost link '''
+        self.consecutive_timeouts = 0
+        self.last_ping_time = time.monotonic()
+        if self.link_lost_time is not None:
+            self.set_output('RECOVERY_TIME_SEC', self.last_ping_time - self.link_lost_time)
+            print('Link recovered after {0:.1f} s'.format(self.last_ping_time - self.link_lost_time))
+            self.link_lost_time = None
+            self.reconnect_attempts = 0
+
+    async def probe_link(self):
+        ''' Returns True if the sonar answers a protocol_version request, i.e. the link is alive even though pings
+        are timing out '''
+        request = PingMessage(definitions.COMMON_GENERAL_REQUEST)
+        request.requested_id = definitions.COMMON_PROTOCOL_VERSION
+        request.pack_msg_data()
+        self.ping_360.write(request.msg_data)
+
+        # The sonar may finish a ping, after a slew, before answering
+        response = await self.transport.wait_message([definitions.COMMON_PROTOCOL_VERSION],
+                                                     self.ping_time_model.timeout(200))
+        return response is not None and self.transport.error is None
+
+    def on_link_lost(self, reason):
+        ''' Closes the connection to the sonar and schedules a reconnection. The sweep resumes at the current
+        transmit angle once the sonar responds again. The transmit angle only advances when a ping is received, so
+        this is the angle that failed, i.e. the first angle after the last ping received, and no angle of the sweep
+        is skipped. '''
+        self.set_output('LAST_ERROR', 'Link lost: {0}'.format(reason))
+        print('Link lost: {0}'.format(reason))
+
+        if self.link_lost_time is None:
+            self.link_lost_time = self.last_ping_time or time.monotonic()
+        self.resume_angle_grads = self.transmit_angle_grads
+        self.disconnect_from_sonar()
+        self.auto_transmit_active = False
+        self.ping_pending = False
+        self.consecutive_timeouts = 0
+        self.set_output('RECONNECT_COUNT', self.outputs['RECONNECT_COUNT'] + 1)
+        self.schedule_reconnect()
+        self.set_output('STATE', State.DB_CONNECTED.name)
+        print('STATE: DB_CONNECTED')
+
+    async def check_link(self):
+        ''' Detects a dead link from a receive error, or from consecutive timeouts which a probe confirms '''
+        if self.transport.error is not None:
+            self.on_link_lost(self.transport.error)
+        elif self.consecutive_timeouts >= self.dead_link_timeouts:
+            if await self.probe_link():
+                # The sonar is responsive, so pinging is restarted in case it has lost its state
+                self.consecutive_timeouts = 0
+                self.auto_transmit_active = False
+                self.ping_pending = False
+            else:
+                self.on_link_lost('{0} consecutive timeouts'.format(self.consecutive_timeouts))
+
+    async def request_head_angle(self):
+        ''' Returns the head angle reported in the sonar's device_data, or None if the sonar does not report it '''
+        request = PingMessage(definitions.COMMON_GENERAL_REQUEST)
+        request.requested_id = definitions.PING360_DEVICE_DATA
+        request.pack_msg_data()
+        try:
+            self.ping_360.write(request.msg_data)
+        except OSError: # The link is checked once transmitting
+            return None
+
+        response = await self.transport.wait_message([definitions.PING360_DEVICE_DATA, definitions.COMMON_NACK],
+                                                     self.ping_time_model.timeout(0))
+        if response is None or response.name == 'nack':
+            return None
+        return response.angle
+
+    async def calc_initial_transmit_angle(self):
+        ''' Starts the sweep at the sector edge the head is expected to reach first (see HeadRouteModel), so that the
+        head slews as little as possible before the first ping. Starts at the start angle if the sonar does not
+        report its head angle. '''
+        start_angle_grads = self.inputs['START_ANGLE_GRADS']['val']
+        stop_angle_grads = self.inputs['STOP_ANGLE_GRADS']['val']
+
+        head_angle_grads = await self.request_head_angle()
+        if head_angle_grads is None:
+            print('calc_initial_transmit_angle: No device state, starting at the start angle')
+            self.transmit_angle_grads, self.clockwise = start_angle_grads%400, True
+        else:
+            self.transmit_angle_grads, self.clockwise = nearer_sector_edge(head_angle_grads, start_angle_grads,
+                                                                           stop_angle_grads,
+                                                                           self.head_route.travel_grads)
+            # The first ping's head movement, and so its timeout, is known
+            self.command_angle_grads = head_angle_grads
+        self.sweep_start_head_angle_grads = head_angle_grads
+        self.sweep_start_time = None
+        self.sweep_start_pending = True
+        self.publish_transmit_angle()
+
+        if self.inputs['DEBUG_ENABLE']['val']:
+            print('Initial transmit angle: {0} gradians, head angle: {1} gradians'.format(self.transmit_angle_grads,
+                                                                                        head_angle_grads))
+
+    def publish_sweep_start_slew(self, angle_grads):
+        ''' Publishes the time the head took to slew to the first angle of the sweep: the time from the sweep's first
+        command to the data of its first ping (which includes any timed out attempts, during which the head was still
+        moving), less the time the ping would take without moving the head. If the head angle was reported before the
+        sweep, the slew also teaches the head route model which way the head turned, and the gradians moved are
+        published with those saved against starting at the start angle. '''
+        self.sweep_start_pending = False
+        slew_time = max(0.0, time.perf_counter() - self.sweep_start_time - self.ping_time_model.expected_ping_time(0))
+        self.set_output('SWEEP_START_SLEW_SEC', slew_time)
+        if self.sweep_start_head_angle_grads is None:
+            return
+
+        slew_grads = self.head_route.update(self.sweep_start_head_angle_grads, angle_grads, slew_time,
+                                            self.ping_time_model.step_time)
+        if self.command_time == self.sweep_start_time:
+            self.ping_steps_grads = slew_grads # for the timing model update of the first ping, if not retried
+        self.set_output('SWEEP_START_SLEW_GRADS', slew_grads)
+        self.set_output('SWEEP_START_SLEW_SAVED_GRADS',
+                        self.head_route.travel_grads(self.sweep_start_head_angle_grads,
+                                                     self.inputs['START_ANGLE_GRADS']['val']) - slew_grads)
+
+    def publish_transmit_angle(self):
+        self.set_output('TRANSMIT_ANGLE_GRADS', self.transmit_angle_grads)
+        self.set_output('TRANSMIT_ANGLE_DEGS', self.transmit_angle_grads * 360 / 400)
+
+        if self.inputs['DEBUG_ENABLE']['val']:
+            print('Transmit Angle: {0} gradians, {1} degrees'.
+                  format(self.transmit_angle_grads, self.transmit_angle_grads * 360 / 400))
+
+    def plan_sweep(self, head_angle_grads):
+        ''' Returns the (transmit angle, clockwise) pair for the next ping of the scan sector, from the head angle.
+        Within the sector the sweep carries on in its current direction. From outside the sector it starts at the
+        nearer edge, heading into the sector, and from an unknown head angle (None) at the start angle. '''
+        start_angle_grads = self.inputs['START_ANGLE_GRADS']['val']
+        stop_angle_grads = self.inputs['STOP_ANGLE_GRADS']['val']
+
+        if head_angle_grads is None:
+            return start_angle_grads%400, True
+        if angle_within(head_angle_grads, start_angle_grads, stop_angle_grads):
+            return next_transmit_angle(head_angle_grads, self.clockwise, start_angle_grads, stop_angle_grads,
+                                       self.inputs['NUM_STEPS']['val'])
+        return nearer_sector_edge(head_angle_grads, start_angle_grads, stop_angle_grads, self.head_route.travel_grads)
+
+    def retarget_sector(self):
+        ''' Applies a new scan sector while transmitting, without stopping the motor. The sweep is replanned from
+        the head angle, and the time lost until the first ping within the new sector is published as
+        RECONFIGURATION_TIME_LOST_SEC. '''
+        self.scan_sector_changed = False
+        self.reconfigure_time = time.perf_counter()
+        self.sector_ping_count = 0
+        self.sector_scan_start_time = time.time()
+
+        if self.inputs['SCAN_MODE']['val'] == ScanMode.AUTO_TRANSMIT.value:
+            # The sonar sweeps from the start angle. A new auto transmit command replaces the current sweep.
+            self.sonar_setting_changed = True
+        elif not self.ping_pending:
+            # A pipelined ping in flight is completed first, and the sweep planned from its angle
+            self.transmit_angle_grads, self.clockwise = self.plan_sweep(self.command_angle_grads)
+            self.publish_transmit_angle()
+
+        if self.inputs['DEBUG_ENABLE']['val']:
+            print('Scan sector retargeted, next transmit angle: {0} gradians'.format(self.transmit_angle_grads))
+
+    def publish_reconfiguration_time(self, angle_grads):
+        ''' Publishes the time lost to the last change of scan sector or mode once a ping is received within the
+        sector: the time since the change, less the time a ping takes when sweeping without a change '''
+        if not angle_within(angle_grads, self.inputs['START_ANGLE_GRADS']['val'],
+                            self.inputs['STOP_ANGLE_GRADS']['val']):
+            return
+        elapsed = time.perf_counter() - self.reconfigure_time
+        self.reconfigure_time = 0
+        ping_time = self.ping_time_model.expected_ping_time(self.inputs['NUM_STEPS']['val'])
+        self.set_output('RECONFIGURATION_TIME_LOST_SEC', max(0.0, elapsed - ping_time))
+
+    def calc_next_transmit_angle(self):
+        if self.ping360_device_data is not None:
+            self.transmit_angle_grads, self.clockwise = next_transmit_angle(self.ping360_device_data.angle,
+                                                                            self.clockwise,
+                                                                            self.inputs['START_ANGLE_GRADS']['val'],
+                                                                            self.inputs['STOP_ANGLE_GRADS']['val'],
+                                                                            self.inputs['NUM_STEPS']['val'])
+
+        self.transmit_angle_grads = self.transmit_angle_grads%400
+        self.publish_transmit_angle()
+        return
+
+    def calculate_sample_period_and_transmit_duration(self):
+        """
+         @brief Calculate the sample period based on the range, number of samples and
+         the speed of sound.
+
+         Adjust the transmit duration for a specific range. Per firmware engineer:
+         1. Starting point is TxPulse in usec = ((one-way range in metres) * 8000) / (Velocity of sound in metres
+         per second)
+         2. Then check that TxPulse is wide enough for currently selected sample interval in usec, i.e.,
+              if TxPulse < (2.5 * sample interval) then TxPulse = (2.5 * sample interval)
+            (transmit duration is microseconds, samplePeriod() is nanoseconds)
+         3. Perform limit checking
+         """
+        range = self.inputs['RANGE']['val']
+        number_of_samples = self.inputs['NUMBER_OF_SAMPLES']['val']
+        speed_of_sound = self.inputs['SPEED_OF_SOUND']['val']
+
+        # sample_period_ticks is the number of timer ticks between each data point.
+        self.sample_period_ticks = int(2 * range / (number_of_samples * speed_of_sound *
+                                                    self.sample_period_tick_duration))
+        sample_period_nsec = self.sample_period_ticks * self.sample_period_tick_duration #TODO: Understand units
+
+        # The maximum transmit duration that will be applied is limited internally by the firmware to prevent damage
+        # to the hardware. The maximum transmit duration is equal to 64 * the sample period in microseconds
+        max_transmit_duration_usec = min(self.firmware_max_transmit_duration, sample_period_nsec * 64e6)
+
+        # Calculate transmit duration
+        self.transmit_duration_usec = round(8000 * range / speed_of_sound)
+        self.transmit_duration_usec = max(2.5 * sample_period_nsec/ 1000, self.transmit_duration_usec)
+        self.transmit_duration_usec = max(self.firmware_min_transmit_duration,
+                                          min(max_transmit_duration_usec, self.transmit_duration_usec))
+
+        self.ping_time_model.configure(self.transmit_duration_usec, self.sample_period_ticks, number_of_samples)
+
+    def start_auto_transmit(self):
+        ''' Configures the sonar to sweep the scan sector by itself. The sonar then streams an auto_device_data message
+        for each ping until it receives a motor_off or another control command. '''
+        sample_period = int(self.sample_period_ticks)
+        number_of_samples = int(self.inputs['NUMBER_OF_SAMPLES']['val'])
+        start_angle_grads = int(self.inputs['START_ANGLE_GRADS']['val'])%400
+        stop_angle_grads = int(self.inputs['STOP_ANGLE_GRADS']['val'])%400
+        if sector_extent_grads(self.inputs['START_ANGLE_GRADS']['val'], self.inputs['STOP_ANGLE_GRADS']['val']) == 400:
+            stop_angle_grads = (start_angle_grads - 1)%400 # A full circle, within the sonar's 0-399 angles
+        num_steps = int(self.inputs['NUM_STEPS']['val'])
+        self.ping_360.control_auto_transmit(1, int(self.inputs['GAIN']['val']), int(self.transmit_duration_usec),
+                                            sample_period, int(self.inputs['TRANSMIT_FREQUENCY']['val']),
+                                            number_of_samples, start_angle_grads, stop_angle_grads, num_steps, 0)
+        self.auto_transmit_settings = (sample_period, number_of_samples, start_angle_grads, stop_angle_grads, num_steps)
+        self.auto_transmit_active = True
+        self.sonar_setting_changed = False
+
+        if self.inputs['DEBUG_ENABLE']['val']:
+            print('Auto transmit started')
+
+    def update_ping_rate(self, scan_time):
+        ''' Publishes the pings/sec achieved over the last sector scan, and its improvement over the per ping loop '''
+        if scan_time <= 0:
+            return
+
+        scan_mode = int(self.inputs['SCAN_MODE']['val'])
+        ping_rate = self.sector_ping_count / scan_time
+        self.ping_rate_by_mode[scan_mode] = ping_rate
+        self.sector_ping_count = 0
+        self.set_output('PING_RATE', ping_rate)
+
+        # Compare against the most recent measurement from the serial per ping loop, if there is one
+        serial_ping_rate = self.ping_rate_by_mode.get(ScanMode.PER_PING.value, 0)
+        if scan_mode != ScanMode.PER_PING.value and serial_ping_rate > 0:
+            improvement_pct = 100 * (ping_rate - serial_ping_rate) / serial_ping_rate
+            self.set_output('PING_RATE_IMPROVEMENT_PCT', improvement_pct)
+            if self.inputs['DEBUG_ENABLE']['val']:
+                print('Ping rate: {0:.2f} pings/sec ({1:+.1f}% vs per ping mode)'.format(ping_rate, improvement_pct))
+
+    def publish_expected_scan_time(self):
+        ''' Publishes the sector scan time predicted by the response timeout model, for comparison with the measured
+        SECTOR_SCAN_TIME_SEC. The model only covers the sonar's part of each ping, so the difference is the time spent
+        by the app between pings. '''
+        num_steps = self.inputs['NUM_STEPS']['val']
+        sector_grads = sector_extent_grads(self.inputs['START_ANGLE_GRADS']['val'],
+                                           self.inputs['STOP_ANGLE_GRADS']['val'])
+        num_pings = max(1, math.ceil(sector_grads / num_steps))
+        self.set_output('EXPECTED_SECTOR_SCAN_TIME_SEC', self.ping_time_model.expected_sector_time(num_pings, num_steps))
+        self.set_output('PING_TIMEOUT_MS', self.ping_time_model.timeout(num_steps) * 1000)
+
+    def publish_sector_image(self):
+        ''' Publishes a snapshot of the scan sector from the rolling sector image '''
+        self.sector_image_publish_time = time.time()
+        self.set_output('SECTOR_IMAGE', self.sector_image.snapshot(self.inputs['START_ANGLE_GRADS']['val'],
+                                                                   self.inputs['STOP_ANGLE_GRADS']['val'],
+                                                                   self.inputs['SECTOR_IMAGE_ANGLE_STEP']['val'],
+                                                                   self.inputs['SECTOR_IMAGE_RANGE_DECIMATION']['val']))
+
+    def publish_compact_ping_data(self):
+        ''' Publishes the current ping encoded with the configured codec, with its size and encoding time '''
+        encode_start = time.perf_counter()
+        message = self.ping_data_encoder.encode(self.ping360_device_data)
+        encode_usec = (time.perf_counter() - encode_start) * 1e6
+
+        self.set_output('PING_DATA_COMPACT', message)
+        self.set_output('PING_DATA_COMPACT_BYTES', len(message))
+        self.set_output('PING_DATA_ENCODE_USEC', encode_usec)
+
+    def process_ping_data(self, ping_data):
+        ''' Publishes & logs a device_data or auto_device_data message, updates the sector scan time and the sector
+        image '''
+        publish_start = self.ping_timing.now()
+        self.ping360_device_data = ping_data
+        self.sector_ping_count += 1
+        if self.reconfigure_time:
+            self.publish_reconfiguration_time(self.ping360_device_data.angle)
+        self.set_output('PING_DATA', bytes(self.ping360_device_data.pack_msg_data()) )
+        if self.ping_data_encoder is not None:
+            self.publish_compact_ping_data()
+        if self.ping_ring is not None:
+            self.ping_ring.write(self.ping360_device_data)
+        if self.inputs['DEBUG_ENABLE']['val']:
+            print(self.ping360_device_data.__repr__())
+
+        sector_image_enabled = self.inputs['SECTOR_IMAGE_ENABLE']['val']
+        if sector_image_enabled:
+            self.sector_image.update(self.ping360_device_data.angle, self.ping360_device_data.data)
+
+        if self.ping360_device_data.angle in [self.inputs['START_ANGLE_GRADS']['val'],
+                                              self.inputs['STOP_ANGLE_GRADS']['val']]:
+            scan_time = time.time() - self.sector_scan_start_time
+            print(scan_time)
+            self.set_output('SECTOR_SCAN_TIME_SEC', scan_time)
+            self.publish_expected_scan_time()
+            self.update_ping_rate(scan_time)
+            self.sector_scan_start_time = time.time()
+            self.ping360_logger.sector_complete()
+            if sector_image_enabled and not self.inputs['SECTOR_IMAGE_RATE_HZ']['val']:
+                self.publish_sector_image()
+
+        sector_image_rate = self.inputs['SECTOR_IMAGE_RATE_HZ']['val']
+        if sector_image_enabled and sector_image_rate and \
+                time.time() - self.sector_image_publish_time >= 1 / sector_image_rate:
+            self.publish_sector_image()
+
+        # Log ping data if logging is enabled
+        log_start = self.ping_timing.record('publish', publish_start)
+        if self.inputs['LOG_ENABLE']['val']:
+            self.ping360_logger.log_message(self.ping360_device_data.msg_data)
+            self.ping_timing.record('log', log_start)
+
+    def send_transducer_command(self, transmit_angle_grads):
+        # The head moves from the previously commanded angle, or by up to the longest move if its angle is unknown
+        if self.command_angle_grads is None:
+            self.ping_steps_grads = self.head_route.max_travel_grads()
+        else:
+            self.ping_steps_grads = self.head_route.travel_grads(self.command_angle_grads, transmit_angle_grads)
+        self.command_angle_grads = int(transmit_angle_grads)
+
+        self.command_start_time = self.ping_timing.now()
+        self.command_settings = (int(self.sample_period_ticks), int(self.inputs['NUMBER_OF_SAMPLES']['val']))
+        self.ping_360.control_transducer(1, int(self.inputs['GAIN']['val']), int(transmit_angle_grads),
+                                         int(self.transmit_duration_usec), self.command_settings[0],
+                                         int(self.inputs['TRANSMIT_FREQUENCY']['val']), self.command_settings[1], 1, 0)
+        self.command_time = time.perf_counter()
+        if self.sweep_start_time is None:
+            self.sweep_start_time = self.command_time
+        self.command_sent_time = self.ping_timing.record('command', self.command_start_time)
+
+    def is_current_auto_data(self, msg):
+        ''' Returns False for auto_device_data streamed with the sampling & sweep settings of an earlier auto transmit
+        command, which can still arrive after the sweep is restarted with new settings '''
+        return msg.message_id != definitions.PING360_AUTO_DEVICE_DATA or \
+            (msg.sample_period, msg.number_of_samples, msg.start_angle, msg.stop_angle, msg.num_steps) == \
+            self.auto_transmit_settings
+
+    def is_reply_to_command(self, msg):
+        ''' Returns False for device_data from a control_transducer command other than the last one, e.g. a late
+        reply to a ping which timed out, so that it is not taken as the data of the ping in flight. A late reply at
+        the same angle is also rejected if the sampling settings (which the data is interpreted with) have changed. '''
+        return msg.message_id != definitions.PING360_DEVICE_DATA or \
+            (msg.angle == self.command_angle_grads and
+             (msg.sample_period, msg.number_of_samples) == self.command_settings)
+
+    async def transmit_per_ping(self):
+        ''' Commands a single ping at the current transmit angle and waits for the response '''
+        self.send_transducer_command(self.transmit_angle_grads)
+        response = await self.transport.wait_message([definitions.PING360_DEVICE_DATA, definitions.COMMON_NACK],
+                                                     self.ping_time_model.timeout(self.ping_steps_grads),
+                                                     self.is_reply_to_command)
+        self.ping_timing.record('response', self.command_sent_time)
+
+        if response is None:
+            self.on_ping_timeout()
+            self.set_output('LAST_ERROR','Timeout: No response to control command')
+            print('Timeout: No response to control command')
+        elif response.name == 'nack':
+            self.ping_timing.nack()
+            self.set_output('LAST_ERROR', 'Control Command Nacked')
+            print('Control Command Nacked')
+        elif response.name == 'device_data':
+            response_time = time.perf_counter() - self.command_time
+            if self.sweep_start_pending:
+                self.publish_sweep_start_slew(response.angle)
+            self.ping_time_model.update(self.ping_steps_grads, response_time)
+            self.on_ping_received()
+            self.process_ping_data(response)
+
+            # Only calculate the next transmit angle if the current angle was successfully scanned, so that it
+            # will attempt to scan the same angle again on the text iteration
+            angle_start = self.ping_timing.now()
+            self.calc_next_transmit_angle()
+            self.ping_timing.record('angle', angle_start)
+            self.ping_timing.ping_complete(self.command_start_time)
+
+    async def transmit_pipelined(self):
+        ''' Commands pings back to back. As soon as a ping's device_data arrives, the next transmit angle is computed
+        and commanded, so that publishing, logging and debug printing overlap with the sonar's next ping. '''
+        if not self.ping_pending:
+            self.send_transducer_command(self.transmit_angle_grads)
+            self.ping_pending = True
+
+        response = await self.transport.wait_message([definitions.PING360_DEVICE_DATA, definitions.COMMON_NACK],
+                                                     self.ping_time_model.timeout(self.ping_steps_grads),
+                                                     self.is_reply_to_command)
+        self.ping_timing.record('response', self.command_sent_time)
+        ping_start = self.command_start_time
+
+        if response is None:
+            # Nothing is in flight anymore, so the same angle is commanded again on the next iteration
+            self.ping_pending = False
+            self.on_ping_timeout()
+            self.set_output('LAST_ERROR','Timeout: No response to control command')
+            print('Timeout: No response to control command')
+        elif response.name == 'nack':
+            self.ping_pending = False
+            self.ping_timing.nack()
+            self.set_output('LAST_ERROR', 'Control Command Nacked')
+            print('Control Command Nacked')
+        elif response.name == 'device_data':
+            response_time = time.perf_counter() - self.command_time
+            if self.sweep_start_pending:
+                self.publish_sweep_start_slew(response.angle)
+            self.ping_time_model.update(self.ping_steps_grads, response_time)
+            self.on_ping_received()
+
+            # Only advance the transmit angle on success, then immediately command the next ping
+            angle_start = self.ping_timing.now()
+            self.transmit_angle_grads, self.clockwise = self.plan_sweep(response.angle)
+            self.ping_timing.record('angle', angle_start)
+            if self.pending_mail:
+                # The pipeline drains for one ping, so that the mail is applied before the next command
+                self.ping_pending = False
+            else:
+                self.send_transducer_command(self.transmit_angle_grads)
+
+            # Off the critical path: the sonar is already pinging the next angle
+            self.process_ping_data(response)
+            self.publish_transmit_angle()
+            self.ping_timing.ping_complete(ping_start)
+
+    async def transmit_auto(self):
+        ''' Consumes the auto_device_data stream. The sonar steps the head itself, so the transmit angle outputs are
+        taken from the angle reported in each message. '''
+        if not self.auto_transmit_active or self.sonar_setting_changed:
+            self.start_auto_transmit()
+            self.auto_data_time = 0
+
+        # The first ping may follow a slew of up to half a turn to the sector
+        steps_grads = self.inputs['NUM_STEPS']['val'] if self.auto_data_time else 200
+        wait_start = self.ping_timing.now()
+        response = await self.transport.wait_message([definitions.PING360_AUTO_DEVICE_DATA,
+                                                      definitions.COMMON_NACK],
+                                                     self.ping_time_model.timeout(steps_grads),
+                                                     self.is_current_auto_data)
+        self.ping_timing.record('response', wait_start)
+
+        if response is None:
+            self.auto_data_time = 0
+            self.on_ping_timeout()
+            self.set_output('LAST_ERROR','Timeout: No auto transmit data')
+            print('Timeout: No auto transmit data')
+        elif response.name == 'nack':
+            self.ping_timing.nack()
+            self.set_output('LAST_ERROR', 'Auto Transmit Command Nacked')
+            print('Auto Transmit Command Nacked')
+            self.start_auto_transmit()
+            self.auto_data_time = 0
+        elif response.name == 'auto_device_data':
+            # Pings are streamed back to back, so the model is refined from the interval between them
+            data_time = time.perf_counter()
+            if self.auto_data_time:
+                self.ping_time_model.update(steps_grads, data_time - self.auto_data_time)
+            self.auto_data_time = data_time
+            self.command_angle_grads = response.angle
+            self.on_ping_received()
+            self.process_ping_data(response)
+
+            self.transmit_angle_grads = response.angle
+            self.set_output('TRANSMIT_ANGLE_GRADS', self.transmit_angle_grads)
+            self.set_output('TRANSMIT_ANGLE_DEGS', self.transmit_angle_grads * 360 / 400)
+            self.ping_timing.ping_complete(wait_start)
+
+    async def run_state_machine(self):
+        while True:
+            # Mail is applied between pings, so each ping is commanded & processed with one configuration. While a
+            # pipelined ping is in flight, it waits until the ping's data has been processed.
+            if self.pending_mail and not self.ping_pending:
+                self.apply_mail()
+
+            state = self.outputs['STATE']
+
+            if (state == State.DB_DISCONNECTED.name):
+                # State will be changed to DB_CONNECTED in on_connect
+                await self.wait_for_event()
+
+            elif (state == State.DB_CONNECTED.name):
+                backoff_time = self.reconnect_time - time.monotonic()
+                if self.inputs['DEVICE_COMMS_ENABLE']['val'] == 0:
+                    await self.wait_for_event()
+                elif backoff_time > 0:
+                    # Mail is still processed while backing off
+                    await self.wait_for_event(backoff_time)
+                # initialize() blocks while waiting for the sonar, so it runs outside the event loop
+                elif (await self.loop.run_in_executor(None, self.connect_to_sonar)):
+                    # The response times of a new connection are learnt afresh, and the head angle is unknown
+                    self.ping_time_model.reset()
+                    self.command_angle_grads = None
+                    self.transport.attach(self.loop)
+                    self.set_output('STATE', State.READY_TO_TRANSMIT.name)
+                    print ('STATE: READY_TO_TRANSMIT')
+                else:
+                    self.set_output('LAST_ERROR', 'Failed to initialize sonar')
+                    self.disconnect_from_sonar()
+                    self.schedule_reconnect()
+
+            elif (state == State.READY_TO_TRANSMIT.name):
+                if self.inputs ['DEVICE_COMMS_ENABLE']['val'] == 0:
+                    self.disconnect_from_sonar()
+                    self.reconnect_attempts = 0
+                    self.reconnect_time = 0
+                    self.set_output('STATE', State.DB_CONNECTED.name)
+                    print('STATE: DB_CONNECTED')
+                elif self.transport.error is not None:
+                    self.on_link_lost(self.transport.error)
+                elif self.inputs['TRANSMIT_ENABLE']['val'] == 1:
+                    self.scan_sector_changed = False # the sweep starts with the current sector & mode
+                    self.scan_mode_changed = False
+                    self.auto_transmit_active = False
+                    self.ping_pending = False
+                    self.sweep_start_pending = False
+                    self.sector_ping_count = 0
+                    self.transport.flush()
+
+                    # After a reconnection, the sweep resumes where it was interrupted
+                    if self.resume_angle_grads is not None and \
+                            angle_within(self.resume_angle_grads, self.inputs['START_ANGLE_GRADS']['val'],
+                                         self.inputs['STOP_ANGLE_GRADS']['val']):
+                        self.transmit_angle_grads = self.resume_angle_grads
+                    elif self.inputs['SCAN_MODE']['val'] == ScanMode.AUTO_TRANSMIT.value:
+                        # The sonar sweeps from the start angle by itself
+                        self.transmit_angle_grads = self.inputs['START_ANGLE_GRADS']['val']%400
+                    else:
+                        await self.calc_initial_transmit_angle()
+                    self.resume_angle_grads = None
+                    self.set_output('STATE',State.TRANSMITTING.name)
+                    self.sector_scan_start_time = time.time()
+                    print('STATE: TRANSMITTING')
+                else:
+                    await self.wait_for_event()
+
+            elif (state == State.TRANSMITTING.name):
+                try:
+                    if self.inputs['DEVICE_COMMS_ENABLE']['val'] == 0:
+                        self.ping_360.control_motor_off()
+                        self.auto_transmit_active = False
+                        self.ping_pending = False
+                        self.disconnect_from_sonar()
+                        self.reconnect_attempts = 0
+                        self.reconnect_time = 0
+                        self.set_output('STATE', State.DB_CONNECTED.name)
+                        print('STATE: DB_CONNECTED')
+                    elif self.scan_mode_changed or self.inputs['TRANSMIT_ENABLE']['val'] == 0:
+                        # A change of scan mode restarts the sweep from READY_TO_TRANSMIT
+                        self.reconfigure_time = time.perf_counter() if self.scan_mode_changed else 0
+                        self.ping_360.control_motor_off()
+                        self.auto_transmit_active = False
+                        self.ping_pending = False
+                        self.set_output('STATE', State.READY_TO_TRANSMIT.name)
+                        print('STATE: READY_TO_TRANSMIT')
+                        self.scan_sector_changed = False
+                        self.scan_mode_changed = False
+
+                    else:
+                        # A new scan sector is applied between pings, while the head keeps moving
+                        if self.scan_sector_changed:
+                            self.retarget_sector()
+
+                        if self.inputs['SCAN_MODE']['val'] == ScanMode.AUTO_TRANSMIT.value:
+                            await self.transmit_auto()
+                        elif self.inputs['SCAN_MODE']['val'] == ScanMode.PIPELINED.value:
+                            await self.transmit_pipelined()
+                        else:
+                            await self.transmit_per_ping()
+                        await self.check_link()
+                except OSError as e: # Sending to the sonar failed
+                    self.on_link_lost(e)
+
+                if self.ping_timing.due():
+                    self.publish_timing()
+
+    async def run(self):
+        ''' Runs the device until it is cancelled '''
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.wakeup = asyncio.Event()
+        self.mail_handlers = self.build_mail_handlers()
+
+        # Create the shared memory ring buffer before the DB connects, so that it exists once SHM_RING is published
+        if self.shm_ring_name:
+            try:
+                self.ping_ring = PingRingWriter(self.shm_ring_name, self.shm_ring_slots,
+                                                self.inputs['NUMBER_OF_SAMPLES']['max'])
+            except FileExistsError as e:
+                # The segment belongs to a running writer, which must not be disturbed
+                print('Shared memory ring buffer disabled: {0}'.format(e))
+                self.outputs['LAST_ERROR'] = 'Shared memory ring buffer disabled: {0}'.format(e)
+                self.outputs['SHM_RING'] = ''
+
+        publish_task = asyncio.ensure_future(self.run_timed_publications())
+        self.ready.set()
+        try:
+            await self.run_state_machine()
+        finally:
+            publish_task.cancel()
+            self.transport.detach()
+            self.ping360_logger.close_log_file()
+            if self.ping_ring is not None:
+                self.ping_ring.close()
+
+    def start(self):
+        ''' Runs the device in its own worker thread. Returns once it is ready for mail. '''
+        self.thread = threading.Thread(target=self.run_worker, name='Ping360Device {0}'.format(self.name),
+                                       daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def run_worker(self):
+        try:
+            asyncio.run(self.run())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.ready.set() # in case run() failed before the device was ready
+
+    def stop(self):
+        ''' Stops the device's worker thread, and waits for it to finish '''
+        if self.thread is None or not self.thread.is_alive():
+            return
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
@@ -2,7 +2,11 @@
 
 # TODO: Remove imports which are not required
 import sys
+import os
 import struct
+import queue
+import threading
+import time
 from argparse import ArgumentParser
 from brping import PingParser
 from dataclasses import dataclass
@@ -66,68 +70,250 @@ class Header:
     """
 
 
+# Queued by sector_complete() in asynchronous mode, so that the writer thread syncs the file to disk
+SECTOR_SYNC = 'sector_sync'
+
+
 class Ping360Logger():
+    ''' Writes PingViewer sensor log files. Structured as a big-endian sequence of size: int32, data: byte_array[size],
+    with strings encoded as UTF-16-BE. Each record is assembled in a preallocated buffer and written with a single
+    file write; the file is flushed according to the flush policy (see set_flush_policy). '''
+
+    # big-endian int32 sizes and header values -> only compile once
+    INT = struct.Struct('>i')
+    TEXT_ENCODING = 'UTF-16-BE'
+    # Record prefix for the fixed length hh:mm:ss.xxx timestamp: size, UTF-16-BE timestamp, message size
+    RECORD_PREFIX = struct.Struct('>i24si')
+    # Initial record buffer size: timestamp + longest ping message (id:2301) w/ 1200 samples. Grown if required.
+    RECORD_BUFFER_SIZE = 2 * INT.size + 12 * 2 + 1230
+    # Size of the file's write buffer, records are written to disk when it fills or the file is flushed
+    FILE_BUFFER_SIZE = 64 * 1024
+    # Maximum number of queued records written by the writer thread in one batch
+    WRITE_BATCH_SIZE = 64
+    # Minimum period over which the write throughput is averaged [s]
+    WRITE_RATE_PERIOD = 1.0
+
     def __init__(self):
         self.file = None
         self.header = Header()
         self.messages = []
         self.status = "Disabled"
 
+        # Asynchronous logging: records are queued by log_message() and written by a writer thread
+        self.async_write = False
+        self.queue_size = 1000
+        self.drop_when_full = False
+        self.queue = None
+        self.writer = None
+        self.dropped_records = 0
+
+        # Write throughput
+        self.bytes_written = 0
+        self.write_rate = 0.0 # [bytes/s]
+        self.rate_start_time = time.time()
+        self.rate_start_bytes = 0
+
+        # Record encoding buffer, reused for every record
+        self.record_buffer = bytearray(self.RECORD_BUFFER_SIZE)
+        self.record_view = memoryview(self.record_buffer)
+
+        # Flush policy, 0/False disables each condition
+        self.flush_records = 0
+        self.flush_interval_ms = 0
+        self.fsync_on_sector = False
+        self.records_since_flush = 0
+        self.last_flush_time = time.monotonic()
+
+    def set_async_mode(self, async_write, queue_size=1000, drop_when_full=False):
+        ''' Selects asynchronous logging, which takes effect when the next file is created. With drop_when_full,
+        records are dropped (and counted in dropped_records) when the queue is full, otherwise log_message() blocks
+        until the writer thread has made space. '''
+        self.async_write = async_write
+        self.queue_size = queue_size
+        self.drop_when_full = drop_when_full
+
+    def set_flush_policy(self, flush_records=0, flush_interval_ms=0, fsync_on_sector=False):
+        ''' Flushes the file every flush_records records and/or when flush_interval_ms has elapsed since the last
+        flush. With fsync_on_sector, the file is also flushed and synced to disk by sector_complete(). If no
+        condition is set, data is only written when the file buffer fills and when the file is closed. '''
+        self.flush_records = flush_records
+        self.flush_interval_ms = flush_interval_ms
+        self.fsync_on_sector = fsync_on_sector
+
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
     def file_write(self, data):
         try:
             self.file.write(data)
+            self.bytes_written += len(data)
             self.status = "Enabled"
         except IOError as e:
             self.status = f"""Error: {e}"""
 
-    def pack_int(self, data: int):
-        data_format = '>1i'
-        packed_data = struct.Struct(data_format).pack(data)
-        self.file_write(packed_data)
+    def poll_write_rate(self):
+        ''' Updates the write rate while no records are being logged, so that it decays to 0. In asynchronous mode
+        the writer thread does this itself. '''
+        if self.writer is None:
+            self.update_write_rate()
 
-    def pack_array(self, array: bytearray):
-        self.pack_int(len(array))
-        self.file_write(array)
+    def update_write_rate(self):
+        now = time.time()
+        elapsed = now - self.rate_start_time
+        if elapsed >= self.WRITE_RATE_PERIOD:
+            self.write_rate = (self.bytes_written - self.rate_start_bytes) / elapsed
+            self.rate_start_time = now
+            self.rate_start_bytes = self.bytes_written
 
-    def pack_string(self, text: str):
-        encoding = 'UTF-16-BE'
-        encoded_text = text.encode(encoding)
-        self.pack_int(len(encoded_text.decode()))
-        self.file_write(encoded_text)
+    def encode_text(self, buffer, offset, text: str):
+        ''' Packs a size prefixed UTF-16-BE string into buffer at offset, returns the offset following it '''
+        encoded_text = text.encode(self.TEXT_ENCODING)
+        self.INT.pack_into(buffer, offset, len(encoded_text))
+        offset += self.INT.size
+        buffer[offset:offset + len(encoded_text)] = encoded_text
+        return offset + len(encoded_text)
 
     def pack_header(self):
-        self.pack_string(self.header.string)
-        self.pack_int(self.header.version)
+        build_info = self.header.ping_viewer_build_info
+        texts = [self.header.string, build_info.hash_commit, build_info.date, build_info.tag, build_info.os_name,
+                 build_info.os_version]
+        buffer = bytearray(sum(len(text.encode(self.TEXT_ENCODING)) for text in texts) + 9 * self.INT.size)
+
+        offset = self.encode_text(buffer, 0, self.header.string)
+        self.INT.pack_into(buffer, offset, self.header.version)
+        offset += self.INT.size
+
+        for text in texts[1:]:
+            offset = self.encode_text(buffer, offset, text)
+
+        self.INT.pack_into(buffer, offset, self.header.sensor.family)
+        self.INT.pack_into(buffer, offset + self.INT.size, self.header.sensor.type_sensor)
+        self.file_write(buffer)
+
+    def encode_record(self, timestamp, msg_data):
+        ''' Assembles the timestamp & message record in the record buffer, returns a view of the encoded record '''
+        encoded_timestamp = timestamp.encode(self.TEXT_ENCODING)
+        data_length = len(msg_data)
+        record_length = self.RECORD_PREFIX.size + data_length
+        if record_length > len(self.record_buffer):
+            self.record_view.release()
+            self.record_buffer = bytearray(record_length + len(encoded_timestamp))
+            self.record_view = memoryview(self.record_buffer)
+
+        if len(encoded_timestamp) == 24:
+            self.RECORD_PREFIX.pack_into(self.record_buffer, 0, 24, encoded_timestamp, data_length)
+            offset = self.RECORD_PREFIX.size
+        else:
+            offset = self.encode_text(self.record_buffer, 0, timestamp)
+            self.INT.pack_into(self.record_buffer, offset, data_length)
+            offset += self.INT.size
+            record_length = offset + data_length
 
-        self.pack_string(self.header.ping_viewer_build_info.hash_commit)
-        self.pack_string(self.header.ping_viewer_build_info.date)
-        self.pack_string(self.header.ping_viewer_build_info.tag)
-        self.pack_string(self.header.ping_viewer_build_info.os_name)
-        self.pack_string(self.header.ping_viewer_build_info.os_version)
+        self.record_buffer[offset:record_length] = msg_data
+        return self.record_view[:record_length]
 
-        self.pack_int(self.header.sensor.family)
-        self.pack_int(self.header.sensor.type_sensor)
+    def flush(self, sync=False):
+        try:
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+        except (OSError, IOError) as e:
+            self.status = f"""Error: {e}"""
+        self.records_since_flush = 0
+        self.last_flush_time = time.monotonic()
+
+    def write_record(self, timestamp, msg_data):
+        self.file_write(self.encode_record(timestamp, msg_data))
+
+        self.records_since_flush += 1
+        if (self.flush_records and self.records_since_flush >= self.flush_records) or \
+           (self.flush_interval_ms and (time.monotonic() - self.last_flush_time) * 1000 >= self.flush_interval_ms):
+            self.flush()
+
+    def sector_complete(self):
+        ''' Called when a sector scan completes. Syncs the file to disk if fsync_on_sector is set. '''
+        if self.file is None or not self.fsync_on_sector:
+            return
+
+        if self.queue is None:
+            self.flush(sync=True)
+        else:
+            try:
+                self.queue.put_nowait(SECTOR_SYNC)
+            except queue.Full:
+                pass # The writer is behind, so the sync is skipped for this sector
 
     def log_message(self, msg_data):
         '''Logs the msg_data bytearray to the file with the current timestamp.
         Returns if no file is open for logging'''
         if self.file is None:
             return
-        timestamp = str(datetime.now().time())[:-3]
-        self.pack_string(timestamp)
-        self.pack_array(msg_data)
+        timestamp = datetime.now().strftime('%H:%M:%S.%f')[:-3]
 
-    def create_new_file(self, dir):
+        if self.queue is None:
+            self.write_record(timestamp, msg_data)
+            self.update_write_rate()
+        elif self.drop_when_full:
+            try:
+                self.queue.put_nowait((timestamp, bytes(msg_data)))
+            except queue.Full:
+                self.dropped_records += 1
+        else:
+            self.queue.put((timestamp, bytes(msg_data)))
+
+    def run_writer(self):
+        ''' Writer thread: drains the queue in batches until the None sentinel is received '''
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get(timeout=self.WRITE_RATE_PERIOD)]
+            except queue.Empty:
+                self.update_write_rate() # Nothing written for a period
+                continue
+            while len(batch) < self.WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is None:
+                    running = False
+                    break
+                elif record is SECTOR_SYNC:
+                    self.flush(sync=True)
+                else:
+                    self.write_record(*record)
+            self.update_write_rate()
+
+    def start_writer(self):
+        self.queue = queue.Queue(self.queue_size)
+        self.writer = threading.Thread(target=self.run_writer, name='Ping360LoggerWriter', daemon=True)
+        self.writer.start()
+
+    def stop_writer(self):
+        ''' Writes any queued records, then stops the writer thread '''
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+            self.queue = None
+
+    def create_new_file(self, dir, label=''):
         '''Closes any existing file, opens a new file in the specified dir and adds the header data.
-        The file name format is ping360_<YYYYMMDD>_<HHMMSS>.bin '''
+        The file name format is ping360_<YYYYMMDD>_<HHMMSS>.bin, or ping360_<label>_<YYYYMMDD>_<HHMMSS>.bin if a
+        label (e.g. the device name) is given '''
         if self.file is not None:
+            self.stop_writer()
             self.file.close()
             self.file = None
 
         date_time = datetime.strftime(datetime.now(), '%Y%m%d_%H%M%S')
+        if label:
+            date_time = f"""{label}_{date_time}"""
         file_name = f"""{dir}ping360_{date_time}.bin"""
         try:
-            self.file = open(file_name, 'wb')
+            self.file = open(file_name, 'wb', buffering=self.FILE_BUFFER_SIZE)
         except (OSError, IOError) as e:
             print(e)
             self.status = f"""Error: {e}"""
@@ -135,9 +321,19 @@ class Ping360Logger():
 
         self.pack_header()
         self.status = "Enabled"
+        self.rate_start_time = time.time()
+        self.rate_start_bytes = self.bytes_written
+        self.records_since_flush = 0
+        self.last_flush_time = time.monotonic()
+
+        if self.async_write:
+            self.start_writer()
         return True
 
     def close_log_file(self):
+        self.stop_writer()
         if self.file is not None:
             self.file.close()
-        self.status = "Disabled"
\ No newline at end of file
+            self.file = None
+        self.status = "Disabled"
+        self.write_rate = 0.0
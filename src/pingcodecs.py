@@ -0,0 +1,122 @@
+import re
+import struct
+import zlib
+
+
+class PingDataEncoder():
+    ''' Encodes device_data/auto_device_data pings into compact messages for low bandwidth links. The codec is a comma
+    separated list of stages, applied in this order whatever order they are listed in:
+        bin<N>  range binning, each output sample is the mean of N adjacent samples
+        4bit    quantisation to 16 levels, two samples per byte
+        delta   XOR against the previous ping at the same angle, so unchanged samples become zero. Every
+                key_interval'th ping at an angle is sent without delta so that decoders resynchronise after a loss
+        rle     run-length encoding, (count, value) byte pairs
+        zlib    zlib compression
+    e.g. 'bin2,4bit,delta,zlib'. utils/decode_ping_compact.py is the reference decoder.
+
+    Message format (little-endian): the HEADER fields below followed by the encoded samples. number_of_samples is
+    the ping's sample count before binning; flags is a combination of the FLAG_ values; sequence counts the pings
+    at the angle since its last key ping (0 for a key ping, modulo 256), so that decoders can tell when the
+    reference of a delta encoded ping was lost. '''
+
+    # magic, flags, angle, gain_setting, transmit_duration, sample_period, transmit_frequency, number_of_samples,
+    # bin_size, sequence
+    HEADER = struct.Struct('<2sBHBHHHHBB')
+    MAGIC = b'PC'
+    FLAG_4BIT = 0x01
+    FLAG_DELTA = 0x02
+    FLAG_RLE = 0x04
+    FLAG_ZLIB = 0x08
+
+    MAX_BIN_SIZE = 64
+    # Runs are split at this length so that counts fit in a byte
+    RLE_RUN = re.compile(rb'(.)\1{0,254}', re.DOTALL)
+    QUANTIZE_4BIT = bytes(value >> 4 for value in range(256))
+
+    def __init__(self, codec='', key_interval=10):
+        self.bin_size = 1
+        self.flags = 0
+        self.key_interval = key_interval
+        self.previous = {} # angle -> (quantised samples of the previous ping, pings since the last key ping)
+
+        for stage in [stage.strip().lower() for stage in codec.split(',') if stage.strip()]:
+            if stage.startswith('bin') and stage[3:].isdigit() and 1 <= int(stage[3:]) <= self.MAX_BIN_SIZE:
+                self.bin_size = int(stage[3:])
+            elif stage == '4bit':
+                self.flags |= self.FLAG_4BIT
+            elif stage == 'delta':
+                self.flags |= self.FLAG_DELTA
+            elif stage == 'rle':
+                self.flags |= self.FLAG_RLE
+            elif stage == 'zlib':
+                self.flags |= self.FLAG_ZLIB
+            else:
+                raise ValueError("Invalid codec stage ({0})".format(stage))
+
+        if self.flags & self.FLAG_RLE and self.flags & self.FLAG_ZLIB:
+            raise ValueError("Only one of rle and zlib can be used")
+
+    def bin(self, data):
+        ''' Returns the mean of each bin_size samples (the last bin may be shorter) '''
+        size = self.bin_size
+        if size == 1:
+            return bytes(data)
+        # Whole bins are summed by zipping size strided slices, which is several times faster than slicing each bin
+        full = len(data) // size * size
+        binned = bytes([sum(samples) // size for samples in zip(*[data[k:full:size] for k in range(size)])])
+        if full < len(data):
+            binned += bytes([sum(data[full:]) // (len(data) - full)])
+        return binned
+
+    @staticmethod
+    def xor(a, b):
+        ''' Returns the byte-wise XOR of two equal length byte strings '''
+        return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+    @staticmethod
+    def pack_4bit(levels):
+        ''' Packs 4 bit levels two per byte, the first in the high nibble '''
+        if len(levels) % 2:
+            levels += b'\x00'
+        high = int.from_bytes(levels[0::2], 'big')
+        low = int.from_bytes(levels[1::2], 'big')
+        return ((high << 4) | low).to_bytes(len(levels) // 2, 'big')
+
+    def rle(self, data):
+        ''' Returns (run length, value) byte pairs for each run of equal bytes '''
+        return b''.join(bytes((match.end() - match.start(), data[match.start()]))
+                        for match in self.RLE_RUN.finditer(data))
+
+    def encode(self, ping):
+        ''' Returns the compact message for a device_data or auto_device_data message '''
+        flags = self.flags & ~self.FLAG_DELTA
+        sequence = 0
+        samples = self.bin(ping.data)
+        if flags & self.FLAG_4BIT:
+            samples = samples.translate(self.QUANTIZE_4BIT)
+
+        if self.flags & self.FLAG_DELTA:
+            previous, count = self.previous.get(ping.angle, (None, 0))
+            if previous is not None and len(previous) == len(samples) and \
+                    (not self.key_interval or count % self.key_interval):
+                self.previous[ping.angle] = (samples, count + 1)
+                flags |= self.FLAG_DELTA
+                sequence = count % 256
+                samples = self.xor(samples, previous)
+            else:
+                self.previous[ping.angle] = (samples, 1)
+
+        if flags & self.FLAG_4BIT:
+            samples = self.pack_4bit(samples)
+        if flags & self.FLAG_RLE:
+            samples = self.rle(samples)
+        elif flags & self.FLAG_ZLIB:
+            samples = zlib.compress(samples)
+
+        return self.HEADER.pack(self.MAGIC, flags, ping.angle, ping.gain_setting, ping.transmit_duration,
+                                ping.sample_period, ping.transmit_frequency, len(ping.data),
+                                self.bin_size, sequence) + samples
+
+    def reset(self):
+        ''' Forgets the previous pings, so that the next ping at each angle is sent whole '''
+        self.previous = {}
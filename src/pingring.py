@@ -0,0 +1,211 @@
+import os
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+
+class PingRing():
+    ''' Layout of the shared memory ring buffer of pings written by iPing360Device (see PingRingWriter) and read by
+    co-located processes (see PingRingReader). All fields are little-endian.
+
+    The segment starts with HEADER, followed by num_slots slots of slot_size bytes. Each slot starts with a lock
+    word and SLOT_HEADER, followed by max_samples bytes for the intensity samples. Ping n (counting from 0) is
+    written to slot n % num_slots, and write_count in the header is the number of pings written so far.
+
+    Slots are protected by a sequence lock: the writer sets a slot's lock to 2n + 1 before writing ping n to it and
+    to 2n + 2 once it is complete. A reader has a consistent ping n if the lock reads 2n + 2 both before and after
+    it reads the slot, so there is one writer, any number of readers, and the writer never waits for readers. '''
+
+    MAGIC = b'P360RING'
+    VERSION = 2
+    # magic, version, num_slots, slot_size, max_samples, write_count, writer_pid
+    HEADER = struct.Struct('<8sIIIIQQ')
+    WRITE_COUNT_OFFSET = 24
+    WORD = struct.Struct('<Q') # slot locks and write_count
+    # message_id, angle, gain_setting, transmit_duration, sample_period, transmit_frequency, number_of_samples,
+    # time [epoch seconds]
+    SLOT_HEADER = struct.Struct('<HHBHHHHd')
+    SLOT_ALIGNMENT = 64
+
+    @classmethod
+    def slot_size(cls, max_samples):
+        size = cls.WORD.size + cls.SLOT_HEADER.size + max_samples
+        return -(-size // cls.SLOT_ALIGNMENT) * cls.SLOT_ALIGNMENT
+
+    @classmethod
+    def layout(cls, name, num_slots, max_samples):
+        ''' Returns the description of a ring buffer published in the SHM_RING MOOS variable '''
+        return 'name={0},version={1},slots={2},slot_size={3},max_samples={4},header_size={5}'.format(
+            name, cls.VERSION, num_slots, cls.slot_size(max_samples), max_samples, cls.HEADER.size)
+
+
+class PingRingWriter(PingRing):
+    ''' Creates a ring buffer in a new POSIX shared memory segment and writes pings to it '''
+
+    def __init__(self, name, num_slots=256, max_samples=1200):
+        self.name = name
+        self.num_slots = num_slots
+        self.max_samples = max_samples
+        self.slot_size_bytes = self.slot_size(max_samples)
+        self.write_count = 0
+
+        size = self.HEADER.size + num_slots * self.slot_size_bytes
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            self.reclaim(name)
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.buffer = self.shm.buf
+        self.HEADER.pack_into(self.buffer, 0, self.MAGIC, self.VERSION, num_slots, self.slot_size_bytes, max_samples,
+                              0, os.getpid())
+
+    @classmethod
+    def reclaim(cls, name):
+        ''' Removes an existing segment if it is a ring buffer left behind by a writer which did not exit cleanly.
+        Raises FileExistsError if the segment is anything else, or if its writer is still running, as readers may be
+        attached to it. '''
+        shm = shared_memory.SharedMemory(name)
+        writer_pid = None
+        try:
+            if shm.size < cls.HEADER.size:
+                error = 'Shared memory {0} exists and is not a ping ring buffer'.format(name)
+            else:
+                magic, version, _, _, _, _, writer_pid = cls.HEADER.unpack_from(shm.buf, 0)
+                if magic != cls.MAGIC or version != cls.VERSION:
+                    error = 'Shared memory {0} exists and is not a version {1} ping ring buffer'.format(name,
+                                                                                                     cls.VERSION)
+                elif cls.process_running(writer_pid):
+                    error = 'Ping ring buffer {0} is in use by process {1}'.format(name, writer_pid)
+                else:
+                    error = None
+        finally:
+            shm.close()
+
+        if error is None:
+            shm.unlink()
+            return
+        # Attaching registered the segment with this process's resource tracker, which would remove it on exit
+        if writer_pid != os.getpid():
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        raise FileExistsError(error)
+
+    @staticmethod
+    def process_running(pid):
+        if pid == os.getpid():
+            return True # e.g. another device of this app
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass # Running as another user
+        return True
+
+    def write(self, ping):
+        ''' Writes a device_data or auto_device_data message to the next slot. Samples beyond max_samples are not
+        stored. '''
+        count = self.write_count
+        slot_offset = self.HEADER.size + (count % self.num_slots) * self.slot_size_bytes
+        header_offset = slot_offset + self.WORD.size
+        data_offset = header_offset + self.SLOT_HEADER.size
+        num_samples = min(len(ping.data), self.max_samples)
+
+        self.WORD.pack_into(self.buffer, slot_offset, 2 * count + 1)
+        self.SLOT_HEADER.pack_into(self.buffer, header_offset, ping.message_id, ping.angle, ping.gain_setting,
+                                   ping.transmit_duration, ping.sample_period, ping.transmit_frequency, num_samples,
+                                   time.time())
+        self.buffer[data_offset:data_offset + num_samples] = ping.data[:num_samples]
+        self.WORD.pack_into(self.buffer, slot_offset, 2 * count + 2)
+
+        self.write_count = count + 1
+        self.WORD.pack_into(self.buffer, self.WRITE_COUNT_OFFSET, self.write_count)
+
+    def close(self):
+        ''' Closes and removes the segment '''
+        self.buffer = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RingPing():
+    ''' A ping in the ring buffer. 'data' is a memoryview of the samples in shared memory, not a copy, so it is only
+    valid until the writer reuses the slot, num_slots pings later. Call valid() after using the data to check that
+    it was not overwritten in the meantime. '''
+    __slots__ = ('reader', 'sequence', 'message_id', 'angle', 'gain_setting', 'transmit_duration', 'sample_period',
+                 'transmit_frequency', 'number_of_samples', 'time', 'data')
+
+    def valid(self):
+        return self.reader.slot_lock(self.sequence) == 2 * self.sequence + 2
+
+
+class PingRingReader(PingRing):
+    ''' Maps a ring buffer created by PingRingWriter and reads its pings without copying them. Readers only read the
+    segment, so any number of processes can read it at once. '''
+
+    def __init__(self, name):
+        self.shm = self.attach(name)
+        self.buffer = self.shm.buf
+        magic, version, self.num_slots, self.slot_size_bytes, self.max_samples, _, _ = \
+            self.HEADER.unpack_from(self.buffer, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise ValueError('{0} is not a version {1} ping ring buffer'.format(name, self.VERSION))
+        self.next_sequence = self.write_count() # Only pings written from now on are read
+        self.lost = 0 # Pings overwritten before they were read
+
+    @staticmethod
+    def attach(name):
+        try:
+            return shared_memory.SharedMemory(name, track=False) # Python 3.13+
+        except TypeError:
+            pass
+        # Before Python 3.13 the resource tracker unlinks segments which this process only attached to when it
+        # exits, which would remove the segment from under the app
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+    def write_count(self):
+        return self.WORD.unpack_from(self.buffer, self.WRITE_COUNT_OFFSET)[0]
+
+    def slot_offset(self, sequence):
+        return self.HEADER.size + (sequence % self.num_slots) * self.slot_size_bytes
+
+    def slot_lock(self, sequence):
+        return self.WORD.unpack_from(self.buffer, self.slot_offset(sequence))[0]
+
+    def read(self):
+        ''' Returns the next unread ping, or None if there is none yet. If the writer has overtaken the reader, the
+        pings which were overwritten are skipped and counted in 'lost'. '''
+        while True:
+            write_count = self.write_count()
+            if self.next_sequence >= write_count:
+                return None
+            if write_count - self.next_sequence > self.num_slots:
+                self.lost += write_count - self.num_slots - self.next_sequence
+                self.next_sequence = write_count - self.num_slots
+
+            sequence = self.next_sequence
+            offset = self.slot_offset(sequence)
+            lock = self.WORD.unpack_from(self.buffer, offset)[0]
+            fields = self.SLOT_HEADER.unpack_from(self.buffer, offset + self.WORD.size)
+            if lock != 2 * sequence + 2 or self.slot_lock(sequence) != lock:
+                # Being overwritten by a later ping, the reader has fallen a whole ring behind
+                self.lost += 1
+                self.next_sequence += 1
+                continue
+
+            ping = RingPing()
+            ping.reader = self
+            ping.sequence = sequence
+            ping.message_id, ping.angle, ping.gain_setting, ping.transmit_duration, ping.sample_period, \
+                ping.transmit_frequency, ping.number_of_samples, ping.time = fields
+            data_offset = offset + self.WORD.size + self.SLOT_HEADER.size
+            ping.data = self.buffer[data_offset:data_offset + ping.number_of_samples]
+            self.next_sequence += 1
+            return ping
+
+    def close(self):
+        ''' Unmaps the segment. The data of any RingPing still in use must be released first. '''
+        self.buffer = None
+        self.shm.close()
@@ -0,0 +1,214 @@
+import math
+import time
+
+
+class LatencyHistogram():
+    ''' Streaming histogram of durations, with logarithmically spaced buckets so that percentiles are within
+    (RATIO - 1) of the true value from MIN_TIME to MAX_TIME, in constant memory '''
+
+    MIN_TIME = 1e-6  # [s]
+    MAX_TIME = 100.0  # [s]
+    RATIO = 1.05
+    NUM_BUCKETS = math.ceil(math.log(MAX_TIME / MIN_TIME) / math.log(RATIO)) + 1
+
+    def __init__(self):
+        self.counts = [0] * self.NUM_BUCKETS
+        self.count = 0
+
+    def record(self, duration):
+        if duration <= self.MIN_TIME:
+            bucket = 0
+        else:
+            bucket = min(int(math.log(duration / self.MIN_TIME) / math.log(self.RATIO)) + 1, self.NUM_BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+
+    def percentile(self, percent):
+        ''' Returns the duration (the upper edge of its bucket) below which 'percent' of the durations fall, or 0 if
+        none have been recorded '''
+        if not self.count:
+            return 0
+        rank = math.ceil(self.count * percent / 100)
+        total = 0
+        for bucket, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return self.MIN_TIME * self.RATIO ** bucket
+        return self.MAX_TIME
+
+    def reset(self):
+        self.counts = [0] * self.NUM_BUCKETS
+        self.count = 0
+
+
+class PingTiming():
+    ''' Times the stages of each ping and counts pings, timeouts and NACKs over a reporting period. While disabled,
+    now() and record() return 0 without reading the clock, so instrumented code costs a method call per stage. '''
+
+    STAGES = ['command', 'response', 'angle', 'publish', 'log', 'total']
+
+    def __init__(self, period=5.0):
+        self.enabled = False
+        self.period = period  # [s] between reports
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.reset()
+
+    def set_enabled(self, enabled):
+        if enabled and not self.enabled:
+            self.reset()
+        self.enabled = enabled
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.pings = 0
+        self.timeouts = 0
+        self.nacks = 0
+        self.period_start = time.perf_counter()
+
+    def now(self):
+        return time.perf_counter() if self.enabled else 0
+
+    def record(self, stage, start):
+        ''' Records the time since 'start' (from now()) for the stage. Returns the current time, for timing the next
+        stage. '''
+        if not self.enabled:
+            return 0
+        now = time.perf_counter()
+        self.histograms[stage].record(now - start)
+        return now
+
+    def ping_complete(self, start):
+        ''' Records the total time of a ping started at 'start' '''
+        if self.enabled:
+            self.record('total', start)
+            self.pings += 1
+
+    def timeout(self):
+        self.timeouts += 1
+
+    def nack(self):
+        self.nacks += 1
+
+    def due(self):
+        return self.enabled and time.perf_counter() - self.period_start >= self.period
+
+    def report(self):
+        ''' Returns the statistics of the period so far, and starts a new period '''
+        elapsed = time.perf_counter() - self.period_start
+        attempts = self.pings + self.timeouts + self.nacks
+        report = {
+            'pings_per_sec': self.pings / elapsed if elapsed > 0 else 0,
+            'timeout_rate': self.timeouts / attempts if attempts else 0,
+            'nack_rate': self.nacks / attempts if attempts else 0,
+            'latency_ms': {stage: [histogram.percentile(percent) * 1000 for percent in (50, 95, 99)]
+                           for stage, histogram in self.histograms.items() if histogram.count},
+        }
+        self.reset()
+        return report
+
+
+class PingTimeModel():
+    ''' Predicts the time from commanding a ping to receiving its data: the head step, the transmit pulse, the
+    acquisition of the samples (sample period x number of samples), plus a fixed overhead (communication & firmware
+    processing) which is learnt online from the measured response times, along with their variability. The response
+    timeout is set from the prediction, so that it follows the range & number of samples. '''
+
+    SAMPLE_PERIOD_TICK = 25e-9  # [s]
+    GAIN = 0.1  # of the exponentially weighted moving averages of the overhead and its deviation
+
+    def __init__(self, step_time=0.001, overhead=0.005, margin=4.0, min_timeout=0.02, max_timeout=2.0):
+        self.step_time = step_time  # [s] per gradian of head movement
+        self.margin = margin  # timeout = predicted time + margin deviations
+        self.min_timeout = min_timeout  # [s]
+        self.max_timeout = max_timeout  # [s]
+        self.initial_overhead = overhead  # [s]
+        self.acquisition_time = 0
+        self.reset()
+
+    def reset(self):
+        ''' Forgets the learnt overhead, e.g. when the connection to the sonar changes '''
+        self.overhead = self.initial_overhead
+        self.deviation = self.initial_overhead
+
+    def configure(self, transmit_duration_usec, sample_period_ticks, number_of_samples):
+        ''' Updates the sonar settings, from calculate_sample_period_and_transmit_duration() '''
+        self.acquisition_time = transmit_duration_usec * 1e-6 + \
+                                sample_period_ticks * self.SAMPLE_PERIOD_TICK * number_of_samples
+
+    def expected_ping_time(self, steps_grads):
+        return steps_grads * self.step_time + self.acquisition_time + self.overhead
+
+    def timeout(self, steps_grads):
+        ''' Returns the response timeout for a ping after the head moves 'steps_grads' '''
+        timeout = self.expected_ping_time(steps_grads) + self.margin * self.deviation
+        return min(self.max_timeout, max(self.min_timeout, timeout))
+
+    def expected_sector_time(self, num_pings, steps_grads):
+        ''' Returns the expected time to scan a sector of 'num_pings' pings, 'steps_grads' apart '''
+        return num_pings * self.expected_ping_time(steps_grads)
+
+    def update(self, steps_grads, response_time):
+        ''' Refines the overhead from the measured response time of a ping '''
+        error = response_time - steps_grads * self.step_time - self.acquisition_time - self.overhead
+        self.overhead = max(0.0, self.overhead + self.GAIN * error)
+        self.deviation += self.GAIN * (abs(error) - self.deviation)
+
+    def missed(self):
+        ''' Widens the timeout after a timeout, in case the overhead has grown faster than it is learnt '''
+        self.deviation = min(self.max_timeout, 2 * self.deviation)
+
+
+class HeadRouteModel():
+    ''' Learns which way round the head turns to reach an angle, from measured slews: the head angle reported before
+    the move, the angle of the ping after it, and the time the head took. The route taken is whichever of the
+    clockwise & counter-clockwise distances is closer to the time divided by the step time. Each slew counts towards
+    the routes it is consistent with (the shorter way round, always clockwise or always counter-clockwise), and the
+    route with the most slews is used to predict moves. Until a slew has singled out a route, the head is assumed to
+    take the shorter way round. '''
+
+    GRADIANS_PER_REVOLUTION = 400
+    ROUTES = ['shortest', 'clockwise', 'counter_clockwise']  # in order of preference between equal counts
+    MIN_ROUTE_DIFFERENCE = 20  # [gradians] between the two routes of a slew, for it to tell them apart
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.ROUTES, 0)
+
+    @property
+    def route(self):
+        return max(self.ROUTES, key=lambda route: self.counts[route])
+
+    def routes(self, from_angle_grads, to_angle_grads):
+        ''' Returns the (clockwise, counter-clockwise) distances from one angle to the other '''
+        clockwise_grads = (to_angle_grads - from_angle_grads) % self.GRADIANS_PER_REVOLUTION
+        return clockwise_grads, (self.GRADIANS_PER_REVOLUTION - clockwise_grads) % self.GRADIANS_PER_REVOLUTION
+
+    def travel_grads(self, from_angle_grads, to_angle_grads):
+        ''' Returns the gradians the head is expected to move from one angle to the other '''
+        clockwise_grads, counter_clockwise_grads = self.routes(from_angle_grads, to_angle_grads)
+        route = self.route
+        if route == 'clockwise':
+            return clockwise_grads
+        if route == 'counter_clockwise':
+            return counter_clockwise_grads
+        return min(clockwise_grads, counter_clockwise_grads)
+
+    def max_travel_grads(self):
+        ''' Returns the longest move of the head: half a turn the shorter way round, or nearly a full turn '''
+        if self.route == 'shortest':
+            return self.GRADIANS_PER_REVOLUTION // 2
+        return self.GRADIANS_PER_REVOLUTION - 1
+
+    def update(self, from_angle_grads, to_angle_grads, slew_time, step_time):
+        ''' Records a measured slew. Returns the gradians the head moved, or the expected travel if the time cannot
+        tell the routes apart. '''
+        clockwise_grads, counter_clockwise_grads = self.routes(from_angle_grads, to_angle_grads)
+        if step_time <= 0 or abs(clockwise_grads - counter_clockwise_grads) < self.MIN_ROUTE_DIFFERENCE:
+            return self.travel_grads(from_angle_grads, to_angle_grads)
+
+        moved_grads = slew_time / step_time
+        took_clockwise = abs(moved_grads - clockwise_grads) <= abs(moved_grads - counter_clockwise_grads)
+        self.counts['clockwise' if took_clockwise else 'counter_clockwise'] += 1
+        if took_clockwise == (clockwise_grads < counter_clockwise_grads):
+            self.counts['shortest'] += 1
+        return clockwise_grads if took_clockwise else counter_clockwise_grads
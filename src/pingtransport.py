@@ -0,0 +1,64 @@
+import asyncio
+
+
+class Ping360Transport():
+    ''' Non-blocking receive path for a connected brping Ping360. The device's socket or serial port is watched by
+    the asyncio event loop, and every decoded PingMessage is put on a queue that coroutines can await, instead of
+    polling the device with the blocking Ping360.wait_message(). Commands are still sent with the Ping360 methods,
+    as writing a command to the UDP socket or serial port does not block. '''
+
+    def __init__(self, ping_360):
+        self.ping_360 = ping_360
+        self.loop = None
+        self.messages = None
+        self.fileno = None
+        self.error = None # Exception which stopped the receive path, until the next attach()
+
+    def attach(self, loop):
+        ''' Starts delivering messages from the (already connected) Ping360 to the loop '''
+        self.detach()
+        self.loop = loop
+        self.messages = asyncio.Queue()
+        self.error = None
+        self.fileno = self.ping_360.iodev.fileno()
+        loop.add_reader(self.fileno, self.on_readable)
+
+    def detach(self):
+        if self.fileno is not None:
+            self.loop.remove_reader(self.fileno)
+            self.fileno = None
+
+    def on_readable(self):
+        ''' Called by the loop when data is available. Decodes all complete messages in the received data. '''
+        try:
+            msg = self.ping_360.read()
+            while msg is not None:
+                self.messages.put_nowait(msg)
+                msg = self.ping_360.read()
+        except OSError as e:
+            # e.g. the sonar's UDP port is unreachable, or the serial adapter was unplugged. The device is no longer
+            # watched, so that a failed port does not keep the loop busy, and the owner is expected to reconnect.
+            self.error = e
+            self.detach()
+
+    def flush(self):
+        ''' Discards any received messages which have not been consumed yet, such as a stale ping response '''
+        if self.messages is not None:
+            while not self.messages.empty():
+                self.messages.get_nowait()
+
+    async def wait_message(self, message_ids, timeout, accept=None):
+        ''' Returns the first received message with an id in message_ids, or None if none arrives within the
+        timeout (seconds). Messages with other ids are discarded, as with Ping360.wait_message(), as are messages
+        for which accept(msg) is False, such as a late reply to an earlier command. '''
+        deadline = self.loop.time() + timeout
+        while True:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                msg = await asyncio.wait_for(self.messages.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            if msg.message_id in message_ids and (accept is None or accept(msg)):
+                return msg
@@ -0,0 +1,78 @@
+import time
+
+
+class PublishPolicy():
+    ''' Decides which output changes are notified to the MOOS DB. A variable can be limited to a maximum rate, in
+    which case the latest withheld value is published once the interval has passed (see due()), and/or published only
+    when its value changes, in which case it is still refreshed every refresh_sec so that subscribers can tell that
+    the app is alive. Variables without a rule are always published. '''
+
+    def __init__(self, refresh_sec=0):
+        self.refresh_sec = refresh_sec  # [s] 0 to never refresh unchanged variables
+        self.min_intervals = {}  # name -> [s] between publications
+        self.on_change = set()
+        self.rules = set()  # names of the variables with a rule
+        self.last_values = {}  # name -> last published value
+        self.last_times = {}  # name -> time of the last publication
+        self.pending = {}  # name -> latest value withheld by the rate limit
+        self.suppressed = 0
+
+    @staticmethod
+    def parse_names(text):
+        ''' Parses a comma separated list of variable names '''
+        return [name.strip().upper() for name in text.split(',') if name.strip()]
+
+    @staticmethod
+    def parse_rates(text):
+        ''' Parses a comma separated list of <name>:<max rate in Hz>, returns a dict '''
+        rates = {}
+        for item in PublishPolicy.parse_names(text):
+            name, _, rate = item.partition(':')
+            try:
+                rates[name.strip()] = float(rate)
+            except ValueError:
+                raise Exception("Invalid maximum rate ({0})".format(item))
+            if rates[name.strip()] <= 0:
+                raise Exception("Invalid maximum rate ({0})".format(item))
+        return rates
+
+    def limit_rate(self, name, max_rate_hz):
+        self.min_intervals[name] = 1 / max_rate_hz
+        self.rules.add(name)
+
+    def publish_on_change(self, name):
+        self.on_change.add(name)
+        self.rules.add(name)
+
+    def should_publish(self, name, value):
+        ''' Returns True if the new value of the variable should be published now, and records its publication '''
+        now = time.monotonic()
+        last_time = self.last_times.get(name)
+        if name in self.on_change and last_time is not None and value == self.last_values[name] and \
+                (not self.refresh_sec or now - last_time < self.refresh_sec):
+            self.pending.pop(name, None)
+            self.suppressed += 1
+            return False
+        min_interval = self.min_intervals.get(name)
+        if min_interval and last_time is not None and now - last_time < min_interval:
+            self.pending[name] = value
+            self.suppressed += 1
+            return False
+
+        self.published(name, value, now)
+        return True
+
+    def published(self, name, value, now=None):
+        self.pending.pop(name, None)
+        self.last_values[name] = value
+        self.last_times[name] = time.monotonic() if now is None else now
+
+    def due(self):
+        ''' Returns the names of the variables to publish now: withheld values whose rate interval has passed, and
+        unchanged variables which are due a refresh '''
+        now = time.monotonic()
+        names = [name for name in self.pending if now - self.last_times[name] >= self.min_intervals[name]]
+        if self.refresh_sec:
+            names += [name for name in self.on_change if name in self.last_times and name not in self.pending and
+                      now - self.last_times[name] >= self.refresh_sec]
+        return names
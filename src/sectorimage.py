@@ -0,0 +1,76 @@
+import struct
+import time
+
+
+class SectorImage():
+    ''' Rolling intensity image of the scan sector. Holds one row of samples per gradian of head angle in a
+    preallocated bytearray, and each ping overwrites its row in place, so the image always holds the latest ping at
+    every angle. Snapshots of the scan sector, optionally decimated in angle and range, are packed into a single
+    binary message so that MOOS clients do not have to rebuild the image from PING_DATA.
+
+    Snapshot format (little-endian): the HEADER fields below, followed by num_rows rows of row_samples uint8
+    intensities. Row i holds the ping at (start_angle + i * angle_step) % 400 gradians, and sample j of a row is
+    sample j * range_decimation of the ping. Angles which have not been pinged are zero. '''
+
+    # magic, start_angle, stop_angle, angle_step [gradians], num_rows, row_samples, range_decimation,
+    # num_samples (per ping), time [epoch seconds]
+    HEADER = struct.Struct('<2sHHHHHHHd')
+    MAGIC = b'SI'
+    NUM_ANGLES = 400
+
+    def __init__(self, num_samples=0):
+        self.num_samples = 0
+        self.buffer = bytearray()
+        self.allocate(num_samples)
+
+    def allocate(self, num_samples):
+        ''' Clears the image and sizes it for pings of num_samples samples '''
+        self.num_samples = int(num_samples)
+        self.buffer = bytearray(self.NUM_ANGLES * self.num_samples)
+
+    def update(self, angle, data):
+        ''' Writes a ping's samples to the row of its angle. The image is reallocated (and cleared) if the number of
+        samples differs from the allocated size, e.g. when NUMBER_OF_SAMPLES has just changed. '''
+        if len(data) != self.num_samples:
+            self.allocate(len(data))
+        start = (angle % self.NUM_ANGLES) * self.num_samples
+        self.buffer[start:start + self.num_samples] = data
+
+    def snapshot(self, start_angle, stop_angle, angle_step=1, range_decimation=1):
+        ''' Returns the packed image of the clockwise sector from start_angle to stop_angle (inclusive), keeping
+        every angle_step'th row and every range_decimation'th sample '''
+        start_angle = int(start_angle) % self.NUM_ANGLES
+        stop_angle = int(stop_angle) % self.NUM_ANGLES
+        angle_step = max(1, int(angle_step))
+        range_decimation = max(1, int(range_decimation))
+
+        num_rows = (stop_angle - start_angle) % self.NUM_ANGLES // angle_step + 1
+        row_samples = len(range(0, self.num_samples, range_decimation))
+        snapshot = bytearray(self.HEADER.size + num_rows * row_samples)
+        self.HEADER.pack_into(snapshot, 0, self.MAGIC, start_angle, stop_angle, angle_step, num_rows, row_samples,
+                              range_decimation, self.num_samples, time.time())
+
+        offset = self.HEADER.size
+        for row in range(num_rows):
+            row_start = (start_angle + row * angle_step) % self.NUM_ANGLES * self.num_samples
+            if range_decimation == 1:
+                snapshot[offset:offset + row_samples] = memoryview(self.buffer)[row_start:row_start + row_samples]
+            else:
+                snapshot[offset:offset + row_samples] = \
+                    self.buffer[row_start:row_start + self.num_samples:range_decimation]
+            offset += row_samples
+        return bytes(snapshot)
+
+    @classmethod
+    def unpack(cls, snapshot):
+        ''' Decodes a snapshot. Returns (header dict, list of rows), where each row is a memoryview of its samples '''
+        fields = cls.HEADER.unpack_from(snapshot, 0)
+        if fields[0] != cls.MAGIC:
+            raise ValueError('Not a sector image snapshot')
+        header = dict(zip(('start_angle', 'stop_angle', 'angle_step', 'num_rows', 'row_samples', 'range_decimation',
+                           'num_samples', 'time'), fields[1:]))
+        view = memoryview(snapshot)
+        row_samples = header['row_samples']
+        rows = [view[cls.HEADER.size + row * row_samples:cls.HEADER.size + (row + 1) * row_samples]
+                for row in range(header['num_rows'])]
+        return header, rows
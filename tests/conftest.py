@@ -0,0 +1,15 @@
+''' Puts the app and utils modules on the path. Without pymoos, the app is imported with the benchmarks' stand-in
+(see benchmarks/mock_moos.py), which is all the tested functions need. '''
+
+import os
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT_DIR, 'src'), os.path.join(ROOT_DIR, 'utils')]
+
+try:
+    import pymoos
+except ImportError:
+    sys.path.append(os.path.join(ROOT_DIR, 'benchmarks'))
+    import mock_moos
+    sys.modules['pymoos'] = mock_moos
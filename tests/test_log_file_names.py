@@ -0,0 +1,27 @@
+import glob
+import os
+from datetime import date
+from ping360logger import Ping360Logger
+from parallel_decode import file_day, file_start
+from export_columnar import log_date
+
+
+def test_dates_from_single_and_labelled_file_names():
+    for name in ['ping360_20240101_120000.bin', 'ping360_port_20240101_120000.bin',
+                 'ping360_stbd_20240101_120000.bin', '/logs/day_1/ping360_fwd_look_20240101_120000.bin']:
+        assert file_day(name) == date(2024, 1, 1).toordinal()
+        assert log_date(name) == date(2024, 1, 1)
+
+    assert file_day('other_20240101_120000.bin') == 0
+    assert log_date('ping360_port.bin') is None
+
+
+def test_labelled_log_file_has_a_start_date(tmp_path):
+    logger = Ping360Logger()
+    assert logger.create_new_file(str(tmp_path) + os.sep, 'port')
+    logger.close_log_file()
+
+    file_name, = glob.glob(os.path.join(str(tmp_path), 'ping360_port_*.bin'))
+    start_date, _ = file_start(file_name)
+    assert start_date is not None
+    assert file_day(file_name) == start_date.toordinal()
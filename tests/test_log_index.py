@@ -0,0 +1,39 @@
+import glob
+import os
+from brping import PingMessage, definitions
+from ping360logger import Ping360Logger
+from decode_sensor_binary import PingViewerLogReader, PingViewerLogIndex
+
+
+def write_log(directory, angles):
+    logger = Ping360Logger()
+    assert logger.create_new_file(directory + os.sep)
+    for angle in angles:
+        message = PingMessage(definitions.PING360_DEVICE_DATA)
+        message.mode, message.gain_setting, message.angle, message.transmit_duration = 1, 0, angle, 32
+        message.sample_period, message.transmit_frequency, message.number_of_samples = 80, 740, 10
+        message.data = bytearray(10)
+        logger.log_message(message.pack_msg_data())
+    logger.close_log_file()
+    file_name, = glob.glob(os.path.join(directory, 'ping360_*.bin'))
+    return file_name
+
+
+def test_index_is_kept_in_memory_if_it_cannot_be_saved(tmp_path):
+    log = PingViewerLogReader(write_log(str(tmp_path), range(20)))
+    log._index = PingViewerLogIndex(log)
+    log._index.filename = str(tmp_path / 'read_only' / 'log.idx')  # cannot be created
+
+    angles = [frame.angle for _, frame in log.time_window()]
+    assert angles == list(range(20))
+    assert isinstance(log.index().save_error, OSError)
+    assert not os.path.exists(log._index.filename)
+
+
+def test_index_is_saved_next_to_the_log(tmp_path):
+    log = PingViewerLogReader(write_log(str(tmp_path), range(5)))
+    assert [frame.angle for _, frame in log.angles([3])] == [3]
+    assert log.index().save_error is None
+
+    index = PingViewerLogIndex(log)
+    assert index.load() and list(index.angles) == list(range(5))
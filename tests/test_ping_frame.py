@@ -0,0 +1,30 @@
+import mmap
+from brping import PingMessage, definitions
+from decode_sensor_binary import PingFrame
+
+
+def device_data(angle):
+    message = PingMessage(definitions.PING360_DEVICE_DATA)
+    message.mode, message.gain_setting, message.angle, message.transmit_duration = 1, 0, angle, 32
+    message.sample_period, message.transmit_frequency, message.number_of_samples = 80, 740, 4
+    message.data = bytearray([1, 2, 3, 4])
+    return bytes(message.pack_msg_data())
+
+
+def test_decode_resyncs_after_corrupt_frames():
+    corrupt = b'BR' + bytes(8)  # fails the checksum
+    buffer = b'xx' + corrupt * 1000 + b'noise B R' + device_data(123)
+    frame = PingFrame.decode(buffer)
+    assert frame.message_id == definitions.PING360_DEVICE_DATA
+    assert frame.angle == 123 and bytes(frame.data) == bytes([1, 2, 3, 4])
+    assert PingFrame.decode(buffer[:-1]) is None  # truncated
+
+
+def test_decode_searches_an_mmap_in_place(tmp_path):
+    file_name = tmp_path / 'frames.bin'
+    file_name.write_bytes(b'BR' + bytes(8) + device_data(7))
+    with open(file_name, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        view = memoryview(buffer)
+        frame = PingFrame.decode(view, 1)
+        assert frame.angle == 7
+        del frame, view
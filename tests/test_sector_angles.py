@@ -0,0 +1,36 @@
+from ping360device import angle_within, nearer_sector_edge, next_transmit_angle, sector_extent_grads, \
+    smallest_angle_between
+
+
+def sweep(head_angle_grads, clockwise, start_angle_grads, stop_angle_grads, num_steps_grads, num_pings):
+    angles = []
+    for _ in range(num_pings):
+        head_angle_grads, clockwise = next_transmit_angle(head_angle_grads, clockwise, start_angle_grads,
+                                                          stop_angle_grads, num_steps_grads)
+        angles.append(head_angle_grads)
+    return angles
+
+
+def test_full_circle_0_to_400():
+    assert sector_extent_grads(0, 400) == 400
+    assert all(angle_within(angle, 0, 400) for angle in range(400))
+
+    angles = sweep(0, True, 0, 400, 1, 800)
+    assert angles[:3] == [1, 2, 3]
+    assert angles[398:402] == [399, 0, 1, 2]  # rotates continuously rather than reversing
+    assert set(angles) == set(range(400))
+
+
+def test_single_angle_sectors_stay_in_range():
+    assert sector_extent_grads(0, 0) == 0
+    assert sector_extent_grads(400, 0) == 0
+    for start, stop in [(0, 0), (400, 0), (100, 100)]:
+        for head in (start % 400, 399, 0, 200):
+            for clockwise in (True, False):
+                assert set(sweep(head, clockwise, start, stop, 1, 10)) == {start % 400}
+
+
+def test_sector_edges_are_normalised():
+    assert nearer_sector_edge(390, 400, 50, smallest_angle_between) == (0, True)
+    assert nearer_sector_edge(100, 350, 400, smallest_angle_between) == (0, False)
+    assert all(0 <= angle < 400 for angle in sweep(399, True, 350, 400, 10, 50))
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+''' Builds or updates the sidecar index (<log file>.idx) of PingViewer sensor log files, so that records can be
+found by time, angle and sector sweep without decoding the whole log. An existing index is only extended with the
+records added since it was built. '''
+
+from argparse import ArgumentParser
+from decode_sensor_binary import PingViewerLogReader
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs='+',
+                        help="PingViewer sensor log files to index.")
+    args = parser.parse_args()
+
+    for file in args.files:
+        log = PingViewerLogReader(file)
+        index = log.index()
+        if index.save_error is not None:
+            print('{0}: not saved, {1}'.format(index.filename, index.save_error))
+        if len(index):
+            print('{0}: {1} records, {2} sweeps, {3:.3f}s to {4:.3f}s'.format(
+                index.filename, len(index), index.sweep + 1, index.times[0], index.times[-1]))
+        else:
+            print('{0}: no records'.format(index.filename))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+''' Reference decoder for the compact ping messages published as PING_DATA_COMPACT by iPing360Device (encoded by
+src/pingcodecs.py). Messages must be decoded in the order they were published, as delta encoded pings are decoded
+against the previous ping at the same angle. '''
+
+import os
+import struct
+import sys
+import zlib
+from dataclasses import dataclass
+
+HEADER = struct.Struct('<2sBHBHHHHBB')
+MAGIC = b'PC'
+FLAG_4BIT = 0x01
+FLAG_DELTA = 0x02
+FLAG_RLE = 0x04
+FLAG_ZLIB = 0x08
+
+
+@dataclass
+class CompactPing:
+    angle: int
+    gain_setting: int
+    transmit_duration: int
+    sample_period: int
+    transmit_frequency: int
+    number_of_samples: int  # before binning
+    bin_size: int  # data[i] is the mean of samples [i * bin_size, (i + 1) * bin_size)
+    data: bytes  # 8 bit intensities, quantised to 16 levels if the message was 4 bit encoded
+
+
+class PingCompactDecoder:
+    ''' Decodes a stream of compact ping messages '''
+
+    def __init__(self):
+        self.previous = {}  # angle -> (decoded levels, sequence) of the previous ping
+
+    def decode(self, message):
+        ''' Returns the CompactPing of a message, or None if it is delta encoded and its reference ping is missing
+        (e.g. a message was lost); decoding of that angle resumes at its next key ping. '''
+        magic, flags, angle, gain_setting, transmit_duration, sample_period, transmit_frequency, \
+            number_of_samples, bin_size, sequence = HEADER.unpack_from(message, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a compact ping message')
+        samples = bytes(message[HEADER.size:])
+        num_levels = -(-number_of_samples // bin_size)
+
+        if flags & FLAG_ZLIB:
+            samples = zlib.decompress(samples)
+        elif flags & FLAG_RLE:
+            samples = b''.join(bytes([samples[i + 1]]) * samples[i] for i in range(0, len(samples), 2))
+
+        if flags & FLAG_4BIT:
+            levels = bytearray(len(samples) * 2)
+            levels[0::2] = bytes(value >> 4 for value in samples)
+            levels[1::2] = bytes(value & 0x0f for value in samples)
+            samples = bytes(levels[:num_levels])
+
+        if flags & FLAG_DELTA:
+            previous, previous_sequence = self.previous.get(angle, (None, None))
+            if previous is None or len(previous) != len(samples) or previous_sequence != (sequence - 1) % 256:
+                self.previous.pop(angle, None)
+                return None
+            samples = bytes(a ^ b for a, b in zip(samples, previous))
+        self.previous[angle] = (samples, sequence)
+
+        if flags & FLAG_4BIT:
+            samples = bytes(level * 17 for level in samples)  # 0-15 -> 0-255
+        return CompactPing(angle, gain_setting, transmit_duration, sample_period, transmit_frequency,
+                           number_of_samples, bin_size, samples)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+    from decode_sensor_binary import PingViewerLogReader
+
+    # Parse arguments
+    parser = ArgumentParser(description='Encodes the pings of a sensor log with a codec and checks that they '
+                                        'decode, reporting the bytes per ping.')
+    parser.add_argument("file",
+                        help="File that contains PingViewer sensor log file.")
+    parser.add_argument("--codec", default='bin2,4bit,delta,zlib',
+                        help="Codec stages, see src/pingcodecs.py.")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+    from pingcodecs import PingDataEncoder
+
+    encoder = PingDataEncoder(args.codec)
+    decoder = PingCompactDecoder()
+    pings = raw_bytes = compact_bytes = 0
+    for _, frame in PingViewerLogReader(args.file).frames({2300, 2301}):
+        message = encoder.encode(frame)
+        ping = decoder.decode(message)
+        assert ping is not None and ping.angle == frame.angle
+        pings += 1
+        raw_bytes += len(frame.msg_data)
+        compact_bytes += len(message)
+    if pings:
+        print('{0} pings: {1:.0f} bytes/ping raw, {2:.0f} bytes/ping with {3}'.format(
+            pings, raw_bytes / pings, compact_bytes / pings, args.codec))
@@ -3,15 +3,18 @@
 #!/usr/bin/env python3
 
 
-import struct, sys, re
+import struct, sys, re, mmap, os
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
 
 # 3.7 for dataclasses, 3.8 for walrus (:=) in recovery
 assert (sys.version_info.major >= 3 and sys.version_info.minor >= 8), \
     "Python version should be at least 3.8."
 
-from brping import PingParser, PingMessage
+from brping import PingMessage
 from dataclasses import dataclass
-from typing import IO, Any, Set
+from typing import IO, Any, Set, Iterable
 
 
 def indent(obj, by=' ' * 4):
@@ -65,6 +68,91 @@ class Header:
     """
 
 
+class PingFrame:
+    ''' A Ping protocol message decoded directly from a buffer, without
+    feeding it byte-by-byte through a PingParser. Structured as a
+    little-endian sequence of
+        'BR', payload_length: uint16, message_id: uint16, src_device_id: uint8,
+        dst_device_id: uint8, payload: byte_array[payload_length],
+        checksum: uint16 (sum of all preceding bytes).
+    For device_data (2300) and auto_device_data (2301) messages the fields
+    are decoded into attributes named as in PingMessage, with 'data' a
+    zero-copy memoryview of the intensity samples.
+    '''
+    __slots__ = ('message_id', 'src_device_id', 'dst_device_id', 'msg_data',
+                 'payload', 'mode', 'gain_setting', 'angle',
+                 'transmit_duration', 'sample_period', 'transmit_frequency',
+                 'start_angle', 'stop_angle', 'num_steps', 'delay',
+                 'number_of_samples', 'data_length', 'data')
+
+    START = b'BR'
+    START_PATTERN = re.compile(re.escape(START))  # searches the buffer in place
+    HEADER = struct.Struct('<2sHHBB')
+    CHECKSUM = struct.Struct('<H')
+    # static payload fields, up to and including data_length
+    DEVICE_DATA = struct.Struct('<BBHHHHHH')
+    AUTO_DEVICE_DATA = struct.Struct('<BBHHHHHHBBHH')
+    DEVICE_DATA_ID = 2300
+    AUTO_DEVICE_DATA_ID = 2301
+
+    @classmethod
+    def decode(cls, buffer, start: int = 0):
+        ''' Returns the first checksum-verified frame in 'buffer' at or after
+        'start', or None if there is none.
+        '''
+        view = memoryview(buffer)
+        while (start := cls.find_start(view, start)) is not None:
+            frame = cls.decode_at(view, start)
+            if frame is not None:
+                return frame
+            start += 1  # not a valid frame, continue searching
+        return None
+
+    @classmethod
+    def find_start(cls, view, start: int):
+        if view[start:start + 2] == cls.START:
+            return start  # messages are normally at the start of the record
+        match = cls.START_PATTERN.search(view, start)
+        return None if match is None else match.start()
+
+    @classmethod
+    def decode_at(cls, view, start: int):
+        ''' Returns the frame starting at 'start', or None if it is truncated
+        or fails the checksum.
+        '''
+        try:
+            _, payload_length, message_id, src_device_id, dst_device_id = \
+                cls.HEADER.unpack_from(view, start)
+            payload_start = start + cls.HEADER.size
+            end = payload_start + payload_length
+            checksum = cls.CHECKSUM.unpack_from(view, end)[0]
+        except struct.error:
+            return None
+        if sum(view[start:end]) & 0xffff != checksum:
+            return None
+
+        frame = cls.__new__(cls)
+        frame.message_id = message_id
+        frame.src_device_id = src_device_id
+        frame.dst_device_id = dst_device_id
+        frame.msg_data = view[start:end + cls.CHECKSUM.size]
+        frame.payload = view[payload_start:end]
+        if message_id == cls.DEVICE_DATA_ID:
+            (frame.mode, frame.gain_setting, frame.angle,
+             frame.transmit_duration, frame.sample_period,
+             frame.transmit_frequency, frame.number_of_samples,
+             frame.data_length) = cls.DEVICE_DATA.unpack_from(view, payload_start)
+            frame.data = view[payload_start + cls.DEVICE_DATA.size:end]
+        elif message_id == cls.AUTO_DEVICE_DATA_ID:
+            (frame.mode, frame.gain_setting, frame.angle,
+             frame.transmit_duration, frame.sample_period,
+             frame.transmit_frequency, frame.start_angle, frame.stop_angle,
+             frame.num_steps, frame.delay, frame.number_of_samples,
+             frame.data_length) = cls.AUTO_DEVICE_DATA.unpack_from(view, payload_start)
+            frame.data = view[payload_start + cls.AUTO_DEVICE_DATA.size:end]
+        return frame
+
+
 class PingViewerLogReader:
     ''' Structured as a big-endian sequence of
         size: uint32, data: byte_array[size].
@@ -86,8 +174,13 @@ class PingViewerLogReader:
         b'(\x00?\d){2}(\x00?:\x00?[0-5]\x00?\d){2}\x00?\.(\x00?\d){3}')
     MAX_TIMESTAMP_LENGTH = 12 * 2
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, use_mmap: bool = False):
+        ''' With 'use_mmap', the file is memory-mapped and iteration yields
+        memoryview slices of the file for timestamps and messages, instead of
+        reading and copying each field.
+        '''
         self.filename = filename
+        self.use_mmap = use_mmap
         self.header = Header()
         self.messages = []
 
@@ -155,6 +248,48 @@ class PingViewerLogReader:
             return (timestamp, message)
         raise EOFError('No timestamp match found in recovery attempt')
 
+    @classmethod
+    def unpack_array_at(cls, buffer, offset: int):
+        ''' Buffer equivalent of unpack_array, for the array at 'offset'.
+        Returns (array view or None if > MAX_ARRAY_LENGTH, next offset).
+        Raises struct.error if there is no complete size at 'offset'.
+        '''
+        array_size = cls.UINT.unpack_from(buffer, offset)[0]
+        offset += cls.UINT.size
+        if array_size <= cls.MAX_ARRAY_LENGTH:
+            return buffer[offset:offset + array_size], offset + array_size
+        return None, offset
+
+    @classmethod
+    def unpack_message_at(cls, buffer, offset: int):
+        ''' Buffer equivalent of unpack_message, for the record at 'offset'.
+        Returns (record offset, timestamp, message, next offset).
+        '''
+        timestamp, next_offset = cls.unpack_array_at(buffer, offset)
+        if timestamp is None:
+            return cls.recover_at(buffer, offset)
+        message, next_offset = cls.unpack_array_at(buffer, next_offset)
+        if message is None:
+            return cls.recover_at(buffer, next_offset - cls.UINT.size)
+        return (offset, timestamp, message, next_offset)
+
+    @classmethod
+    def recover_at(cls, buffer, offset: int):
+        ''' Buffer equivalent of recover. 'offset' is the position of the
+        bad size -> search from there for the next timestamp, and continue as
+        normal from there. The record offset reported for a recovered record
+        is that of the size preceding the matched timestamp.
+        '''
+        while (match := cls.TIMESTAMP_FORMAT.search(buffer, offset)):
+            message, next_offset = cls.unpack_array_at(buffer, match.end())
+            if message is not None:
+                return (match.start() - cls.UINT.size,
+                        buffer[match.start():match.end()], message,
+                        next_offset)
+            # attempt to recover anew from the bad message size
+            offset = next_offset - cls.UINT.size
+        raise EOFError('No timestamp match found in recovery attempt')
+
     def unpack_header(self, file: IO[Any]):
         self.header.string = self.unpack_string(file)
         self.header.version = self.unpack_int(file)
@@ -166,14 +301,90 @@ class PingViewerLogReader:
         self.header.sensor.family = self.unpack_int(file)
         self.header.sensor.type_sensor = self.unpack_int(file)
 
+    def unpack_header_at(self, buffer):
+        ''' Buffer equivalent of unpack_header, returns the offset of the
+        first record.
+        '''
+        def unpack_string(offset):
+            text, offset = self.unpack_array_at(buffer, offset)
+            return bytes(text).decode('UTF-8'), offset
+
+        def unpack_int(offset):
+            return self.INT.unpack_from(buffer, offset)[0], offset + self.INT.size
+
+        self.header.string, offset = unpack_string(0)
+        self.header.version, offset = unpack_int(offset)
+
+        for info in ('hash_commit', 'date', 'tag', 'os_name', 'os_version'):
+            value, offset = unpack_string(offset)
+            setattr(self.header.ping_viewer_build_info, info, value)
+
+        self.header.sensor.family, offset = unpack_int(offset)
+        self.header.sensor.type_sensor, offset = unpack_int(offset)
+        return offset
+
+    @contextmanager
+    def mapped(self):
+        """ Memory-maps self.filename, and provides a memoryview of it. """
+        with open(self.filename, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(mapped)
+        try:
+            yield buffer
+        finally:
+            buffer.release()
+            try:
+                mapped.close()
+            except BufferError:
+                pass  # views are still held by the caller, closed when freed
+
+    def records_at(self, buffer, start: int = 0):
+        """ Yields (offset, timestamp, message, next offset) for each record
+        in the mapped 'buffer', from the record at 'start' (or the first
+        record if 'start' is within the header).
+        """
+        offset = max(start, self.unpack_header_at(buffer))
+        while "data available":
+            try:
+                record = self.unpack_message_at(buffer, offset)
+            except struct.error:
+                break  # reading complete
+            offset = record[3]
+            yield record
+
+    def records(self, start: int = 0):
+        """ Creates an iterator over the memory-mapped self.filename.
+        Yields (offset, timestamp, message) for each record, where 'offset' is
+        the record's position in the file, and 'timestamp' and 'message' are
+        zero-copy memoryview slices of the file. The views are only valid
+        while iterating.
+        """
+        with self.mapped() as buffer:
+            for record_offset, timestamp, message, _ in \
+                    self.records_at(buffer, start):
+                yield record_offset, timestamp, message
+
+    @staticmethod
+    def decode_timestamp(timestamp):
+        ''' Returns 'timestamp' as a str, for a str or a memoryview. '''
+        if isinstance(timestamp, str):
+            return timestamp
+        return bytes(timestamp).decode('UTF-8')
+
     def process(self):
         """ Process and store the entire file into self.messages. """
         self.messages.extend(self)
 
     def __iter__(self):
         """ Creates an iterator for efficient reading of self.filename.
-        Yields (timestamp, message) pairs for decoding.
+        Yields (timestamp, message) pairs for decoding. With use_mmap, these
+        are memoryviews of the mapped file (see records).
         """
+        if self.use_mmap:
+            for _, timestamp, message in self.records():
+                yield timestamp, message
+            return
+
         with open(self.filename, "rb") as file:
             self.unpack_header(file)
             while "data available":
@@ -182,6 +393,18 @@ class PingViewerLogReader:
                 except struct.error:
                     break  # reading complete
 
+    def frames(self, message_ids: Set[int] = {1300, 2300, 2301}):
+        """ Returns a generator that decodes this log's messages directly from
+        each record with PingFrame.
+        Yields (timestamp, frame) pairs. With use_mmap, the frame's views
+        reference the mapped file and are only valid while iterating.
+        'message_ids' is the set of Ping Profile message ids to filter by.
+        """
+        for (timestamp, message) in self:
+            frame = PingFrame.decode(message)
+            if frame is not None and frame.message_id in message_ids:
+                yield self.decode_timestamp(timestamp), frame
+
     def parser(self, message_ids: Set[int] = {1300, 2300, 2301}):
         """ Returns a generator that parses and decodes this log's messages.
         Yields (timestamp, message) pairs. message decoded as a PingMessage.
@@ -190,19 +413,253 @@ class PingViewerLogReader:
                                                     Ping360.device_data,
                                                     Ping360.auto_device_data}
         """
-        self._parser = PingParser()
+        for (timestamp, frame) in self.frames(message_ids):
+            # the frame has been located and verified, only unpack its fields
+            yield timestamp, PingMessage(msg_data=bytearray(frame.msg_data))
 
-        for (timestamp, message) in self:
-            # parse each byte of the message
-            for byte in message:
-                # Check if the parser has registered and verified this message
-                if self._parser.parse_byte(byte) == self._parser.NEW_MESSAGE:
-                    # Get decoded message
-                    decoded_message = self._parser.rx_msg
-                    if decoded_message.message_id in message_ids:
-                        yield timestamp, decoded_message
-                        break  # this message is (should be?) over, get next one
-                # else message is still being parsed
+
+    def index(self):
+        """ Returns the sidecar index of this log, building or extending it
+        if the log has grown since it was last indexed.
+        """
+        if getattr(self, '_index', None) is None:
+            self._index = PingViewerLogIndex(self)
+        self._index.update()
+        return self._index
+
+    def frames_at(self, offsets: Iterable[int],
+                  message_ids: Set[int] = {1300, 2300, 2301}):
+        """ Yields (timestamp, frame) pairs for the records at 'offsets', as
+        returned by frames(). The frame's views are only valid while iterating.
+        """
+        with self.mapped() as buffer:
+            for offset in offsets:
+                _, timestamp, message, _ = self.unpack_message_at(buffer, offset)
+                frame = PingFrame.decode(message)
+                if frame is not None and frame.message_id in message_ids:
+                    yield self.decode_timestamp(timestamp), frame
+
+    def seek_time(self, time):
+        """ Returns the file offset of the first record at or after 'time'
+        (seconds, or an 'hh:mm:ss.xxx' timestamp), or None if there is none.
+        """
+        index = self.index()
+        position = index.find_time(time)
+        if position < len(index):
+            return index.offsets[position]
+        return None
+
+    def time_window(self, start=None, end=None,
+                    message_ids: Set[int] = {1300, 2300, 2301}):
+        """ Yields (timestamp, frame) for records with start <= time < end,
+        using the index to go directly to 'start'. 'start' and 'end' are
+        seconds or 'hh:mm:ss.xxx' timestamps, None for the start/end of the log.
+        """
+        index = self.index()
+        first = 0 if start is None else index.find_time(start)
+        last = len(index) if end is None else index.find_time(end)
+        yield from self.frames_at(index.offsets[first:last], message_ids)
+
+    def angles(self, angles: Iterable[int],
+               message_ids: Set[int] = {2300, 2301}):
+        """ Yields (timestamp, frame) for the records at the given angles
+        [gradians], in log order.
+        """
+        index = self.index()
+        angles = set(angles)
+        yield from self.frames_at((offset for offset, angle in
+                                   zip(index.offsets, index.angles)
+                                   if angle in angles), message_ids)
+
+    def sweeps(self, sweeps: Iterable[int],
+               message_ids: Set[int] = {2300, 2301}):
+        """ Yields (timestamp, frame) for the records in the given sector
+        sweeps (numbered from 0, see PingViewerLogIndex), in log order.
+        """
+        index = self.index()
+        sweeps = set(sweeps)
+        yield from self.frames_at((offset for offset, sweep in
+                                   zip(index.offsets, index.sweeps)
+                                   if sweep in sweeps), message_ids)
+
+
+class PingViewerLogIndex:
+    ''' Sidecar index of a PingViewer log, stored as <log file>.idx.
+    Structured as a little-endian header followed by one entry per record:
+        offset: uint64, time: float64, message_id: uint16, angle: uint16,
+        sweep: uint32.
+    'time' is seconds since midnight of the first record's day, increasing
+    across midnight. 'angle' is NO_ANGLE for messages without one. A new
+    sweep starts when the head reverses direction, or completes a full
+    revolution in the same direction.
+    The header records how much of the log has been indexed, and the sweep
+    tracking state, so the index is extended incrementally as the log grows.
+    '''
+    MAGIC = b'P360IDX1'
+    # magic, indexed log size, next record offset, last time, last angle,
+    # direction (-1, 0, 1), travel in this sweep [gradians], sweep number
+    HEADER = struct.Struct('<8sQQdHbHI')
+    ENTRY = struct.Struct('<QdHHI')
+    NO_ANGLE = 0xffff
+    SECONDS_PER_DAY = 24 * 60 * 60
+
+    def __init__(self, log: PingViewerLogReader):
+        self.log = log
+        self.filename = log.filename + '.idx'
+        self.saved_entries = 0  # number of entries in the index file
+        self.save_error = None  # OSError of the last save, e.g. on read-only media
+        self.clear()
+
+    def clear(self):
+        self.offsets = array('Q')
+        self.times = array('d')
+        self.message_ids = array('H')
+        self.angles = array('H')
+        self.sweeps = array('I')
+        self.log_size = 0
+        self.next_offset = 0
+        self.last_time = -1.0
+        self.last_angle = self.NO_ANGLE
+        self.direction = 0
+        self.travel = 0
+        self.sweep = 0
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @staticmethod
+    def parse_time(timestamp: str):
+        ''' Returns the seconds since midnight of an 'hh:mm:ss.xxx' timestamp
+        (null bytes ignored). '''
+        hours, minutes, seconds = timestamp.replace('\x00', '').split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    def find_time(self, time):
+        """ Returns the position of the first entry at or after 'time'
+        (seconds, or an 'hh:mm:ss.xxx' timestamp on the first day).
+        """
+        if isinstance(time, str):
+            time = self.parse_time(time)
+        return bisect_left(self.times, time)
+
+    def load(self):
+        """ Loads the index file. Returns False if it is missing or invalid. """
+        self.clear()
+        try:
+            with open(self.filename, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return False
+        if len(data) < self.HEADER.size:
+            return False
+        (magic, self.log_size, self.next_offset, self.last_time,
+         self.last_angle, self.direction, self.travel, self.sweep) = \
+            self.HEADER.unpack_from(data)
+        entries = memoryview(data)[self.HEADER.size:]
+        if magic != self.MAGIC or len(entries) % self.ENTRY.size:
+            self.clear()
+            return False
+        for entry in self.ENTRY.iter_unpack(entries):
+            self.append(*entry)
+        self.saved_entries = len(self)
+        return True
+
+    def append(self, offset, time, message_id, angle, sweep):
+        self.offsets.append(offset)
+        self.times.append(time)
+        self.message_ids.append(message_id)
+        self.angles.append(angle)
+        self.sweeps.append(sweep)
+
+    def update(self):
+        """ Brings the index up to date with the log: loads it if needed,
+        then indexes any records added since, rebuilding it if the log has
+        been replaced by a smaller file. Returns the number of new entries.
+        """
+        log_size = os.path.getsize(self.log.filename)
+        if not self.log_size and not self.load():
+            self.clear()
+        if log_size < self.log_size:
+            self.clear()
+        if log_size == self.log_size:
+            return 0
+
+        start = len(self)
+        with self.log.mapped() as buffer:
+            for offset, timestamp, message, next_offset in \
+                    self.log.records_at(buffer, self.next_offset):
+                if next_offset > len(buffer):
+                    break  # partially written record, index it next time
+                self.add_record(offset, timestamp, message)
+                self.next_offset = next_offset
+        self.log_size = log_size
+        self.save(start)
+        return len(self) - start
+
+    def add_record(self, offset, timestamp, message):
+        time = self.parse_time(self.log.decode_timestamp(timestamp))
+        if self.last_time >= 0:
+            # continue on from the last day, rolling over at midnight
+            time += self.last_time // self.SECONDS_PER_DAY * self.SECONDS_PER_DAY
+            if time < self.last_time - self.SECONDS_PER_DAY / 2:
+                time += self.SECONDS_PER_DAY
+        self.last_time = time
+
+        frame = PingFrame.decode(message)
+        message_id = frame.message_id if frame is not None else 0
+        angle = getattr(frame, 'angle', self.NO_ANGLE)
+        if angle != self.NO_ANGLE:
+            self.track_sweep(angle)
+        self.append(offset, time, message_id, angle, self.sweep)
+
+    def track_sweep(self, angle):
+        if self.last_angle != self.NO_ANGLE:
+            # shortest signed rotation from the last angle, in (-200, 200]
+            step = (angle - self.last_angle + 199) % 400 - 199
+            direction = (step > 0) - (step < 0)
+            if direction and self.direction and direction != self.direction:
+                self.sweep += 1  # reversed
+                self.travel = 0
+            self.travel += abs(step)
+            if self.travel >= 400:
+                self.sweep += 1  # full revolution
+                self.travel -= 400
+            if direction:
+                self.direction = direction
+        self.last_angle = angle
+
+    def save(self, start: int = 0):
+        """ Writes the header, and the entries from position 'start'
+        (appending them if the index file already holds those before it).
+        If the index file cannot be written, e.g. because the log is on
+        read-only media, the index is only kept in memory: returns False and
+        sets save_error.
+        """
+        if start > self.saved_entries:
+            start = 0  # the entries before 'start' were not saved
+        header = self.HEADER.pack(self.MAGIC, self.log_size, self.next_offset,
+                                  self.last_time, self.last_angle,
+                                  self.direction, self.travel, self.sweep)
+        entries_start = self.HEADER.size + start * self.ENTRY.size
+        mode = 'r+b' if start and os.path.exists(self.filename) else 'wb'
+        if mode == 'wb':
+            start, entries_start = 0, self.HEADER.size
+        try:
+            with open(self.filename, mode) as file:
+                file.write(header)
+                file.seek(entries_start)
+                file.truncate()
+                file.write(b''.join(self.ENTRY.pack(*entry) for entry in zip(
+                    self.offsets[start:], self.times[start:],
+                    self.message_ids[start:], self.angles[start:],
+                    self.sweeps[start:])))
+        except OSError as error:
+            self.save_error = error
+            self.saved_entries = 0
+            return False
+        self.save_error = None
+        self.saved_entries = len(self)
+        return True
 
 
 @dataclass(init=False, order=True)
@@ -266,10 +723,12 @@ if __name__ == "__main__":
     parser = ArgumentParser(description=__doc__)
     parser.add_argument("file",
                         help="File that contains PingViewer sensor log file.")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Memory-map the log file instead of reading it.")
     args = parser.parse_args()
 
     # Open log and begin processing
-    log = PingViewerLogReader(args.file)
+    log = PingViewerLogReader(args.file, use_mmap=args.mmap)
 
     for index, (timestamp, decoded_message) in enumerate(log.parser()):
         if index == 0:
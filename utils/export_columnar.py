@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+''' Converts PingViewer sensor log files into a columnar dataset directory of .npy files, which can be loaded
+memory-mapped with load_dataset() so that a whole mission is available without decoding the logs again.
+
+Dataset layout:
+    manifest.json                  columns, sample count groups and source files
+    time.npy                       float64 ping time, epoch seconds (seconds since midnight if the date is unknown)
+    angle.npy, gain_setting.npy, transmit_frequency.npy, sample_period.npy, transmit_duration.npy,
+    number_of_samples.npy          uint16/uint8 per ping fields from Ping360Settings
+    intensity_row.npy              int64 row of each ping in its sample count group
+    intensity_<N>.npy              uint8 (pings, N) intensity array of the pings with N samples
+
+Pings are stored in one 2-D array per distinct number_of_samples, so changing the sample count during a mission
+does not pad every ping to the longest one.
+'''
+
+import json
+import os
+import shutil
+import numpy as np
+from datetime import datetime, timezone
+from parallel_decode import LOG_FILE_NAME_FORMAT
+from decode_sensor_binary import PingViewerLogReader, PingViewerLogIndex
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+# Per ping columns and their types
+COLUMNS = {
+    'angle': np.uint16,
+    'gain_setting': np.uint8,
+    'transmit_frequency': np.uint16,
+    'sample_period': np.uint16,
+    'transmit_duration': np.uint16,
+    'number_of_samples': np.uint16,
+}
+
+
+def log_date(filename: str):
+    ''' Returns the date from a ping360_[<device name>_]YYYYMMDD_HHMMSS.bin file name, or None '''
+    match = LOG_FILE_NAME_FORMAT.search(filename)
+    return datetime.strptime(match.group(1)[:8], '%Y%m%d').date() if match else None
+
+
+def write_npy(raw_file_name, npy_file_name, dtype, shape):
+    ''' Writes the raw array data in raw_file_name as an .npy file, without loading it into memory '''
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': shape}
+    with open(npy_file_name, 'wb') as npy_file, open(raw_file_name, 'rb') as raw_file:
+        np.lib.format.write_array_header_1_0(npy_file, header)
+        shutil.copyfileobj(raw_file, npy_file, 1024 * 1024)
+    os.remove(raw_file_name)
+
+
+def export(filenames, output_dir, date=None, message_ids={2300, 2301}):
+    ''' Writes the pings of the log files, in the given order, to a dataset in output_dir. 'date' (a
+    datetime.date) is used for files without a date in their name; times are UTC epoch seconds if every file has a
+    date. Returns the manifest. '''
+    os.makedirs(output_dir, exist_ok=True)
+    columns = {name: [] for name in COLUMNS}
+    times = []
+    rows = []
+    group_files = {}  # number of samples -> raw intensity file
+    group_rows = {}  # number of samples -> pings in the group
+    epoch = True
+
+    try:
+        for filename in filenames:
+            day = log_date(filename) or date
+            epoch = epoch and day is not None
+            day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() if day else 0
+            last_time = None
+
+            for timestamp, frame in PingViewerLogReader(filename, use_mmap=True).frames(message_ids):
+                time = PingViewerLogIndex.parse_time(timestamp)
+                if last_time is not None and time < last_time - PingViewerLogIndex.SECONDS_PER_DAY / 2:
+                    day_start += PingViewerLogIndex.SECONDS_PER_DAY  # recorded after midnight
+                last_time = time
+                times.append(day_start + time)
+
+                # number_of_samples is the number of samples actually received, which selects the ping's group
+                num_samples = len(frame.data)
+                frame_fields = {name: getattr(frame, name) for name in COLUMNS}
+                frame_fields['number_of_samples'] = num_samples
+                for name in COLUMNS:
+                    columns[name].append(frame_fields[name])
+
+                # Intensity rows are appended to a raw file per sample count, not held in memory
+                if num_samples not in group_files:
+                    group_files[num_samples] = open(
+                        os.path.join(output_dir, 'intensity_{0}.raw'.format(num_samples)), 'wb')
+                    group_rows[num_samples] = 0
+                group_files[num_samples].write(frame.data)
+                rows.append(group_rows[num_samples])
+                group_rows[num_samples] += 1
+    finally:
+        for file in group_files.values():
+            file.close()
+
+    np.save(os.path.join(output_dir, 'time.npy'), np.array(times, dtype=np.float64))
+    for name, dtype in COLUMNS.items():
+        np.save(os.path.join(output_dir, name + '.npy'), np.array(columns[name], dtype=dtype))
+    np.save(os.path.join(output_dir, 'intensity_row.npy'), np.array(rows, dtype=np.int64))
+
+    for num_samples, count in group_rows.items():
+        write_npy(os.path.join(output_dir, 'intensity_{0}.raw'.format(num_samples)),
+                  os.path.join(output_dir, 'intensity_{0}.npy'.format(num_samples)), np.uint8,
+                  (count, num_samples))
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'pings': len(times),
+        'time': 'epoch' if epoch else 'seconds_since_midnight',
+        'columns': {name: np.dtype(dtype).name for name, dtype in COLUMNS.items()},
+        'intensity_groups': {str(num_samples): count for num_samples, count in sorted(group_rows.items())},
+        'source_files': [os.path.basename(filename) for filename in filenames],
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+class ColumnarDataset:
+    ''' A dataset written by export(). Columns are attributes (dataset.time, dataset.angle ...), and
+    dataset.intensity_groups maps each number of samples to its 2-D intensity array. '''
+
+    def __init__(self, path, mmap_mode='r'):
+        with open(os.path.join(path, MANIFEST_FILE)) as file:
+            self.manifest = json.load(file)
+        if self.manifest['version'] != MANIFEST_VERSION:
+            raise ValueError('Unsupported dataset version {0}'.format(self.manifest['version']))
+
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+
+        self.time = load('time')
+        for name in self.manifest['columns']:
+            setattr(self, name, load(name))
+        self.intensity_row = load('intensity_row')
+        self.intensity_groups = {int(num_samples): load('intensity_' + num_samples)
+                                 for num_samples in self.manifest['intensity_groups']}
+
+    def __len__(self):
+        return len(self.time)
+
+    def intensity(self, ping):
+        ''' Returns the intensity samples of ping number 'ping' (a view, not a copy) '''
+        return self.intensity_groups[int(self.number_of_samples[ping])][self.intensity_row[ping]]
+
+
+def load_dataset(path, mmap_mode='r'):
+    ''' Loads a dataset written by export(), memory-mapped by default '''
+    return ColumnarDataset(path, mmap_mode)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    # Parse arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs='+',
+                        help="PingViewer sensor log files, in time order.")
+    parser.add_argument("--output", required=True,
+                        help="Dataset directory to write.")
+    parser.add_argument("--date",
+                        help="Date (YYYY-MM-DD) of files without one in their name.")
+    args = parser.parse_args()
+
+    date = datetime.strptime(args.date, '%Y-%m-%d').date() if args.date else None
+    manifest = export(args.files, args.output, date)
+    print('Exported {0} pings to {1}: {2}'.format(manifest['pings'], args.output, manifest['intensity_groups']))
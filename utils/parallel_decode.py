@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+''' Decodes PingViewer sensor log files in parallel on a process pool. Whole files are shared out across the
+workers, and large files are split into chunks at record boundaries, so that a single multi-GB log also uses every
+core. Decoded messages are returned to the caller in timestamp order. '''
+
+import os
+import re
+import struct
+import heapq
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Set
+from decode_sensor_binary import PingViewerLogReader, PingViewerLogIndex, PingFrame
+
+# Files larger than this are split into chunks of about this size [bytes]
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+# ping360_YYYYMMDD_HHMMSS.bin or, with several sonars, ping360_<device name>_YYYYMMDD_HHMMSS.bin, as written by
+# Ping360Logger
+LOG_FILE_NAME_FORMAT = re.compile(r'ping360_(?:[^/\\]+_)?(\d{8}_\d{6})\.bin$')
+
+
+@dataclass
+class DecodedMessage:
+    ''' A decoded device_data/auto_device_data (or other) message, in a form that can be returned from a worker '''
+    filename: str
+    offset: int  # of the record in the file
+    timestamp: str  # hh:mm:ss.xxx, null bytes removed
+    time: float  # seconds since midnight of the day the file was started, increasing across midnight
+    message_id: int
+    angle: int = PingViewerLogIndex.NO_ANGLE
+    gain_setting: int = 0
+    transmit_duration: int = 0
+    sample_period: int = 0
+    transmit_frequency: int = 0
+    number_of_samples: int = 0
+    data: bytes = b''
+
+
+@dataclass
+class DecodeTask:
+    ''' Decode the records which start in [start, end) of a file '''
+    filename: str
+    start: int
+    end: int
+    start_time: float  # time of day of the file's first record, for detecting midnight
+
+
+def find_record_start(reader: PingViewerLogReader, buffer, position: int):
+    ''' Returns the offset of the first complete record starting at or after 'position', using the same timestamp
+    search as PingViewerLogReader.recover(). A candidate timestamp is only accepted if it is preceded by its own
+    size and followed by a valid Ping message, as sample data can contain timestamp-like bytes. Returns the buffer
+    length if there is no record after 'position'. '''
+    uint_size = reader.UINT.size
+    position = max(position, uint_size)
+    while (match := reader.TIMESTAMP_FORMAT.search(buffer, position)):
+        record_offset = match.start() - uint_size
+        try:
+            timestamp_size = reader.UINT.unpack_from(buffer, record_offset)[0]
+            message, _ = reader.unpack_array_at(buffer, match.end())
+        except struct.error:
+            break  # ran out of file
+        if timestamp_size == match.end() - match.start() and message is not None and \
+                PingFrame.decode_at(message, 0) is not None:
+            return record_offset
+        position = match.start() + 1
+    return len(buffer)
+
+
+def decode_task(task: DecodeTask, message_ids: Set[int]) -> List[DecodedMessage]:
+    ''' Worker: decodes the records of one task '''
+    reader = PingViewerLogReader(task.filename)
+    messages = []
+    with reader.mapped() as buffer:
+        for offset, timestamp, message, _ in reader.records_at(buffer, task.start):
+            if offset >= task.end:
+                break
+            frame = PingFrame.decode(message)
+            if frame is None or frame.message_id not in message_ids:
+                continue
+
+            timestamp = reader.decode_timestamp(timestamp).replace('\x00', '')
+            time = PingViewerLogIndex.parse_time(timestamp)
+            if time < task.start_time - PingViewerLogIndex.SECONDS_PER_DAY / 2:
+                time += PingViewerLogIndex.SECONDS_PER_DAY  # recorded after midnight
+
+            decoded = DecodedMessage(task.filename, offset, timestamp, time, frame.message_id)
+            if hasattr(frame, 'data'):
+                for attr in ('angle', 'gain_setting', 'transmit_duration', 'sample_period', 'transmit_frequency',
+                             'number_of_samples'):
+                    setattr(decoded, attr, getattr(frame, attr))
+                decoded.data = bytes(frame.data)
+            messages.append(decoded)
+    return messages
+
+
+@lru_cache(maxsize=None)
+def file_day(filename: str):
+    ''' Returns the day ordinal of the file's date, from the Ping360Logger file name format, or 0 '''
+    match = LOG_FILE_NAME_FORMAT.search(filename)
+    return datetime.strptime(match.group(1)[:8], '%Y%m%d').toordinal() if match else 0
+
+
+def file_start(filename: str):
+    ''' Returns the (date, time of day) of the file's first record. The date is taken from the file name if it has
+    the Ping360Logger format, otherwise None. '''
+    match = LOG_FILE_NAME_FORMAT.search(filename)
+    date = datetime.strptime(match.group(1), '%Y%m%d_%H%M%S').date() if match else None
+
+    reader = PingViewerLogReader(filename)
+    for _, timestamp, _ in reader.records():
+        return date, PingViewerLogIndex.parse_time(reader.decode_timestamp(timestamp))
+    return date, 0.0
+
+
+def plan_tasks(filenames: List[str], chunk_size: int = DEFAULT_CHUNK_SIZE):
+    ''' Splits the files into tasks. Returns a list per file, with the files sorted by their start date & time
+    (files without a date in their name keep their given order, after those with one). '''
+    files = []
+    for order, filename in enumerate(filenames):
+        date, start_time = file_start(filename)
+        sort_key = (date is None, date.toordinal() if date else order, start_time)
+        files.append((sort_key, filename, start_time))
+    files.sort()
+
+    file_tasks = []
+    for _, filename, start_time in files:
+        size = os.path.getsize(filename)
+        reader = PingViewerLogReader(filename)
+        boundaries = [0]
+        if size > chunk_size:
+            with reader.mapped() as buffer:
+                for position in range(chunk_size, size, chunk_size):
+                    boundary = find_record_start(reader, buffer, max(position, boundaries[-1] + 1))
+                    if boundary >= size:
+                        break
+                    boundaries.append(boundary)
+        boundaries.append(size)
+        file_tasks.append([DecodeTask(filename, start, end, start_time)
+                           for start, end in zip(boundaries[:-1], boundaries[1:]) if start < end])
+    return file_tasks
+
+
+def decode_parallel(filenames: List[str], workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    message_ids: Set[int] = {1300, 2300, 2301}):
+    ''' Returns a generator of DecodedMessage for all the files, in timestamp order. All tasks are submitted to a
+    pool of 'workers' processes (default: one per core) straight away, and their results merged as they are
+    consumed. Messages from files which overlap in time are interleaved by time. '''
+    file_tasks = plan_tasks(filenames, chunk_size)
+
+    with ProcessPoolExecutor(workers) as executor:
+        file_futures = [[executor.submit(decode_task, task, message_ids) for task in tasks]
+                        for tasks in file_tasks]
+
+        def file_messages(futures):
+            for future in futures:
+                yield from future.result()
+
+        # Files are sorted by date, then within a day messages are merged by time
+        yield from heapq.merge(*(file_messages(futures) for futures in file_futures),
+                               key=lambda message: (file_day(message.filename) == 0,
+                                                    file_day(message.filename), message.time))
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    # Parse arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs='+',
+                        help="PingViewer sensor log files to decode.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes, default one per core.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Files larger than this [bytes] are split into chunks.")
+    args = parser.parse_args()
+
+    count = 0
+    for message in decode_parallel(args.files, args.workers, args.chunk_size):
+        count += 1
+    print('Decoded {0} messages'.format(count))
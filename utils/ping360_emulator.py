@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+''' Emulates a Ping360 sonar over UDP, and optionally over a pseudo-terminal for the serial port path, so that
+iPing360Device can be run and its throughput measured without the hardware.
+
+Responds to:
+    general_request for protocol_version, device_information and device_data (brping's initialize())
+    control_transducer: moves the head to the angle and, if transmit is set, pings and replies with device_data
+    auto_transmit: sweeps the sector, streaming auto_device_data, until motor_off or another command
+    motor_off: stops an auto transmit sweep, replies with ack
+and replies with a nack to invalid settings and unsupported messages. Commands are carried out one at a time, each
+taking the time to step the head to its angle plus the ping time for the range. The head steps the shorter way
+round, or always clockwise (--head-route clockwise) to emulate a head which does not. Replies can be delayed by a fixed
+latency and random jitter, and dropped at random to simulate packet loss. Intensities are synthetic: a range
+dependent decay, a few point targets, a circular wall and noise. '''
+
+import asyncio
+import math
+import os
+import random
+import struct
+import tty
+from brping import PingParser, PingMessage, definitions
+
+SAMPLE_PERIOD_TICK = 25e-9  # [s]
+SPEED_OF_SOUND = 1500.0  # [m/s], used to place the synthetic targets
+GRADIANS_PER_REVOLUTION = 400
+PING_HEADER = struct.Struct('<2sHHBB')  # start, payload length, message id, source & destination device ids
+
+
+class Ping360Emulator():
+    ''' Protocol handler of the emulated sonar. Bytes from the app are passed to receive() with the function which
+    sends replies back over the same transport. '''
+
+    def __init__(self, step_ms=1.0, processing_ms=2.0, latency_ms=0.0, jitter_ms=0.0, loss=0.0, num_targets=5,
+                 wall_range=30.0, noise=20, seed=0, head_route='shortest'):
+        self.step_time = step_ms / 1000  # per gradian
+        self.head_route = head_route  # 'shortest' or 'clockwise'
+        self.processing_time = processing_ms / 1000
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.loss = loss
+        self.noise = noise
+        self.wall_range = wall_range
+        self.rng = random.Random(seed)
+        # (range [m], angle [gradians]) of point targets
+        self.targets = [(self.rng.uniform(1, wall_range), self.rng.randrange(GRADIANS_PER_REVOLUTION))
+                        for _ in range(num_targets)]
+
+        self.parser = PingParser()
+        self.send = None # replies to the transport of the last command received
+        self.loop = None
+        self.head_angle = 0
+        self.busy_until = 0.0  # loop time at which the current command completes
+        self.last_device_data = None
+        self.auto_transmit_task = None
+        self.stats = {'commands': 0, 'pings': 0, 'nacks': 0, 'dropped': 0}
+
+    async def start_udp(self, host='0.0.0.0', port=12345):
+        ''' Serves UDP on host:port, replying to the sender of each command. Returns the bound port. '''
+        self.loop = asyncio.get_running_loop()
+        emulator = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, address):
+                emulator.receive(data, lambda reply: self.transport.sendto(reply, address))
+
+        transport, _ = await self.loop.create_datagram_endpoint(Protocol, local_addr=(host, port))
+        return transport.get_extra_info('sockname')[1]
+
+    def start_pty(self):
+        ''' Serves a pseudo-terminal. Returns the path of its slave device, to be used as the app's serial_port. '''
+        self.loop = asyncio.get_running_loop()
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        send = lambda data: os.write(master, data)
+        self.loop.add_reader(master, lambda: self.receive(os.read(master, 4096), send))
+        self.pty_slave = slave  # kept open, so the pty stays valid between app connections
+        return os.ttyname(slave)
+
+    def receive(self, data, send):
+        self.send = send
+        for byte in data:
+            if self.parser.parse_byte(byte) == PingParser.NEW_MESSAGE:
+                self.handle(self.parser.rx_msg)
+
+    def reply(self, message, send_time=None):
+        ''' Sends a message (a PingMessage or packed bytes) at send_time (loop time, default now), after the link
+        latency & jitter, unless it is lost '''
+        if self.loss and self.rng.random() < self.loss:
+            self.stats['dropped'] += 1
+            return
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        send_time = (send_time or self.loop.time()) + delay
+        if isinstance(message, PingMessage):
+            message = bytes(message.pack_msg_data())
+        self.loop.call_at(send_time, self.send, message)
+
+    def nack(self, message_id, text):
+        self.stats['nacks'] += 1
+        # Packed here, as brping cannot construct a nack PingMessage with its variable length nack_message
+        payload = struct.pack('<H', message_id) + text.encode() + b'\x00'
+        nack = PING_HEADER.pack(b'BR', len(payload), definitions.COMMON_NACK, 0, 0) + payload
+        self.reply(nack + struct.pack('<H', sum(nack) & 0xffff))
+
+    def handle(self, message):
+        self.stats['commands'] += 1
+        if message.message_id == definitions.COMMON_GENERAL_REQUEST:
+            self.handle_request(message.requested_id)
+            return
+
+        # Any command other than a request stops an auto transmit sweep
+        if self.auto_transmit_task is not None:
+            self.auto_transmit_task.cancel()
+            self.auto_transmit_task = None
+            self.busy_until = self.loop.time()
+
+        if message.message_id == definitions.PING360_TRANSDUCER:
+            error = self.check_settings(message)
+            if error:
+                self.nack(message.message_id, error)
+            elif message.angle >= GRADIANS_PER_REVOLUTION:
+                self.nack(message.message_id, 'Invalid angle')
+            else:
+                ping_time, device_data = self.ping(definitions.PING360_DEVICE_DATA, message, message.angle,
+                                                   message.transmit)
+                self.last_device_data = device_data
+                self.reply(device_data, ping_time)
+        elif message.message_id == definitions.PING360_AUTO_TRANSMIT:
+            error = self.check_settings(message)
+            if error or message.start_angle >= GRADIANS_PER_REVOLUTION or \
+                    message.stop_angle >= GRADIANS_PER_REVOLUTION or not 1 <= message.num_steps <= 10:
+                self.nack(message.message_id, error or 'Invalid sector')
+            else:
+                self.auto_transmit_task = self.loop.create_task(self.auto_transmit(message))
+        elif message.message_id == definitions.PING360_MOTOR_OFF:
+            ack = PingMessage(definitions.COMMON_ACK)
+            ack.acked_id = message.message_id
+            self.reply(ack, max(self.loop.time(), self.busy_until))
+        else:
+            self.nack(message.message_id, 'Unsupported message')
+
+    def handle_request(self, requested_id):
+        if requested_id == definitions.COMMON_PROTOCOL_VERSION:
+            reply = PingMessage(definitions.COMMON_PROTOCOL_VERSION)
+            reply.version_major, reply.version_minor, reply.version_patch, reply.reserved = 1, 0, 0, 0
+        elif requested_id == definitions.COMMON_DEVICE_INFORMATION:
+            reply = PingMessage(definitions.COMMON_DEVICE_INFORMATION)
+            reply.device_type, reply.device_revision = 2, 1
+            reply.firmware_version_major, reply.firmware_version_minor, reply.firmware_version_patch = 3, 3, 0
+            reply.reserved = 0
+        elif requested_id == definitions.PING360_DEVICE_DATA:
+            reply = self.last_device_data
+            if reply is None:
+                reply = PingMessage(definitions.PING360_DEVICE_DATA)
+                reply.mode, reply.gain_setting, reply.angle, reply.transmit_duration = 1, 1, self.head_angle, 32
+                reply.sample_period, reply.transmit_frequency, reply.number_of_samples = 80, 740, 200
+                reply.data = bytearray(200)
+        else:
+            self.nack(definitions.COMMON_GENERAL_REQUEST, 'Unsupported request')
+            return
+        self.reply(reply)
+
+    @staticmethod
+    def check_settings(message):
+        ''' Returns an error message if the transducer settings are invalid, otherwise '' '''
+        if message.gain_setting > 2:
+            return 'Invalid gain'
+        if not 1 <= message.number_of_samples <= 1200:
+            return 'Invalid number of samples'
+        if not 500 <= message.transmit_frequency <= 1000:
+            return 'Invalid transmit frequency'
+        if message.sample_period < 1:
+            return 'Invalid sample period'
+        return ''
+
+    def ping(self, message_id, settings, angle, transmit=True):
+        ''' Moves the head to the angle and pings (if transmit). Returns the loop time at which the ping completes
+        and its device_data or auto_device_data message. '''
+        start_time = max(self.loop.time(), self.busy_until)
+        step = (angle - self.head_angle) % GRADIANS_PER_REVOLUTION
+        if self.head_route == 'shortest':
+            step = min(step, GRADIANS_PER_REVOLUTION - step)
+        duration = step * self.step_time + self.processing_time
+        if transmit:
+            duration += settings.transmit_duration * 1e-6 + \
+                        settings.sample_period * SAMPLE_PERIOD_TICK * settings.number_of_samples
+            self.stats['pings'] += 1
+        self.head_angle = angle
+        self.busy_until = start_time + duration
+
+        reply = PingMessage(message_id)
+        for field in ('gain_setting', 'transmit_duration', 'sample_period', 'transmit_frequency',
+                      'number_of_samples'):
+            setattr(reply, field, getattr(settings, field))
+        reply.mode = 1
+        reply.angle = angle
+        if message_id == definitions.PING360_AUTO_DEVICE_DATA:
+            reply.start_angle, reply.stop_angle = settings.start_angle, settings.stop_angle
+            reply.num_steps, reply.delay = settings.num_steps, settings.delay
+        reply.data = self.returns(angle, settings.sample_period, settings.number_of_samples) if transmit else \
+            bytearray(settings.number_of_samples)
+        return self.busy_until, reply
+
+    def returns(self, angle, sample_period, number_of_samples):
+        ''' Synthetic intensities of a ping at the angle '''
+        sample_range = sample_period * SAMPLE_PERIOD_TICK * SPEED_OF_SOUND / 2  # [m] per sample
+        data = [int(150 * math.exp(-i * sample_range / 2)) for i in range(number_of_samples)]
+
+        echoes = list(self.targets)
+        echoes.append((self.wall_range, angle))
+        for target_range, target_angle in echoes:
+            angle_error = min((angle - target_angle) % GRADIANS_PER_REVOLUTION,
+                              (target_angle - angle) % GRADIANS_PER_REVOLUTION)
+            sample = int(target_range / sample_range)
+            if angle_error <= 2 and sample < number_of_samples:
+                for i in range(max(0, sample - 2), min(number_of_samples, sample + 3)):
+                    data[i] += 200 - 40 * angle_error
+
+        # Random.randbytes() needs Python 3.9
+        noise = self.rng.getrandbits(8 * number_of_samples).to_bytes(number_of_samples, 'little')
+        return bytearray(min(255, value + noise[i] * self.noise // 256) for i, value in enumerate(data))
+
+    @staticmethod
+    def device_data(auto_device_data):
+        ''' Returns the device_data message reporting the state of the sonar after an auto transmit ping '''
+        device_data = PingMessage(definitions.PING360_DEVICE_DATA)
+        for field in ('mode', 'gain_setting', 'angle', 'transmit_duration', 'sample_period', 'transmit_frequency',
+                      'number_of_samples', 'data'):
+            setattr(device_data, field, getattr(auto_device_data, field))
+        return device_data
+
+    async def auto_transmit(self, settings):
+        ''' Sweeps back and forth across the sector, streaming a ping at every num_steps gradians '''
+        start, stop, num_steps = settings.start_angle, settings.stop_angle, settings.num_steps
+        sector = (stop - start) % GRADIANS_PER_REVOLUTION
+        position, direction = 0, 1
+        while True:
+            angle = (start + position) % GRADIANS_PER_REVOLUTION
+            ping_time, auto_device_data = self.ping(definitions.PING360_AUTO_DEVICE_DATA, settings, angle)
+            self.last_device_data = self.device_data(auto_device_data)
+            self.reply(auto_device_data, ping_time)
+            await asyncio.sleep(max(0.0, ping_time - self.loop.time()))
+
+            if not 0 <= position + direction * num_steps <= sector:
+                direction = -direction
+            position = max(0, min(sector, position + direction * num_steps))
+
+
+async def main(args):
+    emulator = Ping360Emulator(args.step_ms, args.processing_ms, args.latency_ms, args.jitter_ms, args.loss,
+                               args.targets, args.wall_range, args.noise, args.seed, args.head_route)
+    port = await emulator.start_udp(args.host, args.port)
+    print('Ping360 emulator listening on UDP {0}:{1}'.format(args.host, port))
+    if args.pty:
+        print('Ping360 emulator serial port: {0}'.format(emulator.start_pty()))
+
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval or 3600)
+            if args.stats_interval:
+                print(emulator.stats)
+    finally:
+        print(emulator.stats)
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    # Parse arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default='0.0.0.0',
+                        help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=12345,
+                        help="UDP port, the app's udp_port.")
+    parser.add_argument("--pty", action='store_true',
+                        help="Also serve a pseudo-terminal, for testing the serial port_type.")
+    parser.add_argument("--step-ms", type=float, default=1.0,
+                        help="Time for the head to step one gradian [ms].")
+    parser.add_argument("--head-route", choices=['shortest', 'clockwise'], default='shortest',
+                        help="Way round the head steps to a new angle.")
+    parser.add_argument("--processing-ms", type=float, default=2.0,
+                        help="Fixed time per command, in addition to stepping and pinging [ms].")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="Delay before each reply is sent [ms].")
+    parser.add_argument("--jitter-ms", type=float, default=0.0,
+                        help="Maximum random delay added to the latency [ms].")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="Probability of each reply being dropped (0-1).")
+    parser.add_argument("--targets", type=int, default=5,
+                        help="Number of synthetic point targets.")
+    parser.add_argument("--wall-range", type=float, default=30.0,
+                        help="Range of the synthetic circular wall [m].")
+    parser.add_argument("--noise", type=int, default=20,
+                        help="Maximum intensity of the synthetic noise (0-255).")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed, for reproducible targets, noise, jitter and loss.")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="Print the message counts every N seconds.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+''' Renders every sector sweep of a PingViewer sensor log as a colour sonar image, written as PNG files or as the
+frames of a video. Sweeps are found with the log's index and rendered in a pool of worker processes, with the
+polar remap tables and colormap lookup table of sonar_render. Only a bounded number of frames are in flight at
+once, so memory use does not grow with the length of the log. '''
+
+import os
+import numpy as np
+import cv2 as cv
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from decode_sensor_binary import PingViewerLogReader
+from sonar_render import render_sector, jet_lut, apply_colormap
+
+# Frames in flight per worker, bounds the memory used by pending results
+FRAMES_PER_WORKER = 2
+
+
+def sweep_tasks(log: PingViewerLogReader):
+    ''' Yields (sweep number, record offsets) for each sweep in the log '''
+    index = log.index()
+    for sweep, entries in groupby(zip(index.sweeps, index.offsets, index.angles),
+                                  key=lambda entry: entry[0]):
+        offsets = [offset for _, offset, angle in entries if angle != index.NO_ANGLE]
+        if offsets:
+            yield sweep, offsets
+
+
+def render_sweep(filename, sweep, offsets, size, output_dir=None):
+    ''' Worker: renders one sweep. Writes it to output_dir as sweep_<number>.png and returns the file name if
+    output_dir is given, otherwise returns the BGR frame. '''
+    log = PingViewerLogReader(filename)
+    intensities = None
+    for _, frame in log.frames_at(offsets, {2300, 2301}):
+        if intensities is None:
+            intensities = np.zeros((400, len(frame.data)), dtype=np.uint8)
+        # Pings after a change of the number of samples mid sweep are skipped
+        if len(frame.data) == intensities.shape[1]:
+            intensities[frame.angle] = frame.data
+    if intensities is None:
+        return None
+
+    image = render_sector(intensities, size)
+    frame = apply_colormap(image, jet_lut())
+    if output_dir is None:
+        return frame
+
+    file_name = os.path.join(output_dir, 'sweep_{0:06d}.png'.format(sweep))
+    cv.imwrite(file_name, frame)
+    return file_name
+
+
+def render_log(filename, size=800, output_dir=None, video_file=None, fps=5.0, workers=None):
+    ''' Renders each sweep of the log to PNGs in output_dir, or to video_file. Returns the number of frames. '''
+    log = PingViewerLogReader(filename)
+    workers = workers or os.cpu_count()
+    writer = None
+    if video_file is not None:
+        writer = cv.VideoWriter(video_file, cv.VideoWriter_fourcc(*'mp4v'), fps, (size, size))
+        output_dir = None
+
+    frames = 0
+    pending = deque()
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            def write_next():
+                result = pending.popleft().result()
+                if writer is not None and result is not None:
+                    writer.write(result)
+                return result is not None
+
+            for sweep, offsets in sweep_tasks(log):
+                pending.append(executor.submit(render_sweep, filename, sweep, offsets, size, output_dir))
+                # Frames are written in order, waiting for the oldest when the window is full
+                if len(pending) >= workers * FRAMES_PER_WORKER:
+                    frames += write_next()
+            while pending:
+                frames += write_next()
+    finally:
+        if writer is not None:
+            writer.release()
+    return frames
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    # Parse arguments
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("file",
+                        help="File that contains PingViewer sensor log file.")
+    parser.add_argument("--output-dir", default='./',
+                        help="Directory for the sweep PNG files.")
+    parser.add_argument("--video",
+                        help="Write the sweeps to this video file (mp4) instead of PNG files.")
+    parser.add_argument("--size", type=int, default=800,
+                        help="Image width & height [pixels].")
+    parser.add_argument("--fps", type=float, default=5.0,
+                        help="Video frame rate.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes, default one per core.")
+    args = parser.parse_args()
+
+    if args.video is None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    frames = render_log(args.file, args.size, args.output_dir, args.video, args.fps, args.workers)
+    print('Rendered {0} sweeps'.format(frames))
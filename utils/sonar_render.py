@@ -0,0 +1,79 @@
+''' Renders sector scans (an angles x samples intensity matrix) as Cartesian sonar images.
+
+The polar to Cartesian mapping only depends on the matrix and image geometry, so it is computed once into a lookup
+table, cached, and each sweep is then rendered with a single gather from the intensity matrix. Only NumPy is
+required, so the module can be used by the live app as well as by the offline tools.
+'''
+
+import numpy as np
+from functools import lru_cache
+
+GRADIANS_PER_REVOLUTION = 400
+# Rotation which reproduces the orientation of the previous cv.warpPolar rendering: 0 gradians (the sonar's forward
+# direction) points down the image, and angles increase clockwise
+DEFAULT_ANGLE_OFFSET_GRADS = 100
+
+
+@lru_cache(maxsize=32)
+def remap_table(num_samples, size, angle_offset_grads=DEFAULT_ANGLE_OFFSET_GRADS, sector=None,
+                num_angles=GRADIANS_PER_REVOLUTION):
+    ''' Returns (indices, outside) for a size x size image of a num_angles x num_samples matrix. 'indices' holds,
+    for each pixel, the index into the flattened matrix of the nearest sample; 'outside' lists the pixels beyond
+    the maximum range or outside 'sector', a (start, stop) pair of gradians defining a clockwise sector.
+    Tables are cached, keyed by all the arguments. '''
+    radius = size / 2
+    y, x = np.mgrid[0:size, 0:size]
+    dx = x + 0.5 - radius
+    dy = y + 0.5 - radius
+
+    # Image y is down, so increasing atan2 angles are clockwise on the image
+    angle_grads = np.arctan2(dy, dx) * (GRADIANS_PER_REVOLUTION / (2 * np.pi))
+    angle_grads = (angle_grads - angle_offset_grads) % GRADIANS_PER_REVOLUTION
+    rows = (angle_grads * num_angles / GRADIANS_PER_REVOLUTION).astype(np.int64) % num_angles
+    samples = (np.hypot(dx, dy) * num_samples / radius).astype(np.int64)
+
+    outside = samples >= num_samples
+    if sector is not None:
+        start, stop = sector
+        # Angle of each pixel clockwise from the sector start, compared with the sector's extent
+        outside |= (rows - start) % num_angles > (stop - start) % num_angles
+
+    indices = rows * num_samples + np.minimum(samples, num_samples - 1)
+    indices = indices.ravel().astype(np.intp)
+    outside = np.flatnonzero(outside)
+    indices.setflags(write=False)
+    outside.setflags(write=False)
+    return indices, outside
+
+
+def render_sector(intensities, size, angle_offset_grads=DEFAULT_ANGLE_OFFSET_GRADS, sector=None, out=None):
+    ''' Returns a size x size uint8 image of 'intensities' (an angles x samples matrix, indexed by angle in
+    gradians). 'out' may be a preallocated image to render into. The matrix is not copied or rearranged. '''
+    num_angles, num_samples = intensities.shape
+    indices, outside = remap_table(num_samples, size, angle_offset_grads, sector, num_angles)
+    if out is None:
+        out = np.empty((size, size), dtype=intensities.dtype)
+
+    flat_out = out.reshape(-1)
+    np.take(intensities.reshape(-1), indices, out=flat_out)
+    flat_out[outside] = 0
+    return out
+
+
+@lru_cache(maxsize=8)
+def jet_lut(bgr=True):
+    ''' Returns a 256 x 3 uint8 lookup table of the 'jet' colormap, in BGR order for OpenCV unless bgr is False.
+    Computed from the usual piecewise linear approximation of matplotlib's jet, so matplotlib is not needed. '''
+    x = np.linspace(0, 1, 256)
+    red = np.clip(np.minimum(4 * x - 1.5, -4 * x + 4.5), 0, 1)
+    green = np.clip(np.minimum(4 * x - 0.5, -4 * x + 3.5), 0, 1)
+    blue = np.clip(np.minimum(4 * x + 0.5, -4 * x + 2.5), 0, 1)
+    channels = (blue, green, red) if bgr else (red, green, blue)
+    lut = np.round(np.stack(channels, axis=1) * 255).astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+
+def apply_colormap(image, lut, out=None):
+    ''' Returns the (height, width, 3) colour image of a uint8 'image', with one gather through the 'lut' '''
+    return np.take(lut, image, axis=0, out=out)
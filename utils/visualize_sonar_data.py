@@ -1,10 +1,9 @@
 from decode_sensor_binary import PingViewerLogReader
+from sonar_render import render_sector
 from matplotlib import pyplot as plt
 from argparse import ArgumentParser
 from datetime import datetime
 import numpy as np
-import cv2 as cv
-import copy
 import os
 import re
 
@@ -16,8 +15,6 @@ rcParams['font.family'] = 'serif'
 
 start_time = "00:10:00.000"
 
-start_time_obj = datetime.strptime(start_time,"%H:%M:%S.%f")
-
 #Create directory for saving images
 date_time = datetime.strftime(datetime.now(), '%Y%m%d_%H%M%S')
 folder_name = f"""sonar_data_plots_{date_time}"""
@@ -45,14 +42,10 @@ if __name__ == "__main__":
     scan_num = 0
     start_timestamp = ""
 
-    for index, (timestamp, decoded_message) in enumerate(log.parser()):
+    # Skip to start time using the log's index
+    for index, (timestamp, decoded_message) in enumerate(log.time_window(start_time)):
 
         timestamp = re.sub(r"\x00", "", timestamp) # Strip any extra \0x00 (null bytes)
-        time_obj = datetime.strptime(timestamp,"%H:%M:%S.%f")
-
-        # Skip to start time
-        if time_obj < start_time_obj:
-            continue
 
         # Save timestamp of start of each scan
         if start_timestamp == "":
@@ -73,16 +66,9 @@ if __name__ == "__main__":
             scan_num += 1
             print('Last timestamp',timestamp)
 
-            # Rearrange sector_intensities matrix to match warp co-ordinates (0 is towards right)
-            sector_intensities_copy = copy.deepcopy(sector_intensities)
-            sector_intensities[0:100] = sector_intensities_copy[300:400]
-            sector_intensities[100:400] = sector_intensities_copy[0:300]
-
-            # Warp intensities matrix into circular image
+            # Warp intensities matrix into circular image, using the cached remap table
             radius = int(400 / (2 * np.pi))
-            warp_flags = flags = cv.WARP_INVERSE_MAP + cv.WARP_POLAR_LINEAR + cv.WARP_FILL_OUTLIERS + cv.INTER_LINEAR
-            warped = cv.warpPolar(sector_intensities, center=(radius, radius), maxRadius=radius, dsize=(2 * radius, 2 * radius),
-                                   flags=warp_flags)
+            warped = render_sector(sector_intensities, 2 * radius)
 
             # Display images
             fig = plt.figure()
@@ -97,6 +83,7 @@ if __name__ == "__main__":
             plt.imshow(warped, interpolation='bilinear',cmap='jet')
             #plt.show()
             plt.savefig(os.path.join(img_save_path, suptitle))
+            plt.close(fig)
 
             start_timestamp = ""
 